@@ -5,11 +5,14 @@ from datetime import datetime as dt
 import geopandas as gpd
 from shapely.geometry import Polygon
 import configparser
-from zipfile import ZipFile
 import re
 import xml.etree.ElementTree as ET
 import pandas as pd
 import geopandas as gpd
+import fcntl
+from contextlib import contextmanager
+
+from .remote_zip import open_zip
 
 
 ##function to clean up temporary elements
@@ -21,6 +24,16 @@ def remove(path):
     elif os.path.isdir(path):
         shutil.rmtree(path)  # remove dir and all contains
 
+## exclusive lock on a sidecar file, e.g. while updating shared outputs
+@contextmanager
+def file_lock(path):
+    with open(path.rstrip("/") + ".lock", "w") as lockf:
+        fcntl.flock(lockf, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockf, fcntl.LOCK_UN)
+
 ## return dictonary from config file
 def get_config(config_file, proc_section):
     if not os.path.isfile(config_file):
@@ -41,6 +54,21 @@ def get_config(config_file, proc_section):
                 v = True
         if k == 'processes':
             v = int(v)
+        if k == 'burst_filter':
+            if v.lower() == 'true':
+                v = True
+            elif v.lower() == 'false':
+                v = False
+        if k == 'partial':
+            if v.lower() == 'true':
+                v = True
+            elif v.lower() == 'false':
+                v = False
+        if k == 'stream':
+            if v.lower() == 'true':
+                v = True
+            elif v.lower() == 'false':
+                v = False
         if k.endswith('date'):
             v = proc_sec.get_datetime(k)
         if k == 'int_proc':
@@ -58,6 +86,11 @@ def get_config(config_file, proc_section):
                 v = True
             elif v.lower() == 'false':
                 v = False
+        if k == 'preview_proc':
+            if v.lower() == 'true':
+                v = True
+            elif v.lower() == 'false':
+                v = False
         if k == 'ext_dem_egm':
             if v.lower() == 'true':
                 v = True
@@ -88,6 +121,31 @@ def get_config(config_file, proc_section):
                 v = True
             elif v.lower() == 'false':
                 v = False
+        if k == 'out_cube':
+            if v.lower() == 'true':
+                v = True
+            elif v.lower() == 'false':
+                v = False
+        if k == 'out_stac':
+            if v.lower() == 'true':
+                v = True
+            elif v.lower() == 'false':
+                v = False
+        if k == 'grid_align':
+            if v.lower() == 'true':
+                v = True
+            elif v.lower() == 'false':
+                v = False
+        if k == 'native_postproc':
+            if v.lower() == 'true':
+                v = True
+            elif v.lower() == 'false':
+                v = False
+        if k == 'mt_speckle':
+            if v.lower() == 'true':
+                v = True
+            elif v.lower() == 'false':
+                v = False
         if k == 'l2db_arg':
             if v.lower() == 'true':
                 v = True
@@ -95,6 +153,24 @@ def get_config(config_file, proc_section):
                 v = False
         if k == 't_crs':
             v = int(v)
+        if k == 'postproc_threads':
+            v = int(v)
+        if k == 'native_threads':
+            v = int(v)
+        if k == 'mt_win_size':
+            v = int(v)
+        if k == 'orbit_tolerance':
+            v = float(v)
+        if k == 'watch_interval':
+            v = int(v)
+        if k == 'stage_gb':
+            v = float(v)
+        if k == 'store_gb':
+            v = float(v)
+        if k == 'grid_origin_x':
+            v = float(v)
+        if k == 'grid_origin_y':
+            v = float(v)
         if k == 'cohwinrg':
             v = int(v)
         if k == 'cohwinaz':
@@ -117,6 +193,8 @@ def get_config(config_file, proc_section):
             v = int(v)
         if k == 'res_ha':
             v = int(v)
+        if k == 'res_preview':
+            v = int(v)
         if k == 'ext_dem_file':
             if v == "None":
                 v =  None
@@ -127,17 +205,62 @@ def get_config(config_file, proc_section):
                 v =  None
             else:
                 v = v
+        if k == 'geo_cache':
+            if v == "None":
+                v =  None
+            else:
+                v = v
+        if k == 'burst_cache':
+            if v == "None":
+                v =  None
+            else:
+                v = v
+        if k == 'search_cache':
+            if v == "None":
+                v =  None
+            else:
+                v = v
+        if k == 'search_ttl':
+            v = float(v)
+        if k == 'offline':
+            if v.lower() == 'true':
+                v = True
+            elif v.lower() == 'false':
+                v = False
+        if k == 'store_dir':
+            if v == "None":
+                v =  None
+            else:
+                v = v
+        if k == 'split_cache':
+            if v == "None":
+                v =  None
+            else:
+                v = v
+        if k == 'stage_dir':
+            if v == "None":
+                v =  None
+            else:
+                v = v
         if k == 'iws':
             v = v.split(',')
-        out_dict[k] = v
         if k == 'decompfeats':
             v = v.split(',')
-        out_dict[k] = v
         if k == 'gpt_paras':
             if v == "None":
                 v =  None
-            else:
+            elif v != "auto":
                 v = v.split(',')
+        if k == 'gpt_workers':
+            v = int(v)
+        if k == 'admission_wait':
+            v = int(v)
+        if k == 'admission':
+            if v.lower() == 'true':
+                v = True
+            elif v.lower() == 'false':
+                v = False
+        out_dict[k] = v
     return out_dict
 ##get datetime from strings such as filenames
 def _parse_datetime(s):
@@ -192,8 +315,14 @@ def group_by_info(infiles, group= None):
     return(out_files)
 ## get metadata from zip file for specific polarization and subswaths
 def load_metadata(zip_path, subswath, polarization):
-    archive = ZipFile(zip_path)
-    archive_files = archive.namelist()
+    ##unpacked or partially downloaded .SAFE folder
+    if os.path.isdir(zip_path):
+        archive_files = [os.path.relpath(os.path.join(root, f), zip_path) for root, dirs, files in os.walk(os.path.join(zip_path, "annotation")) for f in files]
+        archive = None
+    else:
+        ##zip_path may also be a URL, only the central directory and the annotation are read then
+        archive = open_zip(zip_path)
+        archive_files = archive.namelist()
     regex_filter = r's1(?:a|b)-iw\d-slc-(?:vv|vh|hh|hv)-.*\.xml'
     metadata_file_list = []
     for item in archive_files:
@@ -206,6 +335,10 @@ def load_metadata(zip_path, subswath, polarization):
     for item in metadata_file_list:
         if subswath.lower() in item and polarization.lower() in item:
             target_file = item
+    if target_file is None:
+        raise RuntimeError(f'{zip_path} has no annotation of {subswath.upper()} {polarization.upper()}')
+    if archive is None:
+        return open(os.path.join(zip_path, target_file), "rb")
     return archive.open(target_file)
 ## get total number of bursts and their coordinates from metadata
 def parse_location_grid(metadata):
@@ -224,6 +357,19 @@ def parse_location_grid(metadata):
     total_num_bursts = len(set(lines)) - 1
 
     return total_num_bursts, coord_list
+## get ground control points of the geolocation grid from metadata
+def parse_gcps(metadata):
+    """ list of (pixel, line, longitude, latitude, height) of the geolocationGrid of an annotation file """
+    tree = ET.parse(metadata)
+    root = tree.getroot()
+    gcps = []
+    for grid_list in root.iter('geolocationGrid'):
+        for point in grid_list:
+            for item in point:
+                gcps.append((float(item.find('pixel').text), float(item.find('line').text),
+                             float(item.find('longitude').text), float(item.find('latitude').text),
+                             float(item.find('height').text)))
+    return gcps
 ## get subswath geometry from each burst
 def parse_subswath_geometry(coord_list, total_num_bursts):
     def get_coords(index, coord_list):
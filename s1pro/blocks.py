@@ -0,0 +1,115 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def box_sum(arr, win_x, win_y):
+    """[box_sum]
+    moving window sum over a centred win_y x win_x window with separable cumulative sums, windows are cut at the
+    array edges
+    Parameters
+    ----------
+        arr: numpy.ndarray
+            2D array, real or complex
+        win_x: int
+            window size along columns (range)
+        win_y: int
+            window size along rows (azimuth)
+        Returns
+        -------
+        numpy.ndarray of the shape of arr in float64 or complex128
+    """
+    dtype = np.complex128 if np.iscomplexobj(arr) else np.float64
+    out = np.asarray(arr, dtype=dtype)
+    for axis, win in [(0, win_y), (1, win_x)]:
+        if win <= 1:
+            continue
+        n = out.shape[axis]
+        ##cumulative sum with a leading zero, window i covers [i - win // 2, i + (win - 1) // 2]
+        csum = np.cumsum(out, axis=axis)
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (1, 0)
+        csum = np.pad(csum, pad)
+        idx = np.arange(n)
+        hi = np.minimum(idx + (win - 1) // 2 + 1, n)
+        lo = np.maximum(idx - win // 2, 0)
+        out = np.take(csum, hi, axis=axis) - np.take(csum, lo, axis=axis)
+    return out
+
+
+def box_mean(arr, win_x, win_y, valid= None):
+    """[box_mean]
+    moving window mean of box_sum, pixels outside the array or flagged invalid are not counted
+    Parameters
+    ----------
+        arr: numpy.ndarray
+            2D array, real or complex
+        win_x, win_y: int
+            window size along columns and rows
+        valid: numpy.ndarray or None
+            boolean mask of pixels to include, all pixels if None
+        Returns
+        -------
+        numpy.ndarray of the shape of arr, NaN where a window holds no valid pixel
+    """
+    if valid is None:
+        valid = np.ones(arr.shape, dtype=bool)
+    total = box_sum(np.where(valid, arr, 0), win_x, win_y)
+    count = box_sum(valid.astype(np.float64), win_x, win_y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def row_blocks(nrows, block_rows, halo= 0):
+    """[row_blocks]
+    split the rows of a raster into blocks that are extended by a halo for moving window filters
+    Parameters
+    ----------
+        nrows: int
+            number of rows of the raster
+        block_rows: int
+            number of output rows per block
+        halo: int
+            number of extra rows read above and below each block, default is 0
+        Returns
+        -------
+        list of tuples (row, n, read_row, read_n): output rows [row, row + n) are computed from the rows
+        [read_row, read_row + read_n), rows row - read_row of the result belong to the block
+    """
+    blocks = []
+    for row in range(0, nrows, block_rows):
+        n = min(block_rows, nrows - row)
+        read_row = max(row - halo, 0)
+        read_end = min(row + n + halo, nrows)
+        blocks.append((row, n, read_row, read_end - read_row))
+    return blocks
+
+
+def run_blocks(process, blocks, write, threads= 4):
+    """[run_blocks]
+    process blocks on a thread pool and hand the results to write in block order
+    Parameters
+    ----------
+        process: function
+            called with the items of a block tuple, runs in a worker thread
+        blocks: list
+            block tuples, e.g. of row_blocks
+        write: function
+            called with the block tuple and the result of process in the calling thread
+        threads: int
+            number of worker threads, default is 4
+        Note
+        ----
+        At most 2 * threads results are held in memory. NumPy and GDAL release the GIL in their heavy loops, so the
+        workers run in parallel without extra processes.
+    """
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = deque()
+        for block in blocks:
+            pending.append((block, pool.submit(process, *block)))
+            if len(pending) >= 2 * threads:
+                done, future = pending.popleft()
+                write(done, future.result())
+        while pending:
+            done, future = pending.popleft()
+            write(done, future.result())
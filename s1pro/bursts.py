@@ -0,0 +1,520 @@
+import os
+import json
+import math
+import sqlite3
+import hashlib
+import datetime
+import pandas as pd
+import geopandas as gpd
+import xml.etree.ElementTree as ET
+from osgeo import gdal
+from pyroSAR.snap.auxil import parse_recipe, parse_node, execute
+
+from .auxils import load_metadata, get_burst_geometry
+from .grid import align_terrain_correction
+from .resources import SLICE_BURSTS
+from .scheduler import admit_gpt
+
+
+##constants of the ESA burst ID definition: burst cycle, preamble and nominal orbit duration in seconds
+T_BEAM = 2.758273
+T_PRE = 2.299849
+T_ORB = 12 * 24 * 3600 / 175
+##absolute orbit number offset of the relative orbit count per platform
+_ORBIT_OFFSETS = {"S1A": 73, "S1B": 202, "S1C": 172}
+
+
+## parse annotation times, e.g. 2020-01-03T05:12:40.123456
+def _parse_time(s):
+    return datetime.datetime.strptime(s[:26], '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def parse_burst_ids(metadata):
+    """ list of ESA burst IDs of the bursts of an annotation file, e.g. t044_093117_iw1 """
+    root = ET.parse(metadata).getroot()
+    mission = root.find('adsHeader/missionId').text
+    subswath = root.find('adsHeader/swath').text.lower()
+    abs_orbit = int(root.find('adsHeader/absoluteOrbitNumber').text)
+    info = root.find('imageAnnotation/imageInformation')
+    anx = _parse_time(info.find('ascendingNodeTime').text)
+    az_interval = float(info.find('azimuthTimeInterval').text)
+    lines = int(root.find('swathTiming/linesPerBurst').text)
+    rel_orbit = (abs_orbit - _ORBIT_OFFSETS[mission]) % 175 + 1
+    ids = []
+    for burst in root.iter('burst'):
+        ##time of the burst centre since the ascending node of relative orbit 1
+        mid = _parse_time(burst.find('azimuthTime').text) + datetime.timedelta(seconds=lines * az_interval / 2)
+        dt_b = (mid - anx).total_seconds() + (rel_orbit - 1) * T_ORB
+        esa_id = 1 + int(math.floor((dt_b - T_PRE) / T_BEAM))
+        ##bursts after the next ascending node belong to the following track
+        track = int(dt_b // T_ORB) % 175 + 1
+        ids.append(f't{track:03d}_{esa_id:06d}_{subswath}')
+    return ids
+
+
+def burst_table(path, subswaths, polarization):
+    """[burst_table]
+    geometry and ESA burst ID of all bursts of a zipped SLC
+    Parameters
+    ----------
+        path: str
+            SLC zip file
+        subswaths: list
+            e.g. ["IW1", "IW2"]
+        polarization: str
+            e.g. "VV"
+        Returns
+        -------
+        geopandas.GeoDataFrame with columns subswath, burst (index in the scene starting at 1), burst_id, scene and
+        geometry
+    """
+    df = get_burst_geometry(path, target_subswaths= [x.lower() for x in subswaths], polarization= polarization)
+    ids = dict()
+    for subswath in subswaths:
+        for burst, burst_id in enumerate(parse_burst_ids(load_metadata(path, subswath, polarization)), 1):
+            ids[(subswath.upper(), burst)] = burst_id
+    df["burst_id"] = [ids[(s, b)] for s, b in zip(df["subswath"], df["burst"])]
+    df["scene"] = path
+    return df
+
+
+def aoi_bursts(scenes, subswaths, polarization, shapefile):
+    """[aoi_bursts]
+    bursts of the scenes of one date intersecting an AOI, each burst ID only once
+    Parameters
+    ----------
+        scenes: list
+            SLC zip files of one date, e.g. consecutive slices
+        subswaths: list
+            e.g. ["IW1", "IW2", "IW3"]
+        polarization: str
+            e.g. "VV"
+        shapefile: str
+            AOI
+        Returns
+        -------
+        geopandas.GeoDataFrame of burst_table sorted by burst ID
+    """
+    df = gpd.GeoDataFrame(pd.concat([burst_table(s, subswaths, polarization) for s in scenes]), crs='EPSG:4326')
+    polygon = gpd.read_file(shapefile).to_crs('EPSG:4326')
+    df = df[df.intersects(polygon.unary_union)]
+    return df.drop_duplicates("burst_id").sort_values("burst_id")
+
+
+def iw_burst_ids(scenes, subswaths, polarization, shapefile= None):
+    """[iw_burst_ids]
+    first and last ESA burst ID per subswath of the bursts of one date
+    Parameters
+    ----------
+        scenes: list
+            SLC zip files of one date
+        subswaths: list
+            e.g. ["IW1", "IW2", "IW3"]
+        polarization: str
+            e.g. "VV"
+        shapefile: str or None
+            AOI, all bursts of the scenes if None
+        Returns
+        -------
+        dict of subswath to [first, last] burst ID, e.g. {"IW1": ["t044_093117_iw1", "t044_093120_iw1"]}
+    """
+    if shapefile:
+        df = aoi_bursts(scenes, subswaths, polarization, shapefile)
+    else:
+        df = pd.concat([burst_table(s, subswaths, polarization) for s in scenes])
+    ids = dict()
+    for subswath, grp in df.groupby("subswath"):
+        burst_ids = sorted(grp["burst_id"])
+        ids[subswath] = [burst_ids[0], burst_ids[-1]]
+    return ids
+
+
+def assembly_burst_range(scenes, subswaths, polarization, shapefile):
+    """[assembly_burst_range]
+    first and last burst index per subswath covering an AOI in the SliceAssembly product of consecutive slices
+    Parameters
+    ----------
+        scenes: list
+            SLC zip files of one date in the order of SliceAssembly, or a single scene
+        subswaths: list
+            e.g. ["IW1", "IW2", "IW3"]
+        polarization: str
+            e.g. "VV"
+        shapefile: str
+            AOI
+        Returns
+        -------
+        dict of subswath to [first, last] for TOPSAR-Split, subswaths without intersection are left out
+        Note
+        ----
+        Bursts are counted by their burst ID along the assembled slices, so bursts of an AOI spanning a slice border
+        get consecutive indices regardless of the number of bursts per slice.
+    """
+    df = gpd.GeoDataFrame(pd.concat([burst_table(s, subswaths, polarization) for s in scenes]), crs='EPSG:4326')
+    df = df.drop_duplicates("burst_id")
+    polygon = gpd.read_file(shapefile).to_crs('EPSG:4326')
+    inside = set(df[df.intersects(polygon.unary_union)]["burst_id"])
+    iw_bursts = dict()
+    for subswath in sorted(df["subswath"].unique()):
+        ids = sorted(df[df["subswath"] == subswath]["burst_id"])
+        index = [n for n, burst_id in enumerate(ids, 1) if burst_id in inside]
+        if len(index) > 0:
+            iw_bursts[subswath] = [min(index), max(index)]
+    return iw_bursts
+
+
+def aoi_slices(scenes, subswaths, polarization, shapefile):
+    """[aoi_slices]
+    slices of one date with at least one burst intersecting an AOI
+    Parameters
+    ----------
+        scenes: list
+            SLC zip files of one date
+        subswaths: list
+            e.g. ["IW1", "IW2", "IW3"]
+        polarization: str
+            e.g. "VV"
+        shapefile: str
+            AOI
+        Returns
+        -------
+        list of the intersecting scenes in their original order
+    """
+    polygon = gpd.read_file(shapefile).to_crs('EPSG:4326').unary_union
+    out = []
+    for scene in scenes:
+        bursts = get_burst_geometry(scene, target_subswaths= [x.lower() for x in subswaths], polarization= polarization)
+        if bursts.intersects(polygon).any():
+            out.append(scene)
+        else:
+            print(f'Skip: {os.path.basename(scene)} does not intersect the AOI')
+    return out
+
+
+def read_slices(workflow, scenes, pol, formatName= "SENTINEL-1"):
+    """[read_slices]
+    insert Read nodes of the slices of one date into a workflow, followed by SliceAssembly if there are several
+    Parameters
+    ----------
+        workflow: pyroSAR.snap.auxil.Workflow
+            workflow the nodes are added to
+        scenes: list
+            SLC zip files of one date
+        pol: list or str
+            polarizations kept by SliceAssembly
+        formatName: str
+            reader of the slices, default is "SENTINEL-1"
+        Returns
+        -------
+        id of the last inserted node, the source of e.g. TOPSAR-Split or Apply-Orbit-File
+        Note
+        ----
+        SliceAssembly is computed on demand by the following nodes, so a TOPSAR-Split to the AOI bursts behind it
+        only reads and writes these bursts instead of the full assembly.
+    """
+    read1 = parse_node('Read')
+    read1.parameters['file'] = scenes[0]
+    read1.parameters['formatName'] = formatName
+    read1.parameters["copyMetadata"] = "true"
+    workflow.insert_node(read1)
+    if len(scenes) == 1:
+        return read1.id
+    readers = [read1.id]
+    for scene in scenes[1:]:
+        readn = parse_node('Read')
+        readn.parameters['file'] = scene
+        readn.parameters['formatName'] = formatName
+        readn.parameters["copyMetadata"] = "true"
+        workflow.insert_node(readn, before= read1.id, resetSuccessorSource=False)
+        readers.append(readn.id)
+    slcAs = parse_node("SliceAssembly")
+    slcAs.parameters["selectedPolarisations"] = pol
+    workflow.insert_node(slcAs, before= readers)
+    return slcAs.id
+
+
+## connection to the index and cache database with its tables
+def _connect(db):
+    os.makedirs(os.path.dirname(os.path.abspath(db)), exist_ok=True)
+    con = sqlite3.connect(db, timeout=60)
+    con.execute('CREATE TABLE IF NOT EXISTS scenes (burst_id TEXT, scene TEXT, subswath TEXT, burst INTEGER, '
+                'PRIMARY KEY (burst_id, scene))')
+    con.execute('CREATE TABLE IF NOT EXISTS results (burst_id TEXT, date TEXT, pol TEXT, params TEXT, path TEXT, '
+                'PRIMARY KEY (burst_id, date, pol, params))')
+    return con
+
+
+def index_bursts(db, bursts):
+    """[index_bursts]
+    add bursts of burst_table or aoi_bursts to the burst ID index
+    Parameters
+    ----------
+        db: str
+            sqlite database of the index
+        bursts: geopandas.GeoDataFrame
+            bursts with columns burst_id, scene, subswath and burst
+    """
+    with _connect(db) as con:
+        con.executemany('INSERT OR REPLACE INTO scenes VALUES (?, ?, ?, ?)',
+                        [(r.burst_id, r.scene, r.subswath, int(r.burst)) for r in bursts.itertuples()])
+
+
+def find_scenes(db, burst_ids):
+    """[find_scenes]
+    scenes of the index containing bursts
+    Parameters
+    ----------
+        db: str
+            sqlite database of the index
+        burst_ids: list
+            ESA burst IDs
+        Returns
+        -------
+        dict of burst ID to list of (scene, subswath, burst index)
+    """
+    out = {b: [] for b in burst_ids}
+    with _connect(db) as con:
+        for burst_id in burst_ids:
+            for row in con.execute('SELECT scene, subswath, burst FROM scenes WHERE burst_id = ? ORDER BY scene', (burst_id,)):
+                out[burst_id].append(tuple(row))
+    return out
+
+
+def params_key(params):
+    """ short hash of the processing parameters a cached burst result depends on """
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def cached_burst(db, burst_id, date, pol, params):
+    """[cached_burst]
+    processed output of a burst of a date in the cache
+    Parameters
+    ----------
+        db: str
+            sqlite database of the cache
+        burst_id: str
+            ESA burst ID
+        date: str
+            acquisition day, e.g. 20200103
+        pol: str
+            polarization
+        params: dict
+            processing parameters
+        Returns
+        -------
+        path or None if not cached
+    """
+    with _connect(db) as con:
+        row = con.execute('SELECT path FROM results WHERE burst_id = ? AND date = ? AND pol = ? AND params = ?',
+                          (burst_id, date, pol, params_key(params))).fetchone()
+    if row is not None and os.path.isfile(row[0]):
+        return row[0]
+    return None
+
+
+def process_burst(cache_dir, burst, date, pol, params, graph_dir, gpt_paras= None):
+    """[process_burst]
+    backscatter of a single burst from Apply-Orbit-File to Terrain-Correction, cached per burst, date, polarization
+    and processing parameters
+    Parameters
+    ----------
+        cache_dir: str
+            folder of the burst cache with bursts.db
+        burst: namedtuple
+            row of aoi_bursts with burst_id, scene, subswath and burst
+        date: str
+            acquisition day, e.g. 20200103
+        pol: str
+            polarization
+        params: dict
+            orbitType, osvFail, ml_RgLook, ml_AzLook, ref_plain, demName, ext_Dem_file, ext_DEM_noDatVal,
+            ext_DEM_EGM, demResamp, imgResamp, speckFilter, filterSizeX, filterSizeY, t_res, t_crs, grid_origin and
+            msk_noDatVal
+        graph_dir: str
+            folder of the graphs
+        gpt_paras: list, str or None
+            arguments of gpt or "auto", see scheduler.admit_gpt
+        Returns
+        -------
+        path of the linear, grid aligned GeoTIFF of the burst
+    """
+    db = os.path.join(cache_dir, "bursts.db")
+    path = cached_burst(db, burst.burst_id, date, pol, params)
+    if path is not None:
+        return path
+    key = params_key(params)
+    out = os.path.join(cache_dir, key, burst.burst_id, f'{burst.burst_id}_{pol}_{date}')
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    ##single subswath products keep the subswath in the band names
+    beta = [f'Beta0_{burst.subswath}_{pol}']
+    ref_pl = [f'Sigma0_{burst.subswath}_{pol}'] if params["ref_plain"] == "sigma" else [f'Gamma0_{burst.subswath}_{pol}']
+
+    workflow = parse_recipe("blank")
+    read = parse_node("Read")
+    read.parameters["file"] = burst.scene
+    read.parameters["formatName"] = "SENTINEL-1"
+    workflow.insert_node(read)
+
+    ts = parse_node("TOPSAR-Split")
+    ts.parameters["subswath"] = burst.subswath
+    ts.parameters["selectedPolarisations"] = pol
+    ts.parameters["firstBurstIndex"] = int(burst.burst)
+    ts.parameters["lastBurstIndex"] = int(burst.burst)
+    workflow.insert_node(ts, before= read.id)
+
+    aof = parse_node("Apply-Orbit-File")
+    aof.parameters["orbitType"] = params["orbitType"]
+    aof.parameters["polyDegree"] = 3
+    aof.parameters["continueOnFail"] = params["osvFail"]
+    workflow.insert_node(aof, before= ts.id)
+
+    cal = parse_node("Calibration")
+    cal.parameters["selectedPolarisations"] = pol
+    cal.parameters["createBetaBand"] = False
+    cal.parameters["outputBetaBand"] = True
+    cal.parameters["outputSigmaBand"] = False
+    workflow.insert_node(cal, before= aof.id)
+
+    tpd = parse_node("TOPSAR-Deburst")
+    tpd.parameters["selectedPolarisations"] = pol
+    workflow.insert_node(tpd, before= cal.id)
+
+    ml = parse_node("Multilook")
+    ml.parameters["sourceBands"] = beta
+    ml.parameters["nRgLooks"] = params["ml_RgLook"]
+    ml.parameters["nAzLooks"] = params["ml_AzLook"]
+    ml.parameters["grSquarePixel"] = True
+    ml.parameters["outputIntensity"] = False
+    workflow.insert_node(ml, before= tpd.id)
+
+    tf = parse_node("Terrain-Flattening")
+    tf.parameters["sourceBands"] = beta
+    tf.parameters["demName"] = params["demName"]
+    tf.parameters["demResamplingMethod"] = params["demResamp"]
+    tf.parameters["externalDEMFile"] = params["ext_Dem_file"]
+    tf.parameters["externalDEMNoDataValue"] = params["ext_DEM_noDatVal"]
+    tf.parameters["externalDEMApplyEGM"] = True
+    tf.parameters["additionalOverlap"] = 0.1
+    tf.parameters["oversamplingMultiple"] = 1.0
+    if params["ref_plain"] == "sigma":
+        tf.parameters["outputSigma0"] = True
+    workflow.insert_node(tf, before= ml.id)
+
+    sf = parse_node("Speckle-Filter")
+    sf.parameters["sourceBands"] = ref_pl
+    sf.parameters["filter"] = params["speckFilter"]
+    sf.parameters["filterSizeX"] = params["filterSizeX"]
+    sf.parameters["filterSizeY"] = params["filterSizeY"]
+    workflow.insert_node(sf, before= tf.id)
+
+    tc = parse_node("Terrain-Correction")
+    tc.parameters["sourceBands"] = ref_pl
+    tc.parameters["demName"] = params["demName"]
+    tc.parameters["externalDEMFile"] = params["ext_Dem_file"]
+    tc.parameters["externalDEMNoDataValue"] = params["ext_DEM_noDatVal"]
+    tc.parameters["externalDEMApplyEGM"] = params["ext_DEM_EGM"]
+    tc.parameters["imgResamplingMethod"] = params["imgResamp"]
+    tc.parameters["demResamplingMethod"] = params["demResamp"]
+    tc.parameters["pixelSpacingInMeter"] = params["t_res"]
+    tc.parameters["mapProjection"] = params["t_crs"]
+    tc.parameters["saveSelectedSourceBand"] = True
+    tc.parameters["nodataValueAtSea"] = params["msk_noDatVal"]
+    align_terrain_correction(tc, params["t_crs"], params["t_res"], params["grid_origin"])
+    workflow.insert_node(tc, before= sf.id)
+
+    write = parse_node("Write")
+    write.parameters["file"] = out
+    write.parameters["formatName"] = "GeoTIFF"
+    workflow.insert_node(write, before= tc.id)
+    workflow.write(f"{graph_dir}/Int_burst_graph")
+    execute(f"{graph_dir}/Int_burst_graph.xml", gpt_args= admit_gpt(gpt_paras, "burst", 1))
+
+    with _connect(db) as con:
+        con.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', (burst.burst_id, date, pol, key, out + ".tif"))
+    return out + ".tif"
+
+
+def split_product(cache_dir, scenes, relOrb, date, subswath, pol, burst_range, orbitType, osvFail, graph_dir, gpt_paras= None):
+    """[split_product]
+    orbit corrected TOPSAR-Split of the slices of a date, written once and reused by all coherence pairs of the date
+    Parameters
+    ----------
+        cache_dir: str
+            folder of the split products
+        scenes: list
+            SLC zip files or .SAFE folders of the date in the order of SliceAssembly
+        relOrb: int
+            relative orbit
+        date: str
+            acquisition day, e.g. 20200103
+        subswath, pol: str
+            e.g. "IW1" and "VV"
+        burst_range: list or None
+            first and last burst index of assembly_burst_range, None for all bursts
+        orbitType, osvFail:
+            parameters of Apply-Orbit-File
+        graph_dir: str
+            folder of the graphs
+        gpt_paras: list, str or None
+            arguments of gpt or "auto", see scheduler.admit_gpt
+        Returns
+        -------
+        path of the BEAM-DIMAP product
+        Note
+        ----
+        A product is complete once its marker file <name>.done exists, products of interrupted runs are written again.
+    """
+    orbit = "POE" if "Precise" in orbitType else "RES"
+    bursts = "all" if burst_range is None else f'{burst_range[0]}-{burst_range[1]}'
+    n_bursts = SLICE_BURSTS * len(scenes) if burst_range is None else int(burst_range[1]) - int(burst_range[0]) + 1
+    out = os.path.join(cache_dir, f'S1_relOrb_{relOrb}_{date}_{subswath}_{pol}_{bursts}_{orbit}_split')
+    if os.path.isfile(out + ".done"):
+        return out + ".dim"
+    os.makedirs(cache_dir, exist_ok=True)
+
+    workflow = parse_recipe("blank")
+    last_node = read_slices(workflow, scenes, [pol])
+
+    aof = parse_node("Apply-Orbit-File")
+    aof.parameters["orbitType"] = orbitType
+    aof.parameters["polyDegree"] = 3
+    aof.parameters["continueOnFail"] = osvFail
+    workflow.insert_node(aof, before= last_node)
+
+    ts = parse_node("TOPSAR-Split")
+    ts.parameters["subswath"] = subswath
+    ts.parameters["selectedPolarisations"] = pol
+    if burst_range is not None:
+        ts.parameters["firstBurstIndex"] = burst_range[0]
+        ts.parameters["lastBurstIndex"] = burst_range[1]
+    workflow.insert_node(ts, before= aof.id)
+
+    write = parse_node("Write")
+    write.parameters["file"] = out
+    write.parameters["formatName"] = "BEAM-DIMAP"
+    workflow.insert_node(write, before= ts.id)
+    workflow.write(f"{graph_dir}/Coh_split_graph")
+    execute(f"{graph_dir}/Coh_split_graph.xml", gpt_args= admit_gpt(gpt_paras, "split", n_bursts))
+    open(out + ".done", "w").close()
+    return out + ".dim"
+
+
+def mosaic_bursts(paths, dst):
+    """[mosaic_bursts]
+    mosaic grid aligned burst outputs into one GeoTIFF, later bursts overwrite earlier ones in their overlap
+    Parameters
+    ----------
+        paths: list
+            GeoTIFFs of process_burst
+        dst: str
+            output GeoTIFF
+        Returns
+        -------
+        path of the mosaic
+    """
+    ##the bursts share the lattice of the target grid, so nearest neighbour only copies pixels
+    options = gdal.WarpOptions(format="GTiff", srcNodata=0, dstNodata=0, resampleAlg="near", multithread=True,
+                               creationOptions=["TILED=YES", "BIGTIFF=IF_SAFER"])
+    ds = gdal.Warp(dst, paths, options=options)
+    ds = None
+    return dst
@@ -4,6 +4,10 @@ from .processor import process
 @click.command()
 @click.option('--config-file', '-c', required=False, type=click.Path(),
               help='Full path to an INI-style configuration text file.')
+@click.option('--watch', is_flag=True, default=False,
+              help='Keep scanning the data folder and process new acquisitions as they land.')
+@click.option('--release', is_flag=True, default=False,
+              help='Release the products of the project from the store_dir and remove them beyond store_gb.')
 
-def cli(config_file):
-    process(config_file=config_file)
+def cli(config_file, watch, release):
+    process(config_file=config_file, watch=watch, release=release)
@@ -0,0 +1,193 @@
+import re
+import numpy as np
+
+from .blocks import box_sum, row_blocks, run_blocks
+from .dimap import read_dimap, read_band
+
+
+## complex block of an array or of a pair of i/q arrays
+def _complex(data, row, n):
+    if isinstance(data, tuple):
+        return np.asarray(data[0][row:row + n], dtype=np.float32) + 1j * np.asarray(data[1][row:row + n], dtype=np.float32)
+    return np.asarray(data[row:row + n], dtype=np.complex64)
+
+
+def coherence(master, slave, windows, ref_phase= None, block_rows= 512, threads= 4, out= None):
+    """[coherence]
+    interferometric coherence of coregistered, deramped SLCs for one or more estimation windows in a single pass
+    Parameters
+    ----------
+        master: numpy.ndarray or tuple
+            complex master image or tuple of its i and q arrays, e.g. memory maps of dimap.read_band
+        slave: numpy.ndarray or tuple
+            complex slave image of the same shape
+        windows: list
+            tuples (cohWinRg, cohWinAz) of window sizes in range and azimuth
+        ref_phase: numpy.ndarray or None
+            phase in radians removed from the interferogram before estimation, e.g. flat earth and topographic phase
+        block_rows: int
+            number of rows per block, default is 512
+        threads: int
+            number of worker threads, default is 4
+        out: dict or None
+            preallocated 2D arrays per window, e.g. memory maps, new float32 arrays are created if None
+        Returns
+        -------
+        dict of window tuple to float32 coherence array, 0 where master or slave is 0 (SNAP nodata)
+        Note
+        ----
+        The coherence is |sum(m s* exp(-i phi))| / sqrt(sum(|m|^2) sum(|s|^2)) over each window. Blocks are read with
+        a halo of half the largest azimuth window, so results do not depend on the block size.
+    """
+    shape = master[0].shape if isinstance(master, tuple) else master.shape
+    windows = [tuple(w) for w in windows]
+    if out is None:
+        out = {w: np.zeros(shape, dtype=np.float32) for w in windows}
+    halo = max(w[1] for w in windows) // 2
+
+    def _process(row, n, read_row, read_n):
+        m = _complex(master, read_row, read_n)
+        s = _complex(slave, read_row, read_n)
+        valid = (m != 0) & (s != 0)
+        ifg = np.where(valid, m * np.conj(s), 0)
+        if ref_phase is not None:
+            ifg = ifg * np.exp(-1j * np.asarray(ref_phase[read_row:read_row + read_n], dtype=np.float32))
+        pm = np.where(valid, np.abs(m) ** 2, 0)
+        ps = np.where(valid, np.abs(s) ** 2, 0)
+        cut = slice(row - read_row, row - read_row + n)
+        result = {}
+        for win_rg, win_az in windows:
+            num = np.abs(box_sum(ifg, win_rg, win_az)[cut])
+            den = np.sqrt(box_sum(pm, win_rg, win_az)[cut] * box_sum(ps, win_rg, win_az)[cut])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                coh = np.where(den > 0, num / den, 0)
+            coh[~valid[cut]] = 0
+            result[(win_rg, win_az)] = np.clip(coh, 0, 1).astype(np.float32)
+        return result
+
+    def _write(block, result):
+        row, n = block[0], block[1]
+        for w, coh in result.items():
+            out[w][row:row + n] = coh
+
+    run_blocks(_process, row_blocks(shape[0], block_rows, halo), _write, threads=threads)
+    return out
+
+
+## i/q bands of master and slave of a coregistered stack, e.g. i_IW1_VV_mst_03Jan2020
+def _stack_bands(meta, pol= None):
+    pairs = {}
+    for name in meta["bands"]:
+        match = re.match(r'^i_(.*)$', name)
+        if match and "q_" + match.group(1) in meta["bands"]:
+            if pol is None or f'_{pol}_' in name:
+                pairs[name] = "q_" + match.group(1)
+    master = [b for b in pairs if "_mst" in b]
+    slave = [b for b in pairs if "_slv" in b]
+    if len(master) != 1 or len(slave) != 1:
+        raise RuntimeError('expected one master and one slave i/q band pair, found {}'.format(', '.join(pairs)))
+    return (master[0], pairs[master[0]]), (slave[0], pairs[slave[0]])
+
+
+def coherence_dimap(dim_file, windows, pol= None, phase_band= None, block_rows= 512, threads= 4):
+    """[coherence_dimap]
+    coherence of a coregistered BEAM-DIMAP stack, e.g. the output of Back-Geocoding and TOPSAR-Deburst
+    Parameters
+    ----------
+        dim_file: str
+            path of the .dim file with i/q bands of master (_mst) and slave (_slv)
+        windows: list
+            tuples (cohWinRg, cohWinAz) of window sizes
+        pol: str or None
+            polarization to select if the stack holds several, e.g. "VV"
+        phase_band: str or None
+            band with the phase in radians to remove, e.g. the topographic phase band of TopoPhaseRemoval
+        block_rows, threads: int
+            see coherence
+        Returns
+        -------
+        dict of window tuple to float32 coherence array
+    """
+    meta = read_dimap(dim_file)
+    (mi, mq), (si, sq) = _stack_bands(meta, pol)
+    master = (read_band(meta, mi), read_band(meta, mq))
+    slave = (read_band(meta, si), read_band(meta, sq))
+    ref_phase = read_band(meta, phase_band) if phase_band is not None else None
+    return coherence(master, slave, windows, ref_phase, block_rows=block_rows, threads=threads)
+
+
+def compare_to_reference(native, reference, nodata= 0.0, block_rows= 1024):
+    """[compare_to_reference]
+    numerical agreement of a natively computed raster and a reference, e.g. the SNAP coherence band
+    Parameters
+    ----------
+        native: numpy.ndarray
+            result of the native implementation
+        reference: numpy.ndarray
+            reference of the same shape, e.g. a memory map of dimap.read_band
+        nodata: float
+            value excluded in both arrays, default is 0
+        block_rows: int
+            number of rows compared at once, default is 1024
+        Returns
+        -------
+        dict with count of compared pixels, bias, mae, rmse, max_abs and the Pearson correlation
+    """
+    if native.shape != reference.shape:
+        raise ValueError(f'shape {native.shape} differs from reference shape {reference.shape}')
+    n = 0
+    ##running sums of d, |d|, d^2, a, b, a*b, a^2 and b^2
+    sums = np.zeros(8)
+    max_abs = 0.0
+    for row in range(0, native.shape[0], block_rows):
+        a = np.asarray(native[row:row + block_rows], dtype=np.float64)
+        b = np.asarray(reference[row:row + block_rows], dtype=np.float64)
+        valid = (a != nodata) & (b != nodata) & np.isfinite(a) & np.isfinite(b)
+        a, b = a[valid], b[valid]
+        if a.size == 0:
+            continue
+        d = a - b
+        n += a.size
+        sums += [d.sum(), np.abs(d).sum(), np.square(d).sum(), a.sum(), b.sum(), (a * b).sum(),
+                 np.square(a).sum(), np.square(b).sum()]
+        max_abs = max(max_abs, np.abs(d).max())
+    if n == 0:
+        return {"count": 0, "bias": None, "mae": None, "rmse": None, "max_abs": None, "correlation": None}
+    mean_a, mean_b = sums[3] / n, sums[4] / n
+    cov = sums[5] / n - mean_a * mean_b
+    var_a = sums[6] / n - mean_a ** 2
+    var_b = sums[7] / n - mean_b ** 2
+    corr = float(cov / np.sqrt(var_a * var_b)) if var_a > 0 and var_b > 0 else None
+    return {"count": n, "bias": float(sums[0] / n), "mae": float(sums[1] / n), "rmse": float(np.sqrt(sums[2] / n)),
+            "max_abs": float(max_abs), "correlation": corr}
+
+
+def validate_coherence(stack_dim, coh_dim, cohWinRg= 11, cohWinAz= 3, coh_band= None, pol= None, phase_band= None,
+                       threads= 4):
+    """[validate_coherence]
+    compare the native coherence of a coregistered stack with the coherence SNAP computed from the same stack
+    Parameters
+    ----------
+        stack_dim: str
+            .dim of the coregistered stack the SNAP Coherence node was run on
+        coh_dim: str
+            .dim of the SNAP Coherence output
+        cohWinRg, cohWinAz: int
+            window sizes used in SNAP, default are 11 and 3
+        coh_band: str or None
+            name of the coherence band, the first band starting with "coh" if None
+        pol: str or None
+            polarization to select, e.g. "VV"
+        phase_band: str or None
+            phase band to remove, see coherence_dimap
+        threads: int
+            number of worker threads, default is 4
+        Returns
+        -------
+        dict of compare_to_reference
+    """
+    coh_meta = read_dimap(coh_dim)
+    if coh_band is None:
+        coh_band = [b for b in coh_meta["bands"] if b.startswith("coh") and (pol is None or f'_{pol}_' in b)][0]
+    native = coherence_dimap(stack_dim, [(cohWinRg, cohWinAz)], pol=pol, phase_band=phase_band, threads=threads)
+    return compare_to_reference(native[(cohWinRg, cohWinAz)], read_band(coh_meta, coh_band))
@@ -0,0 +1,148 @@
+import os
+import numpy as np
+from osgeo import gdal
+
+from .auxils import file_lock, remove
+from .encoding import get_encoding, read_decoded
+
+
+def _import_xarray():
+    try:
+        import xarray as xr
+        import zarr
+    except ImportError as e:
+        raise ImportError("datacube output requires xarray and zarr: pip install s1pro[cube]") from e
+    return xr, zarr
+
+
+## drop time steps of an append that did not complete
+def _rollback(zarr, cube_path, committed):
+    group = zarr.open_group(cube_path, mode="r+")
+    for name, arr in group.arrays():
+        if (name == "time" or arr.ndim == 3) and arr.shape[0] > committed:
+            arr.resize((committed,) + tuple(arr.shape[1:]))
+
+
+def get_cube_path(out_dir, relOrb, product, shapefile= None):
+    """[get_cube_path]
+    path of the datacube of an AOI, relative orbit and product
+    Parameters
+    ----------
+        out_dir: str
+            output folder of the product
+        relOrb: int
+            relative orbit
+        product: str
+            "INT", "COH" or "HA"
+        shapefile: str or None
+            AOI shapefile, its name is used as subfolder like for the GeoTIFF outputs
+        Returns
+        -------
+        path of the zarr store
+    """
+    if shapefile is not None:
+        aoiname = os.path.splitext(os.path.basename(shapefile))[0]
+        out_dir = f'{out_dir}/{aoiname}'
+    return f'{out_dir}/cube/S1_relOrb_{relOrb}_{product}.zarr'
+
+
+def append_date(cube_path, time, rasters, variables= None, products= None, time_chunk= 32, space_chunk= 256):
+    """[append_date]
+    append one acquisition to a chunked zarr datacube, the cube is created on the first call
+    Parameters
+    ----------
+        cube_path: str
+            path of the zarr store
+        time: str or datetime
+            acquisition time, e.g. "20200103T051240"
+        rasters: dict
+            variable name and path of its single band raster, all rasters must share one grid
+        variables: list or None
+            all variables of the cube, missing ones are filled with NaN, default are the keys of rasters
+        products: dict or None
+            variable name and product type of get_encoding, if given values are stored as scaled integers
+        time_chunk: int
+            chunk size along time, default is 32
+        space_chunk: int
+            chunk size along x and y, default is 256
+        Returns
+        -------
+        True if the date was appended, False if it already is in the cube
+        Note
+        ----
+        Appends are serialized with a lock file. The number of complete time steps is stored in the
+        attribute "s1pro_committed" after all variables are written, steps beyond it are rolled back on the
+        next append and hidden by open_cube. A new cube is written as <cube_path>.tmp and renamed once complete.
+    """
+    xr, zarr = _import_xarray()
+    if isinstance(time, str):
+        time = np.datetime64(f'{time[0:4]}-{time[4:6]}-{time[6:8]}T{time[9:11]}:{time[11:13]}:{time[13:15]}', "ns")
+    else:
+        time = np.datetime64(time, "ns")
+    if variables is None:
+        variables = sorted(rasters)
+
+    ##read rasters and check that they share one grid
+    grid = None
+    data = {}
+    for var, path in rasters.items():
+        ds = gdal.Open(path)
+        ras_grid = (tuple(ds.GetGeoTransform()), ds.RasterYSize, ds.RasterXSize, ds.GetProjection())
+        ds = None
+        if grid is None:
+            grid = ras_grid
+        elif ras_grid[:3] != grid[:3]:
+            raise ValueError(f'{path} does not share the grid of the other rasters')
+        data[var] = read_decoded(path)
+    gt, nrows, ncols, wkt = grid
+    x = gt[0] + (np.arange(ncols) + 0.5) * gt[1]
+    y = gt[3] + (np.arange(nrows) + 0.5) * gt[5]
+    nan = np.full((nrows, ncols), np.nan, dtype=np.float32)
+    dset = xr.Dataset({v: (("time", "y", "x"), data.get(v, nan)[np.newaxis]) for v in variables},
+                      coords={"time": [time], "y": y, "x": x})
+
+    os.makedirs(os.path.dirname(cube_path), exist_ok=True)
+    with file_lock(cube_path):
+        if not os.path.exists(cube_path):
+            dset.attrs = {"crs": wkt, "geotransform": list(gt), "s1pro_committed": 1}
+            encoding = {}
+            for v in variables:
+                encoding[v] = {"chunks": (time_chunk, min(space_chunk, nrows), min(space_chunk, ncols))}
+                if products is not None and v in products:
+                    enc = get_encoding(products[v])
+                    encoding[v].update({"dtype": enc["dtype"], "scale_factor": enc["scale"],
+                                        "add_offset": enc["offset"], "_FillValue": enc["nodata"]})
+            ##the store is written under a temporary name, so a crash never leaves a cube without committed steps
+            tmp_path = cube_path.rstrip("/") + ".tmp"
+            remove(tmp_path)
+            dset.to_zarr(tmp_path, mode="w-", encoding=encoding, consolidated=False)
+            os.rename(tmp_path, cube_path)
+            return True
+        with xr.open_zarr(cube_path, consolidated=False) as cube:
+            committed = cube.attrs["s1pro_committed"]
+            if tuple(cube.attrs["geotransform"]) != gt or cube.sizes["y"] != nrows or cube.sizes["x"] != ncols:
+                raise RuntimeError(f'grid of {time} does not match the grid of {cube_path}')
+            done = time in cube["time"].values[:committed]
+        if done == True:
+            print(f'Skip: {time} already in {cube_path}')
+            return False
+        _rollback(zarr, cube_path, committed)
+        dset.to_zarr(cube_path, append_dim="time", consolidated=False)
+        zarr.open_group(cube_path, mode="r+").attrs["s1pro_committed"] = committed + 1
+    return True
+
+
+def open_cube(cube_path):
+    """[open_cube]
+    open a datacube lazily with all completely appended time steps, sorted by time
+    Parameters
+    ----------
+        cube_path: str
+            path of the zarr store
+        Returns
+        -------
+        xarray.Dataset
+    """
+    xr, zarr = _import_xarray()
+    cube = xr.open_zarr(cube_path, consolidated=False)
+    return cube.isel(time=slice(0, cube.attrs["s1pro_committed"])).sortby("time")
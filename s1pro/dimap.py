@@ -0,0 +1,330 @@
+import os
+import shutil
+import xml.etree.ElementTree as ET
+import numpy as np
+
+from .encoding import init_stats, update_stats, finalize_stats
+
+
+##ENVI data type codes and the numpy types SNAP writes them as
+_envi_types = {1: "u1", 2: "i2", 3: "i4", 4: "f4", 5: "f8", 6: "c8", 9: "c16", 12: "u2", 13: "u4", 14: "i8", 15: "u8"}
+
+
+## value of an element or None if the element does not exist
+def _text(elem, tag, default= None):
+    child = elem.find(tag)
+    if child is None or child.text is None:
+        return default
+    return child.text.strip()
+
+## header of an ENVI raster as dictionary, e.g. {"samples": 2000, "data type": 4, ...}
+def read_envi_header(hdr_file):
+    """[read_envi_header]
+    parse the ENVI header of a raster written by SNAP
+    Parameters
+    ----------
+        hdr_file: str
+            path of the .hdr file
+        Returns
+        -------
+        dict with samples, lines, bands, header offset, data type, byte order and interleave plus all other keys as strings
+    """
+    header = {}
+    with open(hdr_file) as f:
+        content = f.read()
+    if not content.startswith("ENVI"):
+        raise ValueError(f'{hdr_file} is not an ENVI header')
+    key = None
+    for line in content.splitlines()[1:]:
+        if key is not None:
+            ##continuation of a value in braces
+            header[key] += "\n" + line.strip()
+            if "}" in line:
+                key = None
+            continue
+        if "=" not in line:
+            continue
+        k, v = [s.strip() for s in line.split("=", 1)]
+        header[k] = v
+        if v.startswith("{") and "}" not in v:
+            key = k
+    for k in ["samples", "lines", "bands", "header offset", "data type", "byte order"]:
+        if k in header:
+            header[k] = int(header[k])
+    header.setdefault("bands", 1)
+    header.setdefault("header offset", 0)
+    header.setdefault("byte order", 0)
+    header.setdefault("interleave", "bsq")
+    return header
+
+
+def open_envi(img_file, mode= "r"):
+    """[open_envi]
+    memory map an ENVI raster without copying it
+    Parameters
+    ----------
+        img_file: str
+            path of the .img file, the header is expected next to it with extension .hdr
+        mode: str
+            numpy.memmap mode, "r" for read only, "r+" to modify the file in place, default is "r"
+        Returns
+        -------
+        numpy.memmap of shape (lines, samples) for single band and (bands, lines, samples) for band sequential rasters
+        Note
+        ----
+        SNAP writes big endian rasters, the returned array keeps the byte order of the file. Arithmetic converts on
+        the fly, use astype for a native copy.
+    """
+    header = read_envi_header(os.path.splitext(img_file)[0] + ".hdr")
+    if header["data type"] not in _envi_types:
+        raise ValueError(f'unsupported ENVI data type {header["data type"]} of {img_file}')
+    if header["interleave"].lower() != "bsq":
+        raise ValueError(f'only band sequential ENVI rasters are supported, {img_file} is {header["interleave"]}')
+    dtype = np.dtype((">" if header["byte order"] == 1 else "<") + _envi_types[header["data type"]])
+    if header["bands"] == 1:
+        shape = (header["lines"], header["samples"])
+    else:
+        shape = (header["bands"], header["lines"], header["samples"])
+    return np.memmap(img_file, dtype=dtype, mode=mode, offset=header["header offset"], shape=shape)
+
+
+def read_dimap(dim_file):
+    """[read_dimap]
+    parse the metadata of a BEAM-DIMAP product, e.g. the *_2TPM.dim or *_TPD.dim intermediates
+    Parameters
+    ----------
+        dim_file: str
+            path of the .dim file
+        Returns
+        -------
+        dict with
+            name, ncols, nrows: product name and raster size
+            bands: dict of band name to dict with index, data_type, unit, scale, offset, nodata, expression
+                   (virtual bands) and img (path of the ENVI raster, None for virtual bands)
+            tie_point_grids: dict of grid name to dict with ncols, nrows, offset_x, offset_y, step_x, step_y,
+                             cyclic and img
+            crs: WKT of the map geocoding, None for products in radar geometry
+            geotransform: GDAL geotransform of the map geocoding, None for products in radar geometry
+            metadata: attributes of Abstracted_Metadata as strings
+    """
+    root = ET.parse(dim_file).getroot()
+    base = os.path.dirname(os.path.abspath(dim_file))
+    dims = root.find("Raster_Dimensions")
+    meta = {"name": _text(root, "Dataset_Id/DATASET_NAME"), "ncols": int(_text(dims, "NCOLS")),
+            "nrows": int(_text(dims, "NROWS")), "bands": {}, "tie_point_grids": {}, "crs": None,
+            "geotransform": None, "metadata": {}}
+
+    ##raster files of bands and tie-point grids by index
+    band_files = {}
+    tpg_files = {}
+    for data_file in root.iter("Data_File"):
+        href = data_file.find("DATA_FILE_PATH").get("href")
+        band_files[int(_text(data_file, "BAND_INDEX"))] = os.path.join(base, os.path.splitext(href)[0] + ".img")
+    for tpg_file in root.iter("Tie_Point_Grid_File"):
+        href = tpg_file.find("TIE_POINT_GRID_FILE_PATH").get("href")
+        tpg_files[int(_text(tpg_file, "TIE_POINT_GRID_INDEX"))] = os.path.join(base, os.path.splitext(href)[0] + ".img")
+
+    for info in root.iter("Spectral_Band_Info"):
+        idx = int(_text(info, "BAND_INDEX"))
+        nodata = None
+        if _text(info, "NO_DATA_VALUE_USED", "false").lower() == "true":
+            nodata = float(_text(info, "NO_DATA_VALUE"))
+        meta["bands"][_text(info, "BAND_NAME")] = {
+            "index": idx, "data_type": _text(info, "DATA_TYPE"), "unit": _text(info, "PHYSICAL_UNIT"),
+            "scale": float(_text(info, "SCALING_FACTOR", "1.0")), "offset": float(_text(info, "SCALING_OFFSET", "0.0")),
+            "nodata": nodata, "expression": _text(info, "EXPRESSION"), "img": band_files.get(idx)}
+
+    for info in root.iter("Tie_Point_Grid_Info"):
+        idx = int(_text(info, "TIE_POINT_GRID_INDEX"))
+        meta["tie_point_grids"][_text(info, "TIE_POINT_GRID_NAME")] = {
+            "ncols": int(_text(info, "NCOLS")), "nrows": int(_text(info, "NROWS")),
+            "offset_x": float(_text(info, "OFFSET_X")), "offset_y": float(_text(info, "OFFSET_Y")),
+            "step_x": float(_text(info, "STEP_X")), "step_y": float(_text(info, "STEP_Y")),
+            "cyclic": _text(info, "CYCLIC", "false").lower() == "true", "img": tpg_files.get(idx)}
+
+    ##map geocoding of terrain corrected products
+    wkt = _text(root, "Coordinate_Reference_System/WKT")
+    i2m = _text(root, "Geoposition/IMAGE_TO_MODEL_TRANSFORM")
+    if wkt is not None and i2m is not None:
+        ##affine transform as m00, m10, m01, m11, m02, m12
+        m00, m10, m01, m11, m02, m12 = [float(v) for v in i2m.split(",")]
+        meta["crs"] = wkt
+        meta["geotransform"] = (m02, m00, m01, m12, m10, m11)
+
+    for elem in root.iter("MDElem"):
+        if elem.get("name") == "Abstracted_Metadata":
+            for attr in elem.findall("MDATTR"):
+                meta["metadata"][attr.get("name")] = attr.text.strip() if attr.text is not None else None
+            break
+    return meta
+
+
+def read_band(dim, band, mode= "r"):
+    """[read_band]
+    memory mapped array of a band of a BEAM-DIMAP product
+    Parameters
+    ----------
+        dim: str or dict
+            path of the .dim file or its metadata of read_dimap
+        band: str
+            band name, e.g. "Sigma0_VV" or "coh_IW1_VV_03Jan2020_15Jan2020"
+        mode: str
+            numpy.memmap mode, default is "r"
+        Returns
+        -------
+        numpy.memmap of shape (nrows, ncols) with the raw values of the band, scaling is not applied
+    """
+    meta = read_dimap(dim) if isinstance(dim, str) else dim
+    if band not in meta["bands"]:
+        raise KeyError('band {} not in product, available bands: {}'.format(band, ', '.join(meta["bands"])))
+    info = meta["bands"][band]
+    if info["img"] is None:
+        raise ValueError(f'band {band} is a virtual band with expression "{info["expression"]}" and has no raster')
+    return open_envi(info["img"], mode=mode)
+
+
+def read_tie_point_grid(dim, name, window= None):
+    """[read_tie_point_grid]
+    tie-point grid of a product in radar geometry, optionally interpolated bilinearly to the pixels of a window
+    Parameters
+    ----------
+        dim: str or dict
+            path of the .dim file or its metadata of read_dimap
+        name: str
+            grid name, e.g. "latitude", "longitude", "incident_angle" or "slant_range_time"
+        window: tuple or None
+            (xoff, yoff, xsize, ysize) in pixels of the product, the coarse grid is returned if None
+        Returns
+        -------
+        numpy.ndarray of float64
+    """
+    meta = read_dimap(dim) if isinstance(dim, str) else dim
+    if name not in meta["tie_point_grids"]:
+        raise KeyError('tie-point grid {} not in product, available grids: {}'.format(name, ', '.join(meta["tie_point_grids"])))
+    tpg = meta["tie_point_grids"][name]
+    grid = np.asarray(open_envi(tpg["img"]), dtype=np.float64)
+    if window is None:
+        return grid
+    xoff, yoff, xsize, ysize = window
+    ##tie-points refer to pixel centres
+    fx = (np.arange(xoff, xoff + xsize) + 0.5 - tpg["offset_x"]) / tpg["step_x"]
+    fy = (np.arange(yoff, yoff + ysize) + 0.5 - tpg["offset_y"]) / tpg["step_y"]
+    fx = np.clip(fx, 0, tpg["ncols"] - 1)
+    fy = np.clip(fy, 0, tpg["nrows"] - 1)
+    x0 = np.minimum(np.floor(fx).astype(int), tpg["ncols"] - 2)
+    y0 = np.minimum(np.floor(fy).astype(int), tpg["nrows"] - 2)
+    wx = (fx - x0)[np.newaxis, :]
+    wy = (fy - y0)[:, np.newaxis]
+    g00 = grid[np.ix_(y0, x0)]
+    g01 = grid[np.ix_(y0, x0 + 1)]
+    g10 = grid[np.ix_(y0 + 1, x0)]
+    g11 = grid[np.ix_(y0 + 1, x0 + 1)]
+    return (1 - wy) * ((1 - wx) * g00 + wx * g01) + wy * ((1 - wx) * g10 + wx * g11)
+
+
+def band_stats(dim, band, block_rows= 1024):
+    """[band_stats]
+    statistics of a band of a BEAM-DIMAP product computed block by block from the memory map, e.g. for QA of intermediates
+    Parameters
+    ----------
+        dim: str or dict
+            path of the .dim file or its metadata of read_dimap
+        band: str
+            band name
+        block_rows: int
+            number of rows per block, default is 1024
+        Returns
+        -------
+        dict of encoding.finalize_stats, scaling of the band is applied and its nodata value excluded
+    """
+    meta = read_dimap(dim) if isinstance(dim, str) else dim
+    info = meta["bands"].get(band)
+    arr = read_band(meta, band)
+    stats = init_stats()
+    for row in range(0, arr.shape[0], block_rows):
+        block = arr[row:row + block_rows].astype(np.float32)
+        if info["nodata"] is not None:
+            block[block == info["nodata"]] = np.nan
+        update_stats(stats, block * info["scale"] + info["offset"])
+    return finalize_stats(stats)
+
+
+## ENVI header of a single band big endian raster as SNAP writes it
+def _write_envi_header(hdr_file, ncols, nrows, dtype, band):
+    code = [k for k, v in _envi_types.items() if v == np.dtype(dtype).str[1:]][0]
+    with open(hdr_file, "w") as f:
+        f.write("ENVI\n")
+        f.write(f"samples = {ncols}\nlines = {nrows}\nbands = 1\nheader offset = 0\n")
+        f.write(f"file type = ENVI Standard\ndata type = {code}\ninterleave = bsq\nbyte order = 1\n")
+        f.write(f"band names = {{ {band} }}\n")
+
+
+def derive_dimap(src_dim, dst_dim, bands, dtype= "float32", nodata= 0.0, unit= None):
+    """[derive_dimap]
+    create a BEAM-DIMAP product with new bands that shares raster size, metadata, tie-point grids and vector data
+    of a source product, e.g. to pass natively computed bands on to Terrain-Correction
+    Parameters
+    ----------
+        src_dim: str
+            path of the source .dim file
+        dst_dim: str
+            path of the new .dim file, the .data folder is created next to it
+        bands: list
+            names of the new bands, the bands of the source are not copied
+        dtype: str
+            numpy data type of the new bands, default is "float32"
+        nodata: float
+            no data value of the new bands, default is 0
+        unit: str or None
+            physical unit of the new bands
+        Returns
+        -------
+        dict of band name to numpy.memmap opened for writing
+    """
+    tree = ET.parse(src_dim)
+    root = tree.getroot()
+    meta = read_dimap(src_dim)
+    src_data = os.path.splitext(src_dim)[0] + ".data"
+    dst_name = os.path.splitext(os.path.basename(dst_dim))[0]
+    dst_data = os.path.splitext(dst_dim)[0] + ".data"
+    if os.path.exists(dst_data):
+        shutil.rmtree(dst_data)
+    os.makedirs(dst_data)
+    for sub in ["tie_point_grids", "vector_data"]:
+        if os.path.isdir(os.path.join(src_data, sub)):
+            shutil.copytree(os.path.join(src_data, sub), os.path.join(dst_data, sub))
+
+    ##replace band entries and point the remaining data files to the new .data folder
+    name = root.find("Dataset_Id/DATASET_NAME")
+    if name is not None:
+        name.text = dst_name
+    access = root.find("Data_Access")
+    interpretation = root.find("Image_Interpretation")
+    for data_file in access.findall("Data_File"):
+        access.remove(data_file)
+    for info in interpretation.findall("Spectral_Band_Info"):
+        interpretation.remove(info)
+    for tpg_file in access.iter("Tie_Point_Grid_File"):
+        path = tpg_file.find("TIE_POINT_GRID_FILE_PATH")
+        path.set("href", f'{dst_name}.data/tie_point_grids/' + os.path.basename(path.get("href")))
+    root.find("Raster_Dimensions/NBANDS").text = str(len(bands))
+    type_name = {"float32": "float32", "float64": "float64", "int16": "int16", "uint8": "uint8"}[dtype]
+
+    arrays = {}
+    for idx, band in enumerate(bands):
+        data_file = ET.SubElement(access, "Data_File")
+        ET.SubElement(data_file, "DATA_FILE_PATH", href=f'{dst_name}.data/{band}.hdr')
+        ET.SubElement(data_file, "BAND_INDEX").text = str(idx)
+        info = ET.SubElement(interpretation, "Spectral_Band_Info")
+        for tag, value in [("BAND_INDEX", idx), ("BAND_DESCRIPTION", ""), ("BAND_NAME", band),
+                           ("BAND_RASTER_WIDTH", meta["ncols"]), ("BAND_RASTER_HEIGHT", meta["nrows"]),
+                           ("DATA_TYPE", type_name), ("PHYSICAL_UNIT", unit or ""), ("SOLAR_FLUX", 0.0),
+                           ("BAND_WAVELEN", 0.0), ("BANDWIDTH", 0.0), ("SCALING_FACTOR", 1.0),
+                           ("SCALING_OFFSET", 0.0), ("LOG10_SCALED", "false"), ("NO_DATA_VALUE_USED", "true"),
+                           ("NO_DATA_VALUE", nodata)]:
+            ET.SubElement(info, tag).text = str(value)
+        img = os.path.join(dst_data, f'{band}.img')
+        _write_envi_header(os.path.join(dst_data, f'{band}.hdr'), meta["ncols"], meta["nrows"], ">" + np.dtype(dtype).str[1:], band)
+        arrays[band] = np.memmap(img, dtype=">" + np.dtype(dtype).str[1:], mode="w+", shape=(meta["nrows"], meta["ncols"]))
+    tree.write(dst_dim, encoding="ISO-8859-1", xml_declaration=True)
+    return arrays
@@ -1,48 +1,492 @@
+import os
+import time
+import zlib
+import struct
+import hashlib
+import threading
 import asf_search as asf
+import requests
 import geopandas as gpd
-from shapely.geometry import box
+from shapely.geometry import box, shape
 from tqdm import tqdm
-from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from itertools import chain
+from zipfile import ZipFile, BadZipFile, ZIP_STORED, ZIP_DEFLATED
 
+from .auxils import get_burst_geometry, file_lock
+from .store import object_dir, link_product, evict_store
+from .search_cache import cached_search
+from .remote_zip import RemoteFile, set_session
+from .staging import needed_members, reduce_manifest
 
 
-## download specific product
-def _download_product(args):
-    product, path, session = args
-    product.download(path=path, session=session)
+##size of the chunks streamed to disk and hashed
+_CHUNK = 8 * 1024 * 1024
+##upper bound of a local zip header: fixed part, name and extra field of at most 64 KiB each
+_MAX_LOCAL_HEADER = 30 + 2 * 0xFFFF
 
-def asf_downloader(shapefile, download_dir, mindate, maxdate, platform = 'Sentinel-1A', processinglevel = 'SLC', beammode = 'IW', polarization = 'VV+VH', username = None, password = None, processes = 1, **kwargs):
-    gdf = gpd.read_file(shapefile)
+
+## md5 hex digest of a file
+def _md5(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+## true if a file matches the expected size and md5, missing values are not checked
+def verify(path, size= None, md5= None):
+    if not os.path.isfile(path):
+        return False
+    if size is not None and os.path.getsize(path) != int(size):
+        return False
+    if md5 is not None and _md5(path) != md5.lower():
+        return False
+    return True
+
+
+def download_jobs(results):
+    """[download_jobs]
+    url, file name, size and md5 of the products of an ASF search
+    Parameters
+    ----------
+        results: asf_search.ASFSearchResults
+            products of asf.search
+        Returns
+        -------
+        list of dicts with the keys url, filename, bytes, md5, track (relative orbit) and date (YYYY-MM-DD)
+    """
+    jobs = []
+    for product in results:
+        props = product.properties
+        jobs.append({"url": props["url"], "filename": props["fileName"],
+                     "bytes": props.get("bytes"), "md5": props.get("md5sum"),
+                     "track": props.get("pathNumber"), "date": str(props.get("startTime", ""))[:10]})
+    return jobs
+
+
+def download_file(job, download_dir, session, retries= 5, backoff= 2, progress= None):
+    """[download_file]
+    download one file with resume of a partial download and checksum verification
+    Parameters
+    ----------
+        job: dict
+            url, filename, bytes and md5 of the file, bytes and md5 may be None
+        download_dir: str
+            target folder
+        session: requests.Session
+            authenticated session
+        retries: int
+            attempts after a failed request or checksum, default is 5
+        backoff: int, float
+            wait before the n-th retry is backoff**n seconds, default is 2
+        progress: callable or None
+            called with the number of bytes of every written chunk
+        Returns
+        -------
+        "skipped" if the file already exists and is valid, "downloaded" otherwise
+        Note
+        ----
+        Data is written to <filename>.part and renamed once complete. A later call resumes the .part file with an
+        HTTP Range request; servers ignoring the range restart the download.
+    """
+    path = os.path.join(download_dir, job["filename"])
+    if verify(path, job["bytes"], job["md5"]):
+        return "skipped"
+    part = path + ".part"
+    for attempt in range(retries + 1):
+        try:
+            offset = os.path.getsize(part) if os.path.isfile(part) else 0
+            if job["bytes"] is not None and offset > int(job["bytes"]):
+                offset = 0
+            headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+            with session.get(job["url"], headers=headers, stream=True, timeout=60) as r:
+                ##416 means the part file is already complete
+                if r.status_code != 416:
+                    r.raise_for_status()
+                    mode = "ab" if r.status_code == 206 else "wb"
+                    with open(part, mode) as f:
+                        for chunk in r.iter_content(chunk_size=_CHUNK):
+                            f.write(chunk)
+                            if progress is not None:
+                                progress(len(chunk))
+            if verify(part, job["bytes"], job["md5"]):
+                os.replace(part, path)
+                return "downloaded"
+            ##corrupt data cannot be resumed
+            os.remove(part)
+            raise IOError(f'checksum of {job["filename"]} does not match')
+        except (requests.RequestException, IOError) as e:
+            if attempt == retries:
+                raise
+            print(f'Retry {attempt + 1}/{retries} of {job["filename"]}: {e}')
+            time.sleep(backoff ** attempt)
+
+
+## decompressed chunks of one member of a remote zip, read with a single range request from its local header on
+def _member_chunks(url, session, info, size):
+    if info.compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+        raise NotImplementedError(f'compression {info.compress_type} of {info.filename} is not supported')
+    start = info.header_offset
+    stop = min(start + _MAX_LOCAL_HEADER + info.compress_size, size) - 1
+    with session.get(url, headers={"Range": f"bytes={start}-{stop}"}, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise IOError(f'{url} does not support range requests')
+        stream = r.iter_content(chunk_size=_CHUNK)
+        ##the name and extra field of the local header may differ in length from the central directory
+        head, skip = b"", None
+        for chunk in stream:
+            head += chunk
+            if len(head) >= 30:
+                skip = 30 + sum(struct.unpack("<HH", head[26:30]))
+                if len(head) >= skip:
+                    break
+        if skip is None or len(head) < skip or head[:4] != b"PK\x03\x04":
+            raise BadZipFile(f'bad local header of {info.filename}')
+        remaining = info.compress_size
+        inflate = zlib.decompressobj(-15) if info.compress_type == ZIP_DEFLATED else None
+        crc = 0
+        for chunk in chain([head[skip:]], stream):
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            if inflate is not None:
+                chunk = inflate.decompress(chunk)
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+            if remaining == 0:
+                break
+    if inflate is not None:
+        chunk = inflate.flush()
+        crc = zlib.crc32(chunk, crc)
+        yield chunk
+    if remaining > 0 or crc != info.CRC:
+        raise IOError(f'{info.filename} is incomplete or corrupt')
+
+## download one member of a remote zip to a file, the manifest is reduced to the kept members
+def _download_member(url, session, info, size, target, members, progress= None):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    chunks = _member_chunks(url, session, info, size)
+    if os.path.basename(info.filename) == "manifest.safe":
+        chunks = [reduce_manifest(b"".join(chunks), members)]
+    with open(target + ".part", "wb") as out:
+        for chunk in chunks:
+            out.write(chunk)
+            if progress is not None:
+                progress(len(chunk))
+    os.replace(target + ".part", target)
+
+
+def download_partial(job, download_dir, session, subswaths, polarizations= None, threads= 4, retries= 5, backoff= 2, progress= None):
+    """[download_partial]
+    download only the members of the selected subswaths and polarizations of a remote SLC zip as reduced .SAFE folder
+    Parameters
+    ----------
+        job: dict
+            url and filename of the zip
+        download_dir: str
+            target folder
+        session: requests.Session
+            authenticated session
+        subswaths: list
+            e.g. ["IW1"]
+        polarizations: list or None
+            e.g. ["VV"], None keeps all polarizations
+        threads: int
+            number of members downloaded in parallel, default is 4
+        retries, backoff: int
+            see download_file
+        progress: callable or None
+            called with the number of bytes of every written chunk
+        Returns
+        -------
+        "skipped" if all members already exist, "downloaded" otherwise
+        Note
+        ----
+        The manifest, annotation, calibration, noise and measurement members of the selection are fetched with range
+        requests and written to download_dir/<scene>.SAFE, the layout of the unpacked product that pyroSAR and SNAP
+        read. The central directory is read once, then every member with one request from its local header. The
+        manifest is rewritten to list only the kept members. Complete members are kept across retries and calls.
+    """
+    if polarizations is None:
+        polarizations = ["VV", "VH", "HH", "HV"]
+    for attempt in range(retries + 1):
+        try:
+            remote = RemoteFile(job["url"], session)
+            with ZipFile(remote) as archive:
+                infos = {i.filename: i for i in archive.infolist()}
+            members = needed_members(list(infos.keys()), subswaths, polarizations)
+            if len(members) == 0:
+                raise RuntimeError(f'no members of {subswaths} {polarizations} in {job["filename"]}')
+            ##the reduced manifest differs in size from the member, it is only written once complete
+            missing = [m for m in members if not os.path.isfile(os.path.join(download_dir, m))
+                       or (not m.endswith("manifest.safe") and os.path.getsize(os.path.join(download_dir, m)) != infos[m].file_size)]
+            if len(missing) == 0:
+                return "skipped" if attempt == 0 else "downloaded"
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(lambda m: _download_member(job["url"], session, infos[m], remote.size,
+                                                     os.path.join(download_dir, m), members, progress), missing))
+            return "downloaded"
+        except (requests.RequestException, IOError, BadZipFile) as e:
+            if attempt == retries:
+                raise
+            print(f'Retry {attempt + 1}/{retries} of {job["filename"]}: {e}')
+            time.sleep(backoff ** attempt)
+
+
+def download_files(jobs, download_dir, session_factory= requests.Session, threads= 4, retries= 5, backoff= 2, callback= None,
+                   subswaths= None, polarizations= None, store_dir= None, store_gb= None, project= None):
+    """[download_files]
+    download files with a bounded number of threads, skipping valid files and resuming partial ones
+    Parameters
+    ----------
+        jobs: list
+            dicts of download_jobs or with the same keys
+        download_dir: str
+            target folder
+        session_factory: callable
+            returns an authenticated session, called once per thread, default is requests.Session
+        threads: int
+            number of concurrent downloads, default is 4
+        retries, backoff: int
+            see download_file
+        callback: callable or None
+            called with the job and its status "downloaded", "skipped" or "failed" after each file
+        subswaths: list or None
+            download only these subswaths as reduced .SAFE folders with download_partial, default is None (full zips)
+        polarizations: list or None
+            polarizations of the reduced .SAFE folders, default is None (all)
+        store_dir: str or None
+            shared product store: products are downloaded once to the store and linked into download_dir, products
+            already in the store are only linked, default is None (download to download_dir)
+        store_gb: int, float or None
+            size of the store in GB, products no project refers to are evicted beyond, default is None (no limit)
+        project: str or None
+            name of the project the links are referenced for, default is the absolute path of download_dir
+        Returns
+        -------
+        dict of filename to status
+    """
+    dd = Path(download_dir if store_dir is None else object_dir(store_dir))
+    dd.mkdir(parents=True, exist_ok=True)
+    local = threading.local()
+    lock = threading.Lock()
+    ##the size of reduced products is known only once their central directory is read
+    total = None if subswaths is not None else sum(int(j["bytes"]) for j in jobs if j["bytes"] is not None)
+    pbar = tqdm(total=total, unit="B", unit_scale=True, unit_divisor=1024)
+    start = time.time()
+    received = [0]
+
+    def _progress(n):
+        with lock:
+            received[0] += n
+            pbar.update(n)
+
+    def _download(job):
+        name = job["filename"] if subswaths is None else job["filename"].replace(".zip", ".SAFE")
+        ##other projects may download the same product of the store at the same time
+        with file_lock(os.path.join(dd.as_posix(), name)):
+            ##complete files are skipped without opening a session, e.g. offline
+            if subswaths is None and verify(os.path.join(dd.as_posix(), name), job["bytes"], job["md5"]):
+                s = "skipped"
+            else:
+                if not hasattr(local, "session"):
+                    local.session = session_factory()
+                if subswaths is not None:
+                    s = download_partial(job, dd.as_posix(), local.session, subswaths, polarizations, retries= retries, backoff= backoff, progress= _progress)
+                else:
+                    s = download_file(job, dd.as_posix(), local.session, retries, backoff, _progress)
+        if store_dir is not None:
+            link_product(store_dir, name, download_dir, project, job["md5"])
+        return s
+
+    status = dict()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = {pool.submit(_download, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                status[job["filename"]] = future.result()
+            except Exception as e:
+                print(f'Failed: {job["filename"]}: {e}')
+                status[job["filename"]] = "failed"
+            if status[job["filename"]] == "skipped" and job["bytes"] is not None and subswaths is None:
+                with lock:
+                    pbar.update(int(job["bytes"]))
+            if callback is not None:
+                callback(job, status[job["filename"]])
+    pbar.close()
+    if store_dir is not None and store_gb is not None:
+        evict_store(store_dir, store_gb * 1024**3)
+    seconds = max(time.time() - start, 1e-6)
+    counts = {s: list(status.values()).count(s) for s in ("downloaded", "skipped", "failed")}
+    print(f'Downloaded {counts["downloaded"]}, skipped {counts["skipped"]}, failed {counts["failed"]} files, '
+          f'{received[0] / 1024**2:.1f} MiB at {received[0] / 1024**2 / seconds:.1f} MiB/s')
+    return status
+
+
+def burst_products(shapefile, mindate, maxdate, **kwargs):
+    """[burst_products]
+    unique IDs of the SLC products with at least one burst intersecting the exact AOI, from the ASF burst catalogue
+    Parameters
+    ----------
+        shapefile: str
+            AOI
+        mindate, maxdate: datetime
+            period of acquisition
+        Returns
+        -------
+        set of the 4 character product IDs closing SLC names, e.g. "7C85"
+        Note
+        ----
+        Burst names end with the ID of their SLC, e.g. S1_136231_IW2_20200604T022312_VV_7C85-BURST
+    """
+    aoi = gpd.read_file(shapefile).to_crs('EPSG:4326').unary_union
+    bursts = asf.search(dataset= asf.DATASET.SLC_BURST, start= mindate, end= maxdate, intersectsWith= aoi.wkt, **kwargs)
+    return set(b.properties["fileID"].split("_")[-1].split("-")[0] for b in bursts)
+
+
+def filter_aoi(results, shapefile, product_ids= None):
+    """[filter_aoi]
+    remove search results whose footprint misses the exact AOI geometry and report their size
+    Parameters
+    ----------
+        results: asf_search.ASFSearchResults
+            products of asf.search
+        shapefile: str
+            AOI, multi-part geometries are merged
+        product_ids: set or None
+            IDs of burst_products to keep, other products are removed even if their footprint intersects
+        Returns
+        -------
+        list of the remaining products
+    """
+    aoi = gpd.read_file(shapefile).to_crs('EPSG:4326').unary_union
+    keep = []
+    skipped = 0
+    for product in results:
+        name = product.properties["fileName"]
+        size = product.properties.get("bytes") or 0
+        if not shape(product.geometry).intersects(aoi):
+            reason = "footprint"
+        elif product_ids is not None and name.split(".")[0].split("_")[-1] not in product_ids:
+            reason = "bursts"
+        else:
+            keep.append(product)
+            continue
+        skipped += int(size)
+        print(f'Skip: {name} ({int(size) / 1024**3:.2f} GiB), {reason} does not intersect the AOI')
+    print(f'Kept {len(keep)} of {len(results)} products, {skipped / 1024**3:.2f} GiB not downloaded')
+    return keep
+
+
+def filter_annotation(results, shapefile, session= None):
+    """[filter_annotation]
+    remove search results without bursts intersecting the AOI, read from the annotation of the remote zip
+    Parameters
+    ----------
+        results: list
+            products of asf.search
+        shapefile: str
+            AOI
+        session: requests.Session or None
+            authenticated session of the range requests, e.g. asf_search.ASFSession
+        Returns
+        -------
+        list of the remaining products
+        Note
+        ----
+        Only the central directory and the annotation XMLs are transferred with HTTP range requests, they stay
+        cached in remote_zip, so burst ranges can be planned from the same URLs before the download.
+    """
+    if session is not None:
+        set_session(session)
+    aoi = gpd.read_file(shapefile).to_crs('EPSG:4326').unary_union
+    keep = []
+    skipped = 0
+    for product in results:
+        props = product.properties
+        pol = props.get("polarization", "VV")[:2].lower()
+        bursts = get_burst_geometry(props["url"], target_subswaths= ['iw1', 'iw2', 'iw3'], polarization= pol)
+        if bursts.intersects(aoi).any():
+            keep.append(product)
+            continue
+        skipped += int(props.get("bytes") or 0)
+        print(f'Skip: {props["fileName"]} ({int(props.get("bytes") or 0) / 1024**3:.2f} GiB), bursts do not intersect the AOI')
+    print(f'Kept {len(keep)} of {len(results)} products, {skipped / 1024**3:.2f} GiB not downloaded')
+    return keep
+
+
+def asf_search_aoi(shapefile, mindate, maxdate, platform = 'Sentinel-1A', processinglevel = 'SLC', beammode = 'IW', polarization = 'VV+VH', burst_filter = False, session = None,\
+                   search_cache = None, search_ttl = 24, offline = False, **kwargs):
+    """[asf_search_aoi]
+    search ASF for products intersecting the bounding box of a shapefile and keep those intersecting the AOI itself
+    Parameters
+    ----------
+        shapefile: str
+            AOI
+        mindate, maxdate: datetime
+            period of acquisition
+        platform, processinglevel, beammode, polarization: str
+            search filters of asf.search
+        burst_filter: bool or str
+            also drop products whose footprint intersects the AOI but none of their bursts, true uses the ASF burst
+            catalogue, "annotation" reads the burst footprints from the remote zips, default false
+        session: requests.Session or None
+            authenticated session of the range requests of burst_filter "annotation"
+        search_cache: str or None
+            folder of cached search results, only acquisitions outside the cached period are searched, default is None
+        search_ttl: int, float
+            hours after which the period since the last search is searched again, default is 24
+        offline: bool
+            replay the cached search results without requests, needs search_cache, default false
+        Returns
+        -------
+        list of asf_search products
+    """
+    gdf = gpd.read_file(shapefile).to_crs('EPSG:4326')
     bounds = gdf.total_bounds
     gdf_bounds = gpd.GeoSeries([box(*bounds)])
     wkt_aoi = gdf_bounds.to_wkt().values.tolist()[0]
 
-    results = asf.search(
-        platform= platform,
-        processingLevel=[processinglevel],
-        start = mindate,
-        end = maxdate,
-        beamMode = beammode,
-        polarization = polarization,
-        intersectsWith = wkt_aoi,
-        **kwargs
-        )
+    if search_cache is not None:
+        query = dict(platform= platform, processingLevel= [processinglevel], beamMode= beammode,
+                     polarization= polarization, intersectsWith= wkt_aoi, **kwargs)
+        results = cached_search(search_cache, query, mindate, maxdate, ttl_hours= search_ttl, offline= offline)
+    else:
+        results = asf.search(
+            platform= platform,
+            processingLevel=[processinglevel],
+            start = mindate,
+            end = maxdate,
+            beamMode = beammode,
+            polarization = polarization,
+            intersectsWith = wkt_aoi,
+            **kwargs
+            )
 
     print(f'Total Images Found: {len(results)}')
-    session = asf.ASFSession().auth_with_creds(username, password)
-    
-    dd = Path(download_dir)
-    dd.mkdir(parents=True, exist_ok=True)
+    product_ids = None
+    if burst_filter == True:
+        product_ids = burst_products(shapefile, mindate, maxdate, platform= platform)
+    results = filter_aoi(results, shapefile, product_ids)
+    if burst_filter == "annotation":
+        results = filter_annotation(results, shapefile, session)
+    return results
+
+
+def asf_downloader(shapefile, download_dir, mindate, maxdate, platform = 'Sentinel-1A', processinglevel = 'SLC', beammode = 'IW', polarization = 'VV+VH', username = None, password = None, processes = 1, callback = None, burst_filter = False, subswaths = None, polarizations = None,\
+                   store_dir = None, store_gb = None, project = None, search_cache = None, search_ttl = 24, offline = False, **kwargs):
+    session = None
+    if burst_filter == "annotation":
+        session = asf.ASFSession().auth_with_creds(username, password)
+    results = asf_search_aoi(shapefile, mindate, maxdate, platform, processinglevel, beammode, polarization, burst_filter, session,
+                             search_cache, search_ttl, offline, **kwargs)
 
     print('Start download')
-    if processes == 1:
-        for product in tqdm(results):
-            product.download(path=dd.as_posix(), session=session)
-    else:
-        args = [(product, dd.as_posix(), session) for product in results]
-        with Pool(processes) as pool:
-             max = len(results)
-             with tqdm(total=max) as pbar:
-                for i, _ in enumerate(pool.imap_unordered(_download_product, args)):
-                    pbar.update()
\ No newline at end of file
+    ##one authenticated session per download thread instead of pickling a session into worker processes
+    return download_files(download_jobs(results), download_dir,
+                          session_factory= lambda: asf.ASFSession().auth_with_creds(username, password),
+                          threads= processes, callback= callback, subswaths= subswaths, polarizations= polarizations,
+                          store_dir= store_dir, store_gb= store_gb, project= project)
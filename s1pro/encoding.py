@@ -0,0 +1,280 @@
+import os
+import numpy as np
+from osgeo import gdal
+
+
+##compact encodings per product: integer type, scale/offset of the physical value and reserved nodata code
+ENCODINGS = {
+    "dB": {"dtype": "int16", "scale": 0.01, "offset": 0.0, "nodata": -32768},
+    "coherence": {"dtype": "uint8", "scale": 1/250, "offset": 0.0, "nodata": 255},
+    "entropy": {"dtype": "uint8", "scale": 1/250, "offset": 0.0, "nodata": 255},
+    "anisotropy": {"dtype": "uint8", "scale": 1/250, "offset": 0.0, "nodata": 255},
+    "alpha": {"dtype": "uint8", "scale": 90/250, "offset": 0.0, "nodata": 255},
+}
+
+_gdal_types = {"int16": gdal.GDT_Int16, "uint8": gdal.GDT_Byte}
+
+
+def get_encoding(product):
+    """[get_encoding]
+    return the compact encoding of a product type
+    Parameters
+    ----------
+        product: str
+            one of "dB", "coherence", "entropy", "anisotropy" or "alpha" (case insensitive for H/a features)
+        Returns
+        -------
+        dict with dtype, scale, offset and nodata of the encoding
+    """
+    key = product if product == "dB" else product.lower()
+    if key not in ENCODINGS:
+        raise ValueError('no compact encoding for product {}, must be one of: {}'.format(product, ', '.join(ENCODINGS)))
+    return ENCODINGS[key]
+
+
+def encode_array(arr, encoding, src_nodata=None):
+    """[encode_array]
+    quantize an array of physical values to the integer codes of an encoding
+    Parameters
+    ----------
+        arr: numpy.ndarray
+            physical values, e.g. backscatter in dB or coherence
+        encoding: dict
+            encoding as returned by get_encoding
+        src_nodata: int, float or None
+            nodata value of the input, non-finite values are always treated as nodata
+        Returns
+        -------
+        numpy.ndarray of the encoding's dtype
+    """
+    dtype = np.dtype(encoding["dtype"])
+    info = np.iinfo(dtype)
+    ##the nodata code sits at one end of the value range and is excluded from valid codes
+    if encoding["nodata"] == info.min:
+        lo, hi = info.min + 1, info.max
+    else:
+        lo, hi = info.min, info.max - 1
+    arr = np.asarray(arr, dtype=np.float32)
+    invalid = ~np.isfinite(arr)
+    if src_nodata is not None:
+        invalid |= arr == src_nodata
+    codes = np.rint((arr - encoding["offset"]) / encoding["scale"])
+    codes = np.clip(np.where(invalid, 0, codes), lo, hi).astype(dtype)
+    codes[invalid] = encoding["nodata"]
+    return codes
+
+
+def decode_array(codes, scale, offset= 0.0, nodata= None):
+    """[decode_array]
+    convert integer codes back to physical values, nodata becomes NaN
+    Parameters
+    ----------
+        codes: numpy.ndarray
+            encoded values
+        scale: float
+            scale factor of the encoding
+        offset: float
+            offset of the encoding, default is 0
+        nodata: int or None
+            nodata code
+        Returns
+        -------
+        numpy.ndarray of float32
+    """
+    out = codes.astype(np.float32) * np.float32(scale) + np.float32(offset)
+    if nodata is not None:
+        out[codes == nodata] = np.nan
+    return out
+
+
+def init_stats():
+    """[init_stats]
+    empty accumulator for band statistics that are collected block by block while writing a raster
+    """
+    return {"count": 0, "total": 0, "sum": 0.0, "sumsq": 0.0, "min": np.inf, "max": -np.inf}
+
+
+def update_stats(stats, arr):
+    """[update_stats]
+    add a block of physical values to a statistics accumulator, NaN is counted as nodata
+    Parameters
+    ----------
+        stats: dict
+            accumulator of init_stats
+        arr: numpy.ndarray
+            block of physical values
+    """
+    valid = arr[np.isfinite(arr)].astype(np.float64)
+    stats["total"] += arr.size
+    if valid.size > 0:
+        stats["count"] += valid.size
+        stats["sum"] += valid.sum()
+        stats["sumsq"] += np.square(valid).sum()
+        stats["min"] = min(stats["min"], valid.min())
+        stats["max"] = max(stats["max"], valid.max())
+
+
+def finalize_stats(stats):
+    """[finalize_stats]
+    convert a statistics accumulator to minimum, maximum, mean, stddev and nodata fraction
+    Parameters
+    ----------
+        stats: dict
+            accumulator of init_stats
+        Returns
+        -------
+        dict, values are None if the raster holds no valid pixel
+    """
+    out = {"minimum": None, "maximum": None, "mean": None, "stddev": None, "nodata_fraction": 1.0}
+    if stats["total"] > 0:
+        out["nodata_fraction"] = 1.0 - stats["count"] / stats["total"]
+    if stats["count"] > 0:
+        mean = stats["sum"] / stats["count"]
+        out["minimum"] = float(stats["min"])
+        out["maximum"] = float(stats["max"])
+        out["mean"] = float(mean)
+        out["stddev"] = float(np.sqrt(max(stats["sumsq"] / stats["count"] - mean ** 2, 0.0)))
+    return out
+
+
+def raster_stats(path, stats= None, block_rows= 512):
+    """[raster_stats]
+    collect band statistics of a float or encoded raster block by block
+    Parameters
+    ----------
+        path: str
+            path of raster
+        stats: dict or None
+            accumulator of init_stats to update, a new one is created if None
+        block_rows: int
+            number of rows read at once
+        Returns
+        -------
+        the updated accumulator
+    """
+    if stats is None:
+        stats = init_stats()
+    ds = gdal.Open(path)
+    nrows = ds.RasterYSize
+    ds = None
+    for row in range(0, nrows, block_rows):
+        update_stats(stats, read_decoded(path, yoff=row, ysize=min(block_rows, nrows - row)))
+    return stats
+
+
+def create_output(path, ncols, nrows, geotransform, projection, product= None):
+    """[create_output]
+    create a single band tiled GeoTIFF, compact encoded if a product is given and float32 with NaN nodata otherwise
+    Parameters
+    ----------
+        path: str
+            output path
+        ncols, nrows: int
+            size of the raster
+        geotransform: tuple
+            GDAL geotransform
+        projection: str
+            WKT of the coordinate system
+        product: str or None
+            product type passed to get_encoding
+        Returns
+        -------
+        osgeo.gdal.Dataset opened for writing
+    """
+    driver = gdal.GetDriverByName("GTiff")
+    if product is None:
+        out_ds = driver.Create(path, ncols, nrows, 1, gdal.GDT_Float32,
+                               options=["TILED=YES", "COMPRESS=DEFLATE", "PREDICTOR=3"])
+        out_ds.GetRasterBand(1).SetNoDataValue(float("nan"))
+    else:
+        encoding = get_encoding(product)
+        out_ds = driver.Create(path, ncols, nrows, 1, _gdal_types[encoding["dtype"]],
+                               options=["TILED=YES", "COMPRESS=DEFLATE", "PREDICTOR=2"])
+        out_ds.SetMetadata({"S1PRO_ENCODING": product, "S1PRO_SCALE": repr(encoding["scale"]),
+                            "S1PRO_OFFSET": repr(encoding["offset"]), "S1PRO_NODATA": str(encoding["nodata"])})
+        out_band = out_ds.GetRasterBand(1)
+        out_band.SetScale(encoding["scale"])
+        out_band.SetOffset(encoding["offset"])
+        out_band.SetNoDataValue(encoding["nodata"])
+    out_ds.SetGeoTransform(geotransform)
+    out_ds.SetProjection(projection)
+    return out_ds
+
+
+def encode_raster(src, product, dst= None, block_rows= 512, stats= None):
+    """[encode_raster]
+    rewrite a float raster as compact GeoTIFF, scale/offset and nodata are stored in the band metadata
+    Parameters
+    ----------
+        src: str
+            path of float raster, e.g. a SNAP GeoTIFF output
+        product: str
+            product type passed to get_encoding
+        dst: str or None
+            output path, if None src is replaced
+        block_rows: int
+            number of rows read and written at once
+        stats: dict or None
+            accumulator of init_stats, updated with the decoded values in the same pass
+        Returns
+        -------
+        path of the encoded raster
+    """
+    encoding = get_encoding(product)
+    out = dst if dst is not None else src + ".enc.tif"
+    ds = gdal.Open(src)
+    band = ds.GetRasterBand(1)
+    src_nodata = band.GetNoDataValue()
+    ##SNAP and gdalwarp outputs mark nodata with 0 without writing a nodata tag, 0.0 is only a valid value if
+    ##the source carries another nodata value
+    if src_nodata is None:
+        src_nodata = 0.0
+    out_ds = create_output(out, ds.RasterXSize, ds.RasterYSize, ds.GetGeoTransform(), ds.GetProjection(), product)
+    out_band = out_ds.GetRasterBand(1)
+    for row in range(0, ds.RasterYSize, block_rows):
+        nrows = min(block_rows, ds.RasterYSize - row)
+        arr = band.ReadAsArray(0, row, ds.RasterXSize, nrows)
+        codes = encode_array(arr, encoding, src_nodata)
+        out_band.WriteArray(codes, 0, row)
+        if stats is not None:
+            update_stats(stats, decode_array(codes, encoding["scale"], encoding["offset"], encoding["nodata"]))
+    out_band.FlushCache()
+    out_ds = None
+    ds = None
+    if dst is None:
+        os.replace(out, src)
+        out = src
+    return out
+
+
+def read_decoded(path, xoff= 0, yoff= 0, xsize= None, ysize= None):
+    """[read_decoded]
+    read a window of a raster as physical values, compact encodings are decoded and float rasters returned as is
+    Parameters
+    ----------
+        path: str
+            path of raster
+        xoff, yoff: int
+            upper left pixel of the window
+        xsize, ysize: int or None
+            size of the window, None reads to the raster edge
+        Returns
+        -------
+        numpy.ndarray of float32 with NaN for nodata
+    """
+    ds = gdal.Open(path)
+    band = ds.GetRasterBand(1)
+    xsize = ds.RasterXSize - xoff if xsize is None else xsize
+    ysize = ds.RasterYSize - yoff if ysize is None else ysize
+    arr = band.ReadAsArray(xoff, yoff, xsize, ysize)
+    nodata = band.GetNoDataValue()
+    if np.issubdtype(arr.dtype, np.integer):
+        out = decode_array(arr, band.GetScale() or 1.0, band.GetOffset() or 0.0, nodata)
+    else:
+        out = arr.astype(np.float32)
+        ##SNAP and gdalwarp outputs mark nodata with 0 without writing a nodata tag
+        if nodata is None:
+            nodata = 0.0
+        out[out == nodata] = np.nan
+    ds = None
+    return out
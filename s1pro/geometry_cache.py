@@ -0,0 +1,282 @@
+import os
+import re
+import json
+import glob
+import datetime
+import numpy as np
+import xml.etree.ElementTree as ET
+from zipfile import ZipFile
+from pyroSAR.snap.auxil import parse_recipe, parse_node, execute
+
+from .auxils import file_lock
+from .grid import align_terrain_correction
+from .scheduler import admit_gpt
+
+
+##name of the band of Terrain-Flattening with the simulated illuminated area normalization
+SIM_BAND = "simulatedImage"
+
+
+## annotation files of a zipped or unpacked SAFE product
+def _annotation(scene):
+    regex = r'annotation/s1[a-d]-iw\d-slc-(?:vv|vh|hh|hv)-.*\.xml$'
+    if scene.endswith(".zip"):
+        archive = ZipFile(scene)
+        names = [n for n in archive.namelist() if re.search(regex, n)]
+        return archive.open(sorted(names)[0])
+    names = [n for n in glob.glob(os.path.join(scene, "annotation", "*.xml")) if re.search(regex, n)]
+    return open(sorted(names)[0], "rb")
+
+
+def read_orbit(scene):
+    """[read_orbit]
+    orbit state vectors of the annotation of a Sentinel-1 SLC
+    Parameters
+    ----------
+        scene: str
+            zipped or unpacked SAFE product
+        Returns
+        -------
+        numpy.ndarray of shape (n, 7) with seconds since the first vector, Earth-fixed position and velocity
+    """
+    with _annotation(scene) as f:
+        root = ET.parse(f).getroot()
+    vectors = []
+    for orbit in root.iter('orbit'):
+        t = datetime.datetime.strptime(orbit.find('time').text[:26], '%Y-%m-%dT%H:%M:%S.%f')
+        pos = [float(orbit.find(f'position/{c}').text) for c in "xyz"]
+        vel = [float(orbit.find(f'velocity/{c}').text) for c in "xyz"]
+        vectors.append([t.timestamp()] + pos + vel)
+    vectors = np.array(sorted(vectors))
+    vectors[:, 0] -= vectors[0, 0]
+    return vectors
+
+
+## positions and velocities of state vectors densified with cubic Hermite interpolation
+def _densify(orbit, step= 1.0):
+    t, pos, vel = orbit[:, 0], orbit[:, 1:4], orbit[:, 4:7]
+    times = np.arange(t[0], t[-1] + step / 2, step)
+    i = np.clip(np.searchsorted(t, times, side="right") - 1, 0, len(t) - 2)
+    h = (t[i + 1] - t[i])[:, np.newaxis]
+    s = ((times - t[i])[:, np.newaxis]) / h
+    h00, h10, h01, h11 = 2 * s ** 3 - 3 * s ** 2 + 1, s ** 3 - 2 * s ** 2 + s, -2 * s ** 3 + 3 * s ** 2, s ** 3 - s ** 2
+    p = h00 * pos[i] + h10 * h * vel[i] + h01 * pos[i + 1] + h11 * h * vel[i + 1]
+    v = ((6 * s ** 2 - 6 * s) * pos[i] + (3 * s ** 2 - 4 * s + 1) * h * vel[i] + (-6 * s ** 2 + 6 * s) * pos[i + 1] +
+         (3 * s ** 2 - 2 * s) * h * vel[i + 1]) / h
+    return p, v
+
+
+def orbit_deviation(reference, orbit):
+    """[orbit_deviation]
+    largest distance of the state vectors of an orbit to the trajectory of a reference orbit of the same track
+    Parameters
+    ----------
+        reference: numpy.ndarray
+            state vectors of read_orbit
+        orbit: numpy.ndarray
+            state vectors of read_orbit of another date
+        Returns
+        -------
+        float, distance across the reference trajectory in meters, infinite if both do not overlap in time
+    """
+    p, v = _densify(reference)
+    dist = []
+    for pos in orbit[:, 1:4]:
+        j = np.argmin(np.sum((p - pos) ** 2, axis=1))
+        ##positions beyond the ends of the reference have no perpendicular foot point
+        if j == 0 or j == len(p) - 1:
+            continue
+        d = pos - p[j]
+        along = v[j] / np.linalg.norm(v[j])
+        dist.append(np.linalg.norm(d - np.dot(d, along) * along))
+    return max(dist) if dist else float("inf")
+
+
+def track_key(relOrb, IWs, burst_ids= None):
+    """[track_key]
+    name of the cache folder of a relative orbit, its subswaths and the ESA burst IDs they cover
+    Parameters
+    ----------
+        relOrb: int
+            relative orbit
+        IWs: list
+            subswaths, e.g. ["IW1", "IW2"]
+        burst_ids: dict or None
+            first and last ESA burst ID per subswath of bursts.iw_burst_ids, the subswaths only if None
+        Returns
+        -------
+        str, e.g. relOrb_44_IW1_t044_093117_iw1-t044_093120_iw1
+        Note
+        ----
+        Burst indices of TOPSAR-Split depend on the slices of a date, ESA burst IDs name the same ground bursts on
+        all dates of a track.
+    """
+    parts = [f'relOrb_{relOrb}']
+    for iw in sorted(IWs):
+        if burst_ids is not None and iw.upper() in burst_ids:
+            parts.append(f'{iw.upper()}_{burst_ids[iw.upper()][0]}-{burst_ids[iw.upper()][1]}')
+        else:
+            parts.append(iw.upper())
+    return "_".join(parts)
+
+
+def lookup_lut(cache_dir, key, params, orbit, tolerance= 250.0):
+    """[lookup_lut]
+    cached normalization LUT of a track for the processing parameters and an orbit within the tolerance
+    Parameters
+    ----------
+        cache_dir: str
+            folder of the geometry cache
+        key: str
+            track of track_key
+        params: dict
+            parameters the LUT depends on, e.g. DEM, multi-looking and target grid
+        orbit: numpy.ndarray
+            state vectors of read_orbit of the date to process
+        tolerance: float
+            largest orbit deviation in meters at which a LUT is reused, default is 250
+        Returns
+        -------
+        path of the LUT or None
+    """
+    index_file = os.path.join(cache_dir, key, "index.json")
+    if not os.path.isfile(index_file):
+        return None
+    ##compare as stored in json, e.g. tuples as lists
+    params = json.loads(json.dumps(params))
+    with file_lock(index_file):
+        with open(index_file) as f:
+            entries = json.load(f)
+    for entry in entries:
+        if entry["params"] != params:
+            continue
+        deviation = orbit_deviation(np.array(entry["orbit"]), orbit)
+        if deviation <= tolerance:
+            print(f'Reusing geometry of {entry["date"]} for {key}, orbit deviation {deviation:.0f} m')
+            return os.path.join(cache_dir, key, entry["lut"])
+    return None
+
+
+def add_lut(cache_dir, key, params, orbit, date, lut):
+    """[add_lut]
+    register a LUT of a date as reference of its track
+    Parameters
+    ----------
+        cache_dir: str
+            folder of the geometry cache
+        key, params, orbit:
+            see lookup_lut
+        date: str
+            acquisition start of the date the LUT is computed for
+        lut: str
+            path of the LUT inside the folder of the track
+    """
+    index_file = os.path.join(cache_dir, key, "index.json")
+    with file_lock(index_file):
+        entries = []
+        if os.path.isfile(index_file):
+            with open(index_file) as f:
+                entries = json.load(f)
+        entries.append({"params": params, "orbit": orbit.tolist(), "date": date, "lut": os.path.basename(lut)})
+        with open(index_file, 'w') as f:
+            json.dump(entries, f)
+
+
+def geometry_lut(cache_dir, key, params, orbit, date, infiles, beta_bands, graph_dir, gpt_paras= None,
+                 tolerance= 250.0, bursts= None):
+    """[geometry_lut]
+    illuminated area normalization of Terrain-Flattening in map geometry, computed once per track and reused for all
+    dates with an orbit within the tolerance
+    Parameters
+    ----------
+        cache_dir: str
+            folder of the geometry cache
+        key: str
+            track of track_key
+        params: dict
+            demName, externalDEMFile, externalDEMNoDataValue, externalDEMApplyEGM, demResamplingMethod,
+            nRgLooks, nAzLooks, t_crs, t_res and grid_origin of the processing
+        orbit: numpy.ndarray
+            state vectors of read_orbit of the date to process
+        date: str
+            acquisition start of the date
+        infiles: list
+            debursted subswaths of the date, merged if several
+        beta_bands: list
+            beta0 bands of Calibration for Multilook and Terrain-Flattening
+        graph_dir: str
+            folder of the graphs
+        gpt_paras: list, str or None
+            arguments of gpt or "auto", see scheduler.admit_gpt
+        tolerance: float
+            largest orbit deviation in meters at which a LUT is reused, default is 250
+        bursts: int or None
+            number of bursts of the date, sizes gpt_paras "auto"
+        Returns
+        -------
+        path of the LUT GeoTIFF, aligned to the target grid of params
+    """
+    lut = lookup_lut(cache_dir, key, params, orbit, tolerance)
+    if lut is not None:
+        return lut
+    os.makedirs(os.path.join(cache_dir, key), exist_ok=True)
+    lut = os.path.join(cache_dir, key, f'{SIM_BAND}_{date}')
+
+    workflow = parse_recipe("blank")
+    read1 = parse_node('Read')
+    read1.parameters['file'] = infiles[0]
+    workflow.insert_node(read1)
+    last_node = read1.id
+    if len(infiles) > 1:
+        readers = [read1.id]
+        for infile in infiles[1:]:
+            readn = parse_node('Read')
+            readn.parameters['file'] = infile
+            workflow.insert_node(readn, before= last_node, resetSuccessorSource=False)
+            readers.append(readn.id)
+        tpm = parse_node("TOPSAR-Merge")
+        workflow.insert_node(tpm, before=readers)
+        last_node = tpm.id
+
+    ml = parse_node("Multilook")
+    ml.parameters["sourceBands"] = beta_bands
+    ml.parameters["nRgLooks"] = params["nRgLooks"]
+    ml.parameters["nAzLooks"] = params["nAzLooks"]
+    ml.parameters["grSquarePixel"] = True
+    ml.parameters["outputIntensity"] = False
+    workflow.insert_node(ml, before= last_node)
+
+    tf = parse_node("Terrain-Flattening")
+    tf.parameters["sourceBands"] = beta_bands
+    tf.parameters["demName"] = params["demName"]
+    tf.parameters["demResamplingMethod"] = params["demResamplingMethod"]
+    tf.parameters["externalDEMFile"] = params["externalDEMFile"]
+    tf.parameters["externalDEMNoDataValue"] = params["externalDEMNoDataValue"]
+    tf.parameters["externalDEMApplyEGM"] = True
+    tf.parameters["additionalOverlap"] = 0.1
+    tf.parameters["oversamplingMultiple"] = 1.0
+    tf.parameters["outputSimulatedImage"] = True
+    workflow.insert_node(tf, before= ml.id)
+
+    tc = parse_node("Terrain-Correction")
+    tc.parameters["sourceBands"] = [SIM_BAND]
+    tc.parameters["demName"] = params["demName"]
+    tc.parameters["externalDEMFile"] = params["externalDEMFile"]
+    tc.parameters["externalDEMNoDataValue"] = params["externalDEMNoDataValue"]
+    tc.parameters["externalDEMApplyEGM"] = params["externalDEMApplyEGM"]
+    tc.parameters["imgResamplingMethod"] = "BILINEAR_INTERPOLATION"
+    tc.parameters["demResamplingMethod"] = params["demResamplingMethod"]
+    tc.parameters["pixelSpacingInMeter"] = params["t_res"]
+    tc.parameters["mapProjection"] = params["t_crs"]
+    align_terrain_correction(tc, params["t_crs"], params["t_res"], params["grid_origin"])
+    workflow.insert_node(tc, before= tf.id)
+
+    write = parse_node("Write")
+    write.parameters["file"] = lut
+    write.parameters["formatName"] = "GeoTIFF"
+    workflow.insert_node(write, before= tc.id)
+    workflow.write(f"{graph_dir}/Int_geometry_graph")
+    execute(f"{graph_dir}/Int_geometry_graph.xml", gpt_args= admit_gpt(gpt_paras, "tc", bursts))
+
+    add_lut(cache_dir, key, params, orbit, date, lut + ".tif")
+    return lut + ".tif"
@@ -0,0 +1,124 @@
+import os
+import json
+import math
+
+from .auxils import file_lock
+
+
+##mean earth radius SNAP uses to convert pixelSpacingInMeter to pixelSpacingInDegree
+EARTH_RADIUS = 6371008.7714
+
+
+def grid_resolution(t_crs, t_res):
+    """[grid_resolution]
+    pixel size of the target grid in units of the target CRS
+    Parameters
+    ----------
+        t_crs: int
+            EPSG code of target coordinate system
+        t_res: int, float
+            resolution in meters
+        Returns
+        -------
+        float, meters for projected CRS and degrees for EPSG 4326
+    """
+    if t_crs == 4326:
+        return t_res / EARTH_RADIUS * 180 / math.pi
+    return float(t_res)
+
+
+def define_grid(extent, t_crs, t_res, origin= (0, 0)):
+    """[define_grid]
+    pixel aligned target grid covering an AOI extent, the extent is snapped outwards to origin + k * resolution
+    Parameters
+    ----------
+        extent: dict
+            AOI extent in the target CRS with keys xmin, ymin, xmax, ymax, e.g. spatialist.Vector.extent
+        t_crs: int
+            EPSG code of target coordinate system
+        t_res: int, float
+            resolution in meters
+        origin: tuple
+            x and y of a grid corner, default is (0, 0)
+        Returns
+        -------
+        dict with crs, res, origin, bounds [xmin, ymin, xmax, ymax], ncols and nrows
+    """
+    res = grid_resolution(t_crs, t_res)
+    ox, oy = origin
+    xmin = ox + math.floor((extent['xmin'] - ox) / res) * res
+    ymin = oy + math.floor((extent['ymin'] - oy) / res) * res
+    xmax = ox + math.ceil((extent['xmax'] - ox) / res) * res
+    ymax = oy + math.ceil((extent['ymax'] - oy) / res) * res
+    return {"crs": t_crs, "res": res, "origin": [ox, oy], "bounds": [xmin, ymin, xmax, ymax],
+            "ncols": int(round((xmax - xmin) / res)), "nrows": int(round((ymax - ymin) / res))}
+
+
+def get_grid(grid_dir, extent, t_crs, t_res, origin= (0, 0)):
+    """[get_grid]
+    load the target grid of an AOI or define and store it on first use, so all dates and products share it
+    Parameters
+    ----------
+        grid_dir: str
+            folder of the AOI outputs where grid_<crs>_<res>.json is kept
+        extent: dict
+            AOI extent in the target CRS, used if no grid is stored yet
+        t_crs: int
+            EPSG code of target coordinate system
+        t_res: int, float
+            resolution in meters
+        origin: tuple
+            x and y of a grid corner, default is (0, 0)
+        Returns
+        -------
+        dict of define_grid
+    """
+    os.makedirs(grid_dir, exist_ok=True)
+    grid_file = os.path.join(grid_dir, f'grid_{t_crs}_{t_res}.json')
+    with file_lock(grid_file):
+        if os.path.isfile(grid_file):
+            with open(grid_file) as f:
+                grid = json.load(f)
+            if list(grid["origin"]) != list(origin):
+                raise ValueError(f'grid origin {origin} differs from stored grid {grid_file}')
+        else:
+            grid = define_grid(extent, t_crs, t_res, origin)
+            with open(grid_file, 'w') as f:
+                json.dump(grid, f, indent=2)
+    return grid
+
+
+def grid_warp_options(grid):
+    """[grid_warp_options]
+    gdalwarp options that write a raster exactly onto the target grid
+    Parameters
+    ----------
+        grid: dict
+            grid of define_grid or get_grid
+        Returns
+        -------
+        dict of options for spatialist.gdalwarp
+    """
+    ##outputs of Terrain-Correction aligned to the same origin are only cut, nearest neighbour avoids interpolation
+    return {'outputBounds': grid["bounds"], 'xRes': grid["res"], 'yRes': grid["res"], 'resampleAlg': 'near'}
+
+
+def align_terrain_correction(tc, t_crs, t_res, origin= (0, 0)):
+    """[align_terrain_correction]
+    set the Terrain-Correction node to write onto the lattice of the target grid
+    Parameters
+    ----------
+        tc: pyroSAR.snap.auxil.Node
+            Terrain-Correction node
+        t_crs: int
+            EPSG code of target coordinate system
+        t_res: int, float
+            resolution in meters
+        origin: tuple
+            x and y of a grid corner, default is (0, 0)
+    """
+    tc.parameters["alignToStandardGrid"]= True
+    tc.parameters["standardGridOriginX"]= origin[0]
+    tc.parameters["standardGridOriginY"]= origin[1]
+    if t_crs == 4326:
+        tc.parameters["pixelSpacingInDegree"]= grid_resolution(t_crs, t_res)
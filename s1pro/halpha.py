@@ -0,0 +1,163 @@
+import numpy as np
+
+from .blocks import box_sum, row_blocks, run_blocks
+from .coherence import compare_to_reference
+from .dimap import read_dimap, read_band, derive_dimap
+
+
+##names of the C2 bands written by Polarimetric-Matrices and of the features of Polarimetric-Decomposition
+C2_BANDS = ["C11", "C12_real", "C12_imag", "C22"]
+FEATURES = ["Entropy", "Anisotropy", "Alpha"]
+
+
+## p * log2(p) with 0 * log2(0) = 0
+def _xlog2x(p):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(p > 0, p * np.log2(p), 0)
+
+## |first component| of the unit eigenvector of [[c11, c12], [c12*, c22]] for eigenvalue lam
+def _cos_alpha(lam, c11, c22, c12_abs2):
+    ##(c12, lam - c11) and (lam - c22, c12*) both span the eigenspace, the longer one is numerically stable
+    n1 = c12_abs2 + (lam - c11) ** 2
+    n2 = (lam - c22) ** 2 + c12_abs2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos = np.where(n1 >= n2, np.sqrt(c12_abs2 / n1), np.abs(lam - c22) / np.sqrt(n2))
+    ##degenerate matrices with equal eigenvalues
+    return np.where((n1 > 0) | (n2 > 0), cos, 1.0)
+
+
+def h_alpha(c11, c12_real, c12_imag, c22):
+    """[h_alpha]
+    dual-pol entropy, anisotropy and alpha of averaged C2 matrices with a closed-form 2x2 eigen-decomposition
+    Parameters
+    ----------
+        c11, c12_real, c12_imag, c22: numpy.ndarray
+            elements of the averaged C2 covariance matrix
+        Returns
+        -------
+        tuple of float32 arrays (entropy, anisotropy, alpha in degrees), NaN where the matrix is empty
+    """
+    c11 = np.asarray(c11, dtype=np.float64)
+    c22 = np.asarray(c22, dtype=np.float64)
+    c12_abs2 = np.asarray(c12_real, dtype=np.float64) ** 2 + np.asarray(c12_imag, dtype=np.float64) ** 2
+    half_trace = (c11 + c22) / 2
+    root = np.sqrt(((c11 - c22) / 2) ** 2 + c12_abs2)
+    lam1 = half_trace + root
+    lam2 = np.maximum(half_trace - root, 0)
+    span = lam1 + lam2
+    valid = np.isfinite(span) & (span > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p1 = np.where(valid, lam1 / span, np.nan)
+        p2 = np.where(valid, lam2 / span, np.nan)
+    entropy = -(_xlog2x(p1) + _xlog2x(p2))
+    anisotropy = p1 - p2
+    alpha1 = np.degrees(np.arccos(np.clip(_cos_alpha(lam1, c11, c22, c12_abs2), 0, 1)))
+    ##the eigenvectors are orthonormal, so alpha2 = 90 - alpha1
+    alpha = p1 * alpha1 + p2 * (90 - alpha1)
+    entropy[~valid] = np.nan
+    return entropy.astype(np.float32), anisotropy.astype(np.float32), alpha.astype(np.float32)
+
+
+def decompose(c2, win_size= 5, block_rows= 512, threads= 4, out= None):
+    """[decompose]
+    blockwise dual-pol H/A/alpha decomposition with boxcar averaging of the C2 matrix, all features in one pass
+    Parameters
+    ----------
+        c2: tuple
+            arrays of C11, C12_real, C12_imag and C22, e.g. memory maps of dimap.read_band
+        win_size: int
+            size of the averaging window like windowSize of Polarimetric-Decomposition, default is 5
+        block_rows: int
+            number of rows per block, default is 512
+        threads: int
+            number of worker threads, default is 4
+        out: dict or None
+            preallocated arrays for "Entropy", "Anisotropy" and "Alpha", new float32 arrays are created if None
+        Returns
+        -------
+        dict of feature name to array, pixels without valid C2 elements are 0 like in SNAP
+    """
+    shape = c2[0].shape
+    if out is None:
+        out = {f: np.zeros(shape, dtype=np.float32) for f in FEATURES}
+
+    def _process(row, n, read_row, read_n):
+        block = [np.asarray(c[read_row:read_row + read_n], dtype=np.float64) for c in c2]
+        valid = (block[0] != 0) | (block[3] != 0)
+        cut = slice(row - read_row, row - read_row + n)
+        means = [box_sum(np.where(valid, b, 0), win_size, win_size)[cut] for b in block]
+        features = h_alpha(*means)
+        result = {}
+        for f, arr in zip(FEATURES, features):
+            arr[~valid[cut] | ~np.isfinite(arr)] = 0
+            result[f] = arr
+        return result
+
+    def _write(block, result):
+        row, n = block[0], block[1]
+        for f, arr in result.items():
+            out[f][row:row + n] = arr
+
+    ##the eigenvalue ratios do not depend on the number of pixels, so window sums replace window means
+    run_blocks(_process, row_blocks(shape[0], block_rows, win_size // 2), _write, threads=threads)
+    return out
+
+
+## sink for features that are not written
+class _Discard:
+    def __setitem__(self, key, value):
+        pass
+
+
+def decompose_dimap(c2_dim, out_dim, win_size= 5, features= None, block_rows= 512, threads= 4):
+    """[decompose_dimap]
+    H/A/alpha decomposition of a C2 BEAM-DIMAP product into a derived BEAM-DIMAP product for Terrain-Correction
+    Parameters
+    ----------
+        c2_dim: str
+            .dim of a product with bands C11, C12_real, C12_imag and C22
+        out_dim: str
+            path of the derived .dim
+        win_size: int
+            size of the averaging window, default is 5
+        features: list or None
+            subset of "Entropy", "Anisotropy" and "Alpha" to keep, all if None
+        block_rows, threads: int
+            see decompose
+        Returns
+        -------
+        path of the derived .dim
+    """
+    meta = read_dimap(c2_dim)
+    c2 = tuple(read_band(meta, b) for b in C2_BANDS)
+    features = FEATURES if features is None else [f for f in FEATURES if f.lower() in [x.lower() for x in features]]
+    arrays = derive_dimap(c2_dim, out_dim, features)
+    ##features that are not kept are computed into scratch memory of one block only
+    out = {f: arrays[f] if f in arrays else _Discard() for f in FEATURES}
+    decompose(c2, win_size, block_rows=block_rows, threads=threads, out=out)
+    for arr in arrays.values():
+        arr.flush()
+    return out_dim
+
+
+def validate_h_alpha(c2_dim, ha_dim, win_size= 5, threads= 4):
+    """[validate_h_alpha]
+    compare the native decomposition of a C2 product with SNAP's Polarimetric-Decomposition of the same product
+    Parameters
+    ----------
+        c2_dim: str
+            .dim of the C2 product
+        ha_dim: str
+            .dim of the SNAP "H-Alpha Dual Pol Decomposition" output with the same window size
+        win_size: int
+            window size used in SNAP, default is 5
+        threads: int
+            number of worker threads, default is 4
+        Returns
+        -------
+        dict of feature name to compare_to_reference result for the features present in ha_dim
+    """
+    meta = read_dimap(c2_dim)
+    ha_meta = read_dimap(ha_dim)
+    native = decompose(tuple(read_band(meta, b) for b in C2_BANDS), win_size, threads=threads)
+    return {f: compare_to_reference(native[f], read_band(ha_meta, f)) for f in FEATURES if f in ha_meta["bands"]}
@@ -0,0 +1,174 @@
+import os
+import re
+import glob
+import numpy as np
+from osgeo import gdal
+
+from .blocks import box_sum, row_blocks, run_blocks
+from .encoding import create_output, encode_array, get_encoding, read_decoded
+
+
+## date of an output name, e.g. ..._INT_VV_20200103T051240_...
+def _date_of(path):
+    match = re.search(r'_(\d{8}T\d{6})', os.path.basename(path))
+    return match.group(1) if match else os.path.basename(path)
+
+
+def find_track_outputs(track_dir, relOrb, pol):
+    """[find_track_outputs]
+    backscatter outputs of one relative orbit and polarization in an output folder, sorted by date
+    Parameters
+    ----------
+        track_dir: str
+            output folder of S1_INT_proc, the AOI subfolder if a shapefile is used
+        relOrb: int
+            relative orbit
+        pol: str
+            polarization, e.g. "VV"
+        Returns
+        -------
+        list of raster paths
+    """
+    pattern = os.path.join(track_dir, f'*_relOrb_{relOrb}_INT_*', f'*_relOrb_{relOrb}_INT_{pol}_*')
+    paths = [p for p in glob.glob(pattern) if os.path.splitext(p)[1] in ["", ".tif"]]
+    return sorted(paths, key=_date_of)
+
+
+def quegan_filter(paths, out_dir= None, size_x= 5, size_y= 5, dB= False, max_block_bytes= 512 * 2 ** 20, threads= 4):
+    """[quegan_filter]
+    multi-temporal speckle filter after Quegan & Yu (2001) streaming over row blocks of all dates of a track:
+    J_k = E[I_k] / N * sum_i I_i / E[I_i], E[] being the local mean of a size_y x size_x window
+    Parameters
+    ----------
+        paths: list
+            aligned rasters of one track and polarization with identical size and geotransform, e.g. of
+            find_track_outputs, float32 or compact encoded
+        out_dir: str or None
+            folder of the filtered outputs, the subfolder and file name of each input are kept; inputs are
+            replaced if None
+        size_x, size_y: int
+            window of the local means, default is 5
+        dB: bool
+            inputs are in dB, they are filtered in linear scale and written in dB again, default false
+        max_block_bytes: int
+            memory budget of all blocks in flight, default is 512 MB
+        threads: int
+            number of worker threads, default is 4
+        Returns
+        -------
+        list of paths of the filtered outputs
+        Note
+        ----
+        Only dates with a valid pixel are counted in the sum, so N varies per pixel at scene edges.
+    """
+    ds = gdal.Open(paths[0])
+    ncols, nrows = ds.RasterXSize, ds.RasterYSize
+    gt, projection = ds.GetGeoTransform(), ds.GetProjection()
+    ds = None
+    products = []
+    for p in paths:
+        ds = gdal.Open(p)
+        if (ds.RasterXSize, ds.RasterYSize) != (ncols, nrows) or \
+                not np.allclose(ds.GetGeoTransform(), gt, rtol=0, atol=1e-9 * max(abs(gt[1]), 1)):
+            raise ValueError(f'{p} is not aligned to {paths[0]}, enable grid_align for multi-temporal filtering')
+        products.append(ds.GetMetadataItem("S1PRO_ENCODING"))
+        ds = None
+
+    if out_dir is None:
+        dst = [p + ".mt.tif" for p in paths]
+    else:
+        dst = [os.path.join(out_dir, os.path.basename(os.path.dirname(p)), os.path.basename(p)) for p in paths]
+        for d in dst:
+            os.makedirs(os.path.dirname(d), exist_ok=True)
+    outs = [create_output(d, ncols, nrows, gt, projection, prod) for d, prod in zip(dst, products)]
+    bands = [o.GetRasterBand(1) for o in outs]
+
+    ##rows per block so that the blocks in flight of all dates with halo and float64 intermediates fit the budget
+    halo = size_y // 2
+    block_rows = max(int(max_block_bytes / (2 * threads * len(paths) * ncols * 8 * 3)) - 2 * halo, 1)
+
+    def _process(row, n, read_row, read_n):
+        stack = np.stack([read_decoded(p, yoff=read_row, ysize=read_n) for p in paths]).astype(np.float64)
+        if dB:
+            stack = 10 ** (stack / 10)
+        valid = np.isfinite(stack) & (stack > 0)
+        stack[~valid] = 0
+        means = np.empty_like(stack)
+        for k in range(len(paths)):
+            count = box_sum(valid[k].astype(np.float64), size_x, size_y)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                means[k] = np.where(count > 0, box_sum(stack[k], size_x, size_y) / count, 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(valid & (means > 0), stack / means, 0).sum(axis=0)
+            n_valid = valid.sum(axis=0)
+            out = np.where(valid, means * ratio / np.maximum(n_valid, 1), np.nan)
+        cut = slice(row - read_row, row - read_row + n)
+        out = out[:, cut].astype(np.float32)
+        if dB:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                out = (10 * np.log10(out)).astype(np.float32)
+        return out
+
+    def _write(block, out):
+        row = block[0]
+        for k, band in enumerate(bands):
+            if products[k] is not None:
+                band.WriteArray(encode_array(out[k], get_encoding(products[k])), 0, row)
+            else:
+                band.WriteArray(out[k], 0, row)
+
+    run_blocks(_process, row_blocks(nrows, block_rows, halo), _write, threads=threads)
+    for band in bands:
+        band.FlushCache()
+    outs = None
+    bands = None
+    if out_dir is None:
+        for d, p in zip(dst, paths):
+            os.replace(d, p)
+        return list(paths)
+    return dst
+
+
+def filter_tracks(out_dir, shapefile, relOrbs, pol, size= 5, dB= False, threads= 4, window= None):
+    """[filter_tracks]
+    quegan_filter of the time series of every relative orbit and polarization of the INT outputs of an AOI, the
+    filtered outputs are written to the folder MT next to them
+    Parameters
+    ----------
+        out_dir: str
+            output folder of S1_INT_proc
+        shapefile: str
+            AOI, its name is the subfolder of the outputs
+        relOrbs: list
+            relative orbits
+        pol: str or list
+            polarizations, "full" for all
+        size: int
+            window of the local means, default is 5
+        dB: bool
+            outputs are in dB, default false
+        threads: int
+            number of worker threads, default is 4
+        window: int or None
+            number of latest dates filtered together, e.g. when new dates are added one by one, default is None (all)
+        Returns
+        -------
+        list of paths of the filtered outputs
+    """
+    if pol == "full":
+        pol = ["VV", "VH", "HH", "HV"]
+    elif isinstance(pol, str):
+        pol = [pol]
+    aoiname = os.path.splitext(os.path.basename(shapefile))[0]
+    track_dir = f'{out_dir}/{aoiname}'
+    out = []
+    for relOrb in sorted(set(relOrbs)):
+        for p in pol:
+            paths = find_track_outputs(track_dir, relOrb, p)
+            if window is not None:
+                paths = paths[-window:]
+            if len(paths) > 1:
+                out += quegan_filter(paths, os.path.join(track_dir, "MT"), size_x= size, size_y= size, dB= dB, threads= threads)
+            elif len(paths) == 1:
+                print(f'Multi-temporal filter needs more than one date, skipping relOrb {relOrb} {p}')
+    return out
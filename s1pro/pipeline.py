@@ -0,0 +1,136 @@
+import os
+import queue
+import threading
+import asf_search as asf
+
+from .download_ASF import asf_search_aoi, download_jobs, download_files
+from .s1_slc_proc import S1_SLC_proc
+from .multitemporal import filter_tracks
+
+
+def plan_units(jobs):
+    """[plan_units]
+    work units of a download: the slices of one date per relative orbit and the pairs of consecutive dates for COH
+    Parameters
+    ----------
+        jobs: list
+            dicts of download_jobs with the keys filename, track and date
+        Returns
+        -------
+        tuple of a dict (track, date) to the set of file names and a list of ((track, date1), (track, date2)) pairs
+    """
+    dates = dict()
+    for job in jobs:
+        dates.setdefault((job["track"], job["date"]), set()).add(job["filename"])
+    pairs = []
+    for track in sorted(set(k[0] for k in dates)):
+        track_dates = sorted(k for k in dates if k[0] == track)
+        pairs.extend(zip(track_dates[:-1], track_dates[1:]))
+    return dates, pairs
+
+
+def S1_stream_proc(download, proc):
+    """[S1_stream_proc]
+    download and process at the same time: every date is processed as soon as all its slices are downloaded,
+    every coherence pair as soon as both of its dates are
+    Parameters
+    ----------
+        download: dict
+            arguments of asf_downloader, see the Download section of the config file
+        proc: dict
+            arguments of S1_SLC_proc, see the Processing section of the config file
+        Returns
+        -------
+        dict of download status per file name
+        Note
+        ----
+        Downloads run in a background thread and publish each finished file to a queue, the planner processes the
+        work units in the calling thread in the order they become complete. Dates with a failed download and the
+        pairs using them are left out, failed work units are reported and the others go on. The multi-temporal
+        filter runs once after all dates.
+    """
+    ##S1_INT_proc validates this for every date, the filter of the whole series runs here
+    if proc.get("mt_speckle", False) == True and (proc.get("shapefile") is None or proc.get("grid_align", False) == False):
+        raise ValueError('mt_speckle requires a shapefile and grid_align')
+    download = dict(download)
+    download_dir = download.pop("download_dir")
+    username = download.pop("username", None)
+    password = download.pop("password", None)
+    threads = download.pop("processes", 1)
+    subswaths = download.pop("subswaths", None)
+    polarizations = download.pop("polarizations", None)
+    store = {k: download.pop(k, None) for k in ("store_dir", "store_gb", "project")}
+    session = None
+    if download.get("burst_filter") == "annotation":
+        session = asf.ASFSession().auth_with_creds(username, password)
+    results = asf_search_aoi(**download, session= session)
+    jobs = download_jobs(results)
+    dates, pairs = plan_units(jobs)
+
+    landed = queue.Queue()
+    status = dict()
+
+    def _download():
+        try:
+            status.update(download_files(jobs, download_dir,
+                                         session_factory= lambda: asf.ASFSession().auth_with_creds(username, password),
+                                         threads= threads, callback= lambda job, s: landed.put((job, s)),
+                                         subswaths= subswaths, polarizations= polarizations, **store))
+        finally:
+            ##end of the downloads
+            landed.put(None)
+
+    thread = threading.Thread(target=_download, daemon=True)
+    thread.start()
+
+    ##reduced products are written as .SAFE folders
+    def _local(f):
+        return os.path.join(download_dir, f.replace(".zip", ".SAFE") if subswaths is not None else f)
+
+    done = set()
+    dispatched = set()
+    failed = set()
+    coh_proc = proc.get("coh_proc", False)
+    ##the multi-temporal filter runs once over the complete series after the downloads
+    date_proc = dict(proc, coh_proc= False, mt_speckle= False)
+    pair_proc = dict(proc, int_proc= False, ha_proc= False, preview_proc= False)
+    while True:
+        item = landed.get()
+        if item is None:
+            break
+        job, s = item
+        if s == "failed":
+            continue
+        done.add(job["filename"])
+        key = (job["track"], job["date"])
+        if key not in dispatched and dates[key] <= done:
+            dispatched.add(key)
+            print(f'Complete: relOrb {key[0]} {key[1]}')
+            scenes = sorted(_local(f) for f in dates[key])
+            try:
+                S1_SLC_proc(**date_proc, scenes= scenes)
+            except Exception as e:
+                ##the downloads go on, the remaining units are processed
+                print(f'Failed: relOrb {key[0]} {key[1]}: {e}')
+                failed.add(key)
+        if coh_proc == True:
+            for pair in pairs:
+                if pair not in dispatched and pair[0] in dispatched and pair[1] in dispatched and failed.isdisjoint(pair):
+                    dispatched.add(pair)
+                    print(f'Complete: relOrb {pair[0][0]} {pair[0][1]} {pair[1][1]}')
+                    scenes = sorted(_local(f) for d in pair for f in dates[d])
+                    try:
+                        S1_SLC_proc(**pair_proc, scenes= scenes)
+                    except Exception as e:
+                        print(f'Failed: relOrb {pair[0][0]} {pair[0][1]} {pair[1][1]}: {e}')
+                        failed.add(pair)
+    thread.join()
+    for key in dates:
+        if key not in dispatched:
+            print(f'Skip: relOrb {key[0]} {key[1]} is incomplete')
+    if proc.get("int_proc", False) == True and proc.get("mt_speckle", False) == True:
+        filter_tracks(proc["outdir_int"], proc["shapefile"], [k[0] for k in dates], proc.get("pol", "full"),
+                      size= proc.get("mt_win_size", 5), dB= proc.get("l2db_arg", True), threads= proc.get("native_threads", 4))
+    if len(failed) > 0:
+        print(f'Failed: {len(failed)} work units, see above')
+    return status
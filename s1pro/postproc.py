@@ -0,0 +1,181 @@
+import math
+import threading
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+from .encoding import get_encoding, encode_array, decode_array, update_stats, create_output
+from .blocks import row_blocks, run_blocks
+
+
+## union of all AOI features in the coordinate system of a raster
+def _aoi_wkt(shapefile, projection):
+    vds = ogr.Open(shapefile)
+    layer = vds.GetLayer()
+    src_srs = layer.GetSpatialRef()
+    dst_srs = osr.SpatialReference(wkt=projection)
+    src_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    dst_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    trans = osr.CoordinateTransformation(src_srs, dst_srs)
+    union = None
+    for feat in layer:
+        geom = feat.GetGeometryRef().Clone()
+        geom.Transform(trans)
+        union = geom if union is None else union.Union(geom)
+    vds = None
+    return union.ExportToWkt()
+
+## pixel window of the output in the source raster
+def _output_window(gt, grid= None, bounds= None):
+    eps = 1e-6
+    if grid is not None:
+        xmin, ymin, xmax, ymax = grid["bounds"]
+        col0 = (xmin - gt[0]) / gt[1]
+        row0 = (gt[3] - ymax) / -gt[5]
+        if abs(gt[1] - grid["res"]) > eps * grid["res"] or abs(col0 - round(col0)) > eps or abs(row0 - round(row0)) > eps:
+            raise ValueError('raster is not aligned to the target grid, enable grid_align in Terrain-Correction')
+        return int(round(col0)), int(round(row0)), grid["ncols"], grid["nrows"]
+    xmin, ymin, xmax, ymax = bounds
+    col0 = math.floor((xmin - gt[0]) / gt[1] + eps)
+    col1 = math.ceil((xmax - gt[0]) / gt[1] - eps)
+    row0 = math.floor((gt[3] - ymax) / -gt[5] + eps)
+    row1 = math.ceil((gt[3] - ymin) / -gt[5] - eps)
+    return col0, row0, col1 - col0, row1 - row0
+
+
+## window of a raster aligned to the same lattice, pixels outside of it are NaN
+def _read_aligned(band, ncols, nrows, col, row, width, height):
+    arr = np.full((height, width), np.nan, dtype=np.float32)
+    c0, c1 = max(col, 0), min(col + width, ncols)
+    r0, r1 = max(row, 0), min(row + height, nrows)
+    if c1 > c0 and r1 > r0:
+        arr[r0 - row:r1 - row, c0 - col:c1 - col] = band.ReadAsArray(c0, r0, c1 - c0, r1 - r0)
+    return arr
+
+
+def postprocess(src, dst, l2dB= False, shapefile= None, bounds= None, grid= None, product= None, stats= None,
+                normalize= None, block_rows= 256, threads= 4):
+    """[postprocess]
+    single streaming pass over a Terrain-Correction output: dB conversion, nodata handling, AOI cut and
+    masking and optional compact encoding
+    Parameters
+    ----------
+        src: str
+            path of float GeoTIFF written by SNAP, 0 and non-finite values are nodata
+        dst: str
+            path of the output GeoTIFF
+        l2dB: bool
+            convert linear values to dB, default false
+        shapefile: str or None
+            AOI, pixels outside its polygons are set to nodata
+        bounds: list or None
+            [xmin, ymin, xmax, ymax] in the raster CRS to cut, snapped outwards to the raster pixels
+        grid: dict or None
+            target grid of grid.get_grid, the raster must be aligned to it and is cut to its bounds
+        product: str or None
+            product type of encoding.get_encoding, float32 with NaN nodata is written if None
+        stats: dict or None
+            accumulator of encoding.init_stats, updated with the written values
+        normalize: str or None
+            raster on the lattice of src the values are divided by before dB conversion, e.g. the cached
+            illuminated area normalization of geometry_cache.geometry_lut, pixels without a positive value are nodata
+        block_rows: int
+            number of rows per block, default is 256
+        threads: int
+            number of worker threads reading and processing blocks, default is 4
+        Returns
+        -------
+        path of the output
+        Note
+        ----
+        At most 2 * threads blocks are held in memory. Every worker opens its own GDAL handles, blocks
+        are written in order by the calling thread.
+    """
+    ds = gdal.Open(src)
+    gt = ds.GetGeoTransform()
+    projection = ds.GetProjection()
+    src_cols, src_rows = ds.RasterXSize, ds.RasterYSize
+    src_nodata = ds.GetRasterBand(1).GetNoDataValue()
+    ds = None
+    ##SNAP marks nodata with 0 without writing a nodata tag
+    if src_nodata is None:
+        src_nodata = 0.0
+    if grid is not None or bounds is not None:
+        col0, row0, ncols, nrows = _output_window(gt, grid, bounds)
+    else:
+        col0, row0, ncols, nrows = 0, 0, src_cols, src_rows
+    out_gt = (gt[0] + col0 * gt[1], gt[1], 0.0, gt[3] + row0 * gt[5], 0.0, gt[5])
+    aoi_wkt = _aoi_wkt(shapefile, projection) if shapefile is not None else None
+    encoding = get_encoding(product) if product is not None else None
+    if normalize is not None:
+        nds = gdal.Open(normalize)
+        norm_gt = nds.GetGeoTransform()
+        norm_cols, norm_rows = nds.RasterXSize, nds.RasterYSize
+        nds = None
+        ##offset of the source raster in the normalization raster
+        norm_col0 = (gt[0] - norm_gt[0]) / gt[1]
+        norm_row0 = (gt[3] - norm_gt[3]) / gt[5]
+        if abs(norm_gt[1] - gt[1]) > 1e-6 * abs(gt[1]) or abs(norm_col0 - round(norm_col0)) > 1e-6 or \
+                abs(norm_row0 - round(norm_row0)) > 1e-6:
+            raise ValueError(f'{normalize} is not aligned to {src}, enable grid_align in Terrain-Correction')
+        norm_col0, norm_row0 = int(round(norm_col0)), int(round(norm_row0))
+
+    local = threading.local()
+
+    def _process_block(row, n, read_row, read_n):
+        if not hasattr(local, "band"):
+            local.ds = gdal.Open(src)
+            local.band = local.ds.GetRasterBand(1)
+        arr = np.full((n, ncols), np.nan, dtype=np.float32)
+        ##read the part of the block that overlaps the source raster
+        c0, c1 = max(col0, 0), min(col0 + ncols, src_cols)
+        r0, r1 = max(row0 + row, 0), min(row0 + row + n, src_rows)
+        if c1 > c0 and r1 > r0:
+            vals = local.band.ReadAsArray(c0, r0, c1 - c0, r1 - r0).astype(np.float32)
+            vals[vals == src_nodata] = np.nan
+            if normalize is not None:
+                if not hasattr(local, "norm_band"):
+                    local.norm_ds = gdal.Open(normalize)
+                    local.norm_band = local.norm_ds.GetRasterBand(1)
+                norm = _read_aligned(local.norm_band, norm_cols, norm_rows, c0 + norm_col0, r0 + norm_row0, c1 - c0, r1 - r0)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    vals = np.where(norm > 0, vals / norm, np.nan).astype(np.float32)
+            arr[r0 - row0 - row:r1 - row0 - row, c0 - col0:c1 - col0] = vals
+        if l2dB:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                arr = np.where(arr > 0, 10 * np.log10(arr), np.nan).astype(np.float32)
+        if aoi_wkt is not None:
+            arr[~_rasterize_block(row, n)] = np.nan
+        return arr
+
+    def _rasterize_block(row, n):
+        if not hasattr(local, "layer"):
+            srs = osr.SpatialReference(wkt=projection)
+            local.vds = ogr.GetDriverByName("Memory").CreateDataSource("")
+            local.layer = local.vds.CreateLayer("aoi", srs, ogr.wkbUnknown)
+            feat = ogr.Feature(local.layer.GetLayerDefn())
+            feat.SetGeometry(ogr.CreateGeometryFromWkt(aoi_wkt))
+            local.layer.CreateFeature(feat)
+        mds = gdal.GetDriverByName("MEM").Create("", ncols, n, 1, gdal.GDT_Byte)
+        mds.SetGeoTransform((out_gt[0], out_gt[1], 0.0, out_gt[3] + row * out_gt[5], 0.0, out_gt[5]))
+        mds.SetProjection(projection)
+        gdal.RasterizeLayer(mds, [1], local.layer, burn_values=[1])
+        return mds.GetRasterBand(1).ReadAsArray().astype(bool)
+
+    out_ds = create_output(dst, ncols, nrows, out_gt, projection, product)
+    out_band = out_ds.GetRasterBand(1)
+
+    def _write(block, arr):
+        row = block[0]
+        if encoding is not None:
+            codes = encode_array(arr, encoding)
+            out_band.WriteArray(codes, 0, row)
+            arr = decode_array(codes, encoding["scale"], encoding["offset"], encoding["nodata"])
+        else:
+            out_band.WriteArray(arr, 0, row)
+        if stats is not None:
+            update_stats(stats, arr)
+
+    run_blocks(_process_block, row_blocks(nrows, block_rows), _write, threads=threads)
+    out_band.FlushCache()
+    out_ds = None
+    return dst
@@ -1,18 +1,46 @@
+import os
 import logging
 from .download_ASF import asf_downloader
 from .s1_slc_proc import S1_SLC_proc
+from .pipeline import S1_stream_proc
+from .watch import S1_watch_proc
 from .auxils import get_config
+from .store import release_project, evict_store
 
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
 
-def process(config_file):
+def process(config_file, watch= False, release= False):
     general = get_config(config_file, 'General')
     download = get_config(config_file, 'Download')
+    proc = get_config(config_file, 'Processing')
+    proc.update(general)
+    watch_interval = proc.pop('watch_interval', 600)
+    stream = download.pop('stream', False)
+    ##the project is finished, its products may be removed from the store
+    if release == True:
+        if download.get('store_dir') is None:
+            raise ValueError('release requires a store_dir')
+        project = download.get('project') or os.path.abspath(download['download_dir'])
+        print(f'Released {release_project(download["store_dir"], project)} products of {project}')
+        if download.get('store_gb') is not None:
+            evict_store(download['store_dir'], download['store_gb'] * 1024**3)
+        return
+    ##reduced .SAFE folders with the subswaths and polarizations of the processing
+    if download.pop('partial', False) == True:
+        pol = proc.get('pol', 'full')
+        download['subswaths'] = proc.get('iws', ["IW1", "IW2", "IW3"])
+        download['polarizations'] = None if pol == 'full' else ([pol] if isinstance(pol, str) else pol)
     if download['download'] == True:
         download.pop('download', None)
         download.update(general)
+        ##process dates while the remaining ones are downloaded
+        if stream == True:
+            S1_stream_proc(download, proc)
+            return
         asf_downloader(**download)
 
-    proc = get_config(config_file, 'Processing')
-    proc.update(general)
+    ##process new acquisitions of the data folder as they land
+    if watch == True:
+        S1_watch_proc(proc, interval= watch_interval)
+        return
     S1_SLC_proc(**proc)
@@ -0,0 +1,169 @@
+import io
+import threading
+from collections import OrderedDict
+from zipfile import ZipFile
+import requests
+
+
+##size of the cached blocks of a remote file
+BLOCK_SIZE = 256 * 1024
+##number of remote files kept open, each with its cached blocks
+_MAX_FILES = 8
+
+_session = None
+_files = OrderedDict()
+_lock = threading.Lock()
+
+
+def set_session(session):
+    """[set_session]
+    session used for the range requests of remote zips, e.g. an authenticated asf_search.ASFSession
+    Parameters
+    ----------
+        session: requests.Session
+    """
+    global _session
+    with _lock:
+        _session = session
+        _files.clear()
+
+
+def is_remote(path):
+    """ true if path is a http(s) URL """
+    return str(path).startswith(("http://", "https://"))
+
+
+class RemoteFile(io.RawIOBase):
+    """[RemoteFile]
+    read-only, seekable file over HTTP range requests with a cache of fixed size blocks
+    Parameters
+    ----------
+        url: str
+            URL of the file, redirects are resolved once
+        session: requests.Session or None
+            session of the requests, default is a new requests.Session
+        block_size: int
+            size of the cached blocks in bytes, default is BLOCK_SIZE
+        max_blocks: int
+            number of cached blocks, default is 256
+    """
+    def __init__(self, url, session= None, block_size= BLOCK_SIZE, max_blocks= 256):
+        self.session = session if session is not None else requests.Session()
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+        self.requests = 0
+        self.pos = 0
+        ##the last bytes give the size in Content-Range, the end of central directory is read from there anyway
+        with self.session.get(url, headers={"Range": f"bytes=-{block_size}"}, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise IOError(f'{url} does not support range requests')
+            self.url = r.url
+            self.size = int(r.headers["Content-Range"].split("/")[-1])
+            tail = r.content
+        self.requests += 1
+        tail_start = self.size - len(tail)
+        for n in range(-(-tail_start // block_size), (self.size - 1) // block_size + 1):
+            start = n * block_size - tail_start
+            self._store(n, tail[start:start + block_size])
+
+    def _store(self, n, data):
+        ##keep only complete blocks and the last one
+        if len(data) == self.block_size or n == (self.size - 1) // self.block_size:
+            self.blocks[n] = data
+            self.blocks.move_to_end(n)
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+
+    def _fetch(self, first, last):
+        ##one request for the missing blocks between first and last
+        start = first * self.block_size
+        stop = min((last + 1) * self.block_size, self.size) - 1
+        r = self.session.get(self.url, headers={"Range": f"bytes={start}-{stop}"}, timeout=60)
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise IOError(f'{self.url} does not support range requests')
+        self.requests += 1
+        blocks = dict()
+        for n in range(first, last + 1):
+            blocks[n] = r.content[(n - first) * self.block_size:(n - first + 1) * self.block_size]
+            self._store(n, blocks[n])
+        return blocks
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence= io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        self.pos = max(self.pos, 0)
+        return self.pos
+
+    def read(self, n= -1):
+        if n is None or n < 0:
+            n = self.size - self.pos
+        n = min(n, self.size - self.pos)
+        if n <= 0:
+            return b""
+        first = self.pos // self.block_size
+        last = (self.pos + n - 1) // self.block_size
+        ##reads beyond the cache are passed through
+        if last - first + 1 > self.max_blocks:
+            r = self.session.get(self.url, headers={"Range": f"bytes={self.pos}-{self.pos + n - 1}"}, timeout=60)
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise IOError(f'{self.url} does not support range requests')
+            self.requests += 1
+            self.pos += n
+            return r.content
+        ##cached blocks of the read are renewed first, so storing the missing ones cannot evict them
+        blocks = dict()
+        for b in range(first, last + 1):
+            if b in self.blocks:
+                self.blocks.move_to_end(b)
+                blocks[b] = self.blocks[b]
+        missing = [b for b in range(first, last + 1) if b not in blocks]
+        if len(missing) > 0:
+            blocks.update(self._fetch(missing[0], missing[-1]))
+        data = b"".join(blocks[b] for b in range(first, last + 1))
+        start = self.pos - first * self.block_size
+        self.pos += n
+        return data[start:start + n]
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def open_zip(path):
+    """[open_zip]
+    ZipFile of a local path or of a URL read with range requests, remote files are kept open with their cached blocks
+    Parameters
+    ----------
+        path: str
+            zip file or http(s) URL of it
+        Returns
+        -------
+        zipfile.ZipFile
+    """
+    if not is_remote(path):
+        return ZipFile(path)
+    with _lock:
+        if path not in _files:
+            _files[path] = RemoteFile(path, _session)
+            while len(_files) > _MAX_FILES:
+                _files.popitem(last=False)
+        _files.move_to_end(path)
+        return ZipFile(_files[path])
@@ -0,0 +1,134 @@
+import os
+import math
+
+
+##heap in GB per burst and bursts per thread of the graph types, measured on full IW slices
+GRAPH_COST = {
+    "split": (0.15, 4),
+    "int": (0.25, 2),
+    "burst": (0.5, 1),
+    "coh": (0.6, 1),
+    "h2a": (0.4, 1),
+    "tc": (0.3, 2),
+    }
+##bursts of a subswath of one slice
+SLICE_BURSTS = 9
+##heap of the JVM without tiles, in GB
+_BASE_HEAP = 1.5
+##part of the memory left to the system and the native post-processing
+_RESERVE = 0.2
+
+_workers = 1
+
+
+def set_workers(workers):
+    """[set_workers]
+    number of gpt processes running at the same time on the host, e.g. parallel runs of s1pro
+    Parameters
+    ----------
+        workers: int
+    """
+    global _workers
+    _workers = max(1, int(workers))
+
+
+## memory limit of the cgroup of the process in bytes, None without limit
+def _cgroup_memory():
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 2**60:
+            return int(value)
+    return None
+
+## cpu limit of the cgroup of the process, None without limit
+def _cgroup_cpus():
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        return None
+    if quota == "max":
+        return None
+    return max(1, int(int(quota) / int(period)))
+
+
+def host_resources():
+    """[host_resources]
+    cores and memory available to the process, limited by its cpu affinity and cgroup
+    Parameters
+    ----------
+        Returns
+        -------
+        tuple of the number of cores and the memory in bytes
+    """
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    cgroup_cpus = _cgroup_cpus()
+    if cgroup_cpus is not None:
+        cores = min(cores, cgroup_cpus)
+    cgroup_memory = _cgroup_memory()
+    if cgroup_memory is not None:
+        memory = min(memory, cgroup_memory)
+    return cores, memory
+
+
+def gpt_args(gpt_paras, graph, bursts= None):
+    """[gpt_args]
+    arguments of gpt for a graph: a static list is passed through, "auto" sizes threads, tile cache and heap from
+    the share of the host of one gpt worker and the bursts of the graph
+    Parameters
+    ----------
+        gpt_paras: list, str or None
+            arguments of the config file, e.g. ["-e", "-x", "-c", "2G", "-q", "2"], or "auto"
+        graph: str
+            type of the graph, one of GRAPH_COST
+        bursts: int or None
+            number of bursts read by the graph, default is None (the whole share of the host)
+        Returns
+        -------
+        list of arguments or None
+        Examples
+        --------
+        >>> gpt_args("auto", "split", bursts= 3)
+        ['-e', '-x', '-J-Xmx2048M', '-c', '1228M', '-q', '1']
+    """
+    if gpt_paras != "auto":
+        return gpt_paras
+    cores, memory = host_resources()
+    share_cores = max(1, cores // _workers)
+    share_gb = memory * (1 - _RESERVE) / _workers / 1024**3
+    heap_per_burst, bursts_per_thread = GRAPH_COST[graph]
+    if bursts is None:
+        heap_gb = share_gb
+        threads = share_cores
+    else:
+        ##small graphs stop reserving the whole host, big ones get heap for their tiles
+        heap_gb = min(max(_BASE_HEAP + heap_per_burst * bursts, 2), share_gb)
+        threads = min(max(1, math.ceil(bursts / bursts_per_thread)), share_cores)
+    heap_mb = int(heap_gb * 1024)
+    ##SNAP keeps tiles in about 60% of the heap, the rest is needed by the operators
+    return ["-e", "-x", f"-J-Xmx{heap_mb}M", "-c", f"{int(heap_mb * 0.6)}M", "-q", str(threads)]
+
+
+def count_bursts(iw_bursts, IWs, slices):
+    """[count_bursts]
+    bursts read per subswath by the graphs of a date
+    Parameters
+    ----------
+        iw_bursts: dict or None
+            first and last burst index of the AOI per subswath, None for all bursts of the slices
+        IWs: list
+            subswaths, e.g. ["IW1", "IW2"]
+        slices: int
+            number of assembled slices
+        Returns
+        -------
+        dict of subswath to number of bursts
+    """
+    if iw_bursts is None:
+        return {iw: SLICE_BURSTS * slices for iw in IWs}
+    return {iw: int(iw_bursts[iw][1]) - int(iw_bursts[iw][0]) + 1 for iw in IWs}
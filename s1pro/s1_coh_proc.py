@@ -1,22 +1,30 @@
 import pyroSAR
-from pyroSAR.snap.auxil import parse_recipe, parse_node, gpt, execute
+from pyroSAR.snap.auxil import parse_recipe, parse_node, execute
 from pyroSAR import  identify_many
 from spatialist.ancillary import finder
 from spatialist import crsConvert, Vector, Raster
 import os
 import glob
 import datetime
-import geopandas as gpd
 from spatialist import gdalwarp
-import pathlib
 
-from auxils import get_burst_geometry, remove
+from .auxils import remove
+from .encoding import encode_raster, init_stats, raster_stats
+from .datacube import get_cube_path, append_date
+from .stac import get_catalog_dir, update_catalog
+from .grid import get_grid, grid_warp_options, align_terrain_correction
+from .postproc import postprocess
+from .staging import stage_scenes
+from .resources import count_bursts
+from .scheduler import admit_gpt
+from .bursts import aoi_slices, assembly_burst_range, read_slices, split_product
 
 def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res=20, t_crs=32633,  out_format= "GeoTIFF",gpt_paras= None, pol= 'full',\
                    IWs= ["IW1", "IW2", "IW3"], ext_DEM= False, ext_DEM_noDatVal= -9999, ext_Dem_file= None, msk_noDatVal= False,\
                    ext_DEM_EGM= True, BGC_demResamp= "BICUBIC_INTERPOLATION", TC_demResamp= "BILINEAR_INTERPOLATION", osvPath= None,\
                    cohWinRg= 11, cohWinAz= 3, ml_RgLook= 4, ml_AzLook= 1, firstBurstIndex= None, lastBurstIndex= None, clean_tmpdir= True, osvFail= False,
-                   tpm_format = "BEAM-DIMAP"):
+                   tpm_format = "BEAM-DIMAP", out_encoding= "float32", out_cube= False, out_stac= False, grid_align= False, grid_origin= (0, 0), native_postproc= False, postproc_threads= 4,\
+                   stage_dir= None, stage_gb= 100, split_cache= None):
     
     """[S1_InSAR_coh_proc]
     function for processing InSAR coherences from S-1 SLC files in SNAP
@@ -34,8 +42,8 @@ def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res
             EPSG code of target coordinate system, default is 4326
         out_format: str
             format of final output, formats supported by SNAP, default is GeoTiff
-        gpt_paras: none or list
-            a list of additional arguments to be passed to the gpt call
+        gpt_paras: none, list or "auto"
+            a list of additional arguments to be passed to the gpt call, "auto" sizes them per graph, see resources.gpt_args
         pol: str or list or "full"
             polaristations to process, "full" processes all available polarizations, default is "full"
         IWs: str or list
@@ -72,6 +80,30 @@ def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res
             specify path to locally stored OSVs, if none default OSV path of SNAP is set
         tpm_format: str
             specify the SNAP format for temporary files: "BEAM-DIMAP" or "ZNAP". "BEAM-DIMAP" default.
+        out_encoding: str
+            "float32" keeps SNAP output, "compact" stores coherence as scaled uint8 GeoTIFF, default is "float32"
+        out_cube: bool
+            append each pair to a zarr datacube per AOI and relative orbit at the date of the later acquisition, requires grid_align, default false
+        out_stac: bool
+            add each pair as item with band statistics to a static STAC catalog in the output folder, default false
+        grid_align: bool
+            snap Terrain-Correction to a pixel aligned grid and cut AOI outputs to the grid stored per AOI,
+            so all dates share identical geotransforms, default false
+        grid_origin: tuple
+            x and y of a corner of the target grid in the target CRS, default is (0, 0)
+        native_postproc: bool
+            replace SNAP dB conversion and the gdalwarp AOI cut by one streaming NumPy pass with AOI masking, default false
+        postproc_threads: int
+            number of threads of the native post-processing, default is 4
+        stage_dir: str or None
+            folder on fast local disk the manifest, annotation and measurement members of the selected IWs and
+            polarizations are extracted to once per scene, SNAP then reads the staged .SAFE instead of inflating the
+            zip in every coherence graph, default is None (SNAP reads the zip files)
+        stage_gb: int, float
+            size of stage_dir in GB, least recently used scenes are removed beyond, default is 100
+        split_cache: str or None
+            folder the orbit corrected TOPSAR-Split of every date, IW and polarization is written to once, so the
+            next pair of the date, e.g. of a later run, only splits the new date, default is None (split in the graph)
         Returns
         -------
         Raster files of selected output format for selected H-alpha features
@@ -172,6 +204,9 @@ def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res
         raise ValueError(message.format('demResamplingMethod', '\n- '.join(reSamp_LookUp)))
     if TC_demResamp not in reSamp_LookUp:
         raise ValueError(message.format('imgResamplingMethod', '\n- '.join(reSamp_LookUp)))
+    ##all dates of a cube share one grid, so its origin must not depend on the scene
+    if out_cube == True and grid_align == False:
+        raise ValueError('out_cube requires grid_align')
         
     ##query unique dates of files: selection of paired images for coherence estimation
     dates_info= []
@@ -202,8 +237,12 @@ def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res
     for i in range(0, len(pair_dates_idx)-1):
         fps1= list(map(fps_lst.__getitem__, pair_dates_idx[i])) 
         fps2= list(map(fps_lst.__getitem__, pair_dates_idx[i+1]))  
-        
-        fps_paired= [fps1, fps2]
+        ##slices without bursts in the AOI are neither read nor assembled
+        if shapefile:
+            fps1 = aoi_slices(fps1, IWs, pol[0], shapefile)
+            fps2 = aoi_slices(fps2, IWs, pol[0], shapefile)
+            if len(fps1) == 0 or len(fps2) == 0:
+                continue
         
         
         info_lst=[pyroSAR.identify(fps1[0]),\
@@ -235,139 +274,28 @@ def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res
         datetime2= info_lst[1].start
         ##exception handling against SNAP errors
         try:
-            date_uniq=[date1, date2]
             ##manage numbers of scenes needed per time step to estimate coherence, initiate sliceAssembly if necessary
             graph_dir = f'{tmpdir}/graphs'
             isExist = os.path.exists(graph_dir)
             if not isExist:
                 os.makedirs(graph_dir)
-            date_uniq=[date1, date2]
-            ##manage numbers of scenes needed per time step to estimate coherence, initiate sliceAssembly if necessary
-            if len(fps1)== 1 and len(fps2) == 1:
-                slcAs_fps_slv= fps1[0]
-                if shapefile:
-                    bursts = get_burst_geometry(slcAs_fps_slv, target_subswaths = [ x.lower() for x in IWs], polarization = pol[0])
-                    polygon = gpd.read_file(shapefile)
-                    inter = bursts.overlay(polygon, how='intersection')
-                    iw_list = inter['subswath'].unique()
-                    iw_bursts_slv = dict()
-                    for ib in iw_list:
-                        iw_inter = inter[inter['subswath'] == ib.upper()]
-                        minb = iw_inter['burst'].min()
-                        maxb = iw_inter['burst'].max()
-                        iw_bursts_slv[ib] =  [minb, maxb]
-                    IWs_slv = list(iw_bursts_slv.keys())
-                
-                slcAs_fps_ms= fps2[0]
-                if shapefile:
-                    bursts = get_burst_geometry(slcAs_fps_ms, target_subswaths = [ x.lower() for x in IWs], polarization = pol[0])
-                    polygon = gpd.read_file(shapefile)
-                    inter = bursts.overlay(polygon, how='intersection')
-                    iw_list = inter['subswath'].unique()
-                    iw_bursts_ms = dict()
-                    for ib in iw_list:
-                        iw_inter = inter[inter['subswath'] == ib.upper()]
-                        minb = iw_inter['burst'].min()
-                        maxb = iw_inter['burst'].max()
-                        iw_bursts_ms[ib] =  [minb, maxb]
-                    IWs_ms = list(iw_bursts_ms.keys())
-
-                    IWs = list(set(IWs_ms + IWs_slv))
-            else:
-                if len(fps1) == 1 and len(fps2) > 1: 
-                    slcAs_fps_slv= fps1[0]
-                    idx_start= 1
-                    idx_stop= len(fps_paired)
-                elif len(fps1) > 1 and len(fps2) == 1:
-                    slcAs_fps_ms= fps2[0]
-                    idx_start= 0
-                    idx_stop= len(fps_paired)-1
-                else: 
-                    idx_start= 0
-                    idx_stop= len(fps_paired)
-              ## initiate sliceAssembly where the time step consists of more than one scene  
-                for fp in range(idx_start, idx_stop):
-                    workflow_slcAs = parse_recipe("blank")
-                    if fp == 0:
-                        slcAs_name= "S1_relOrb_"+ str(relOrbs[0])+"_COH_"+date_uniq[fp]+"_SLC_slv"
-                        
-                    else:
-                        slcAs_name= "S1_relOrb_"+ str(relOrbs[0])+"_COH_"+date_uniq[fp]+"_SLC_ms"
-                    
-                    slcAs_out= os.path.join(tmpdir, slcAs_name)
-
-                    read1 = parse_node('Read')
-                    read1.parameters['file'] = fps_paired[fp][0]
-                    read1.parameters['formatName'] = formatName
-                    readers = [read1.id]
-
-                    workflow_slcAs.insert_node(read1)
-            
-                    if shapefile:
-                        bursts = get_burst_geometry(fps_paired[fp][0], target_subswaths= [ x.lower() for x in IWs], polarization = pol[0])
-                        polygon = gpd.read_file(shapefile)
-                        inter = bursts.overlay(polygon, how='intersection')
-                        iw_list = inter['subswath'].unique()
-                        iw_bursts = dict()
-                        for ib in iw_list:
-                            iw_inter = inter[inter['subswath'] == ib.upper()]
-                            minb = iw_inter['burst'].min()
-                            maxb = iw_inter['burst'].max()
-                            iw_bursts[ib] =  [minb, maxb]
-                    
-                    for r in range(1, len(fps_paired[fp])):
-                        readn = parse_node('Read')
-                        readn.parameters['file'] = fps_paired[fp][r]
-                        readn.parameters['formatName'] = formatName
-                        workflow_slcAs.insert_node(readn, before= read1.id, resetSuccessorSource=False)
-                        readers.append(readn.id)
-
-                        if shapefile:
-                            bursts = get_burst_geometry(fps_paired[fp][r], target_subswaths = [ x.lower() for x in IWs], polarization = pol[0])
-                            polygon = gpd.read_file(shapefile)
-                            inter = bursts.overlay(polygon, how='intersection')
-                            iw_list = inter['subswath'].unique()
-                            for ib in iw_list:
-                                iw_inter = inter[inter['subswath'] == ib.upper()]
-                                minb = iw_inter['burst'].min()
-                                maxb = iw_inter['burst'].max()
-                                if ib in iw_bursts:
-                                    iw_bursts[ib][1]  =  iw_bursts[ib][1] + maxb
-                                else:
-                                    iw_bursts[ib] =  [minb, maxb]
-                        IWs = list(iw_bursts.keys())
-
-                    slcAs=parse_node("SliceAssembly")
-                    slcAs.parameters["selectedPolarisations"]= pol
-
-                    workflow_slcAs.insert_node(slcAs, before= readers)
-                    read1= slcAs
-
-                    write_slcAs=parse_node("Write")
-                    write_slcAs.parameters["file"]= slcAs_out
-                    write_slcAs.parameters["formatName"]= tpm_format
-
-                    workflow_slcAs.insert_node(write_slcAs, before= slcAs.id)
-
-                    workflow_slcAs.write("Coh_slc_prep_graph")
-
-                    gpt('Coh_slc_prep_graph.xml', gpt_args= gpt_paras, tmpdir= tmpdir)
-
-                ###import sliceAssemblies according to how many files per time step are needed   
-                if len(fps1) > 1 and len(fps2) == 1:
-                    slcAs_fps_slv= glob.glob(os.path.join(tmpdir, "*"+date1+"_SLC_slv"+file_end))
-                elif len(fps1) == 1 and len(fps2) > 1:
-                    slcAs_fps_ms= glob.glob(os.path.join(tmpdir, "*"+date2+"_SLC_ms" + file_end))
-                elif len(fps1) > 1 and len(fps2) > 1: 
-                    slcAs_fps_slv= glob.glob(os.path.join(tmpdir, "*"+date1+"_SLC_slv"+ file_end))
-                    slcAs_fps_ms= glob.glob(tmpdir+"/"+"*"+date2+"_SLC_ms"+ file_end)
-
-                #if len(slcAs_fps_slv) > 1:
-                    #slcAs_fps_slv = slcAs_fps_slv[0]
-                #if len(slcAs_fps_ms) > 1:
-                    #slcAs_fps_ms = slcAs_fps_ms[0]
+            ##SliceAssembly of several slices per date is fused into the coherence graphs below, so only the AOI bursts are read
+            ##burst ranges of the AOI per date, counted by burst ID across the slices, for subswaths covered at both dates
+            iw_bursts_slv = None
+            iw_bursts_ms = None
+            if shapefile:
+                iw_bursts_slv = assembly_burst_range(fps1, IWs, pol[0], shapefile)
+                iw_bursts_ms = assembly_burst_range(fps2, IWs, pol[0], shapefile)
+                IWs = [iw for iw in iw_bursts_ms.keys() if iw in iw_bursts_slv]
+            snap_slv, snap_ms = fps1, fps2
+            n_bursts = count_bursts(iw_bursts_ms, IWs, len(fps2))
+            if stage_dir is not None:
+                snap_slv = stage_scenes(fps1, stage_dir, IWs, pol, stage_gb * 1024**3, postproc_threads)
+                snap_ms = stage_scenes(fps2, stage_dir, IWs, pol, stage_gb * 1024**3, postproc_threads)
 
             ##start coherence estimation for each IW
+            cube_rasters = dict()
+            stac_assets = dict()
             for p in pol:
                 for iw in IWs:
                     #my_source = "coh_"+ iw + "_"+ p+ "_"+ dates[1] +"_"+ dates[0]
@@ -380,59 +308,56 @@ def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res
                     ##coherence calculation per IW
                     workflow_coh=parse_recipe("blank")
 
-                    read1= parse_node("Read")
-                    read1.parameters["file"]= slcAs_fps_ms
-                    
-                    if isinstance(slcAs_fps_ms,list):
-                        query_fps_ms = slcAs_fps_ms[0]
+                    if split_cache is not None:
+                        ##split products of both dates are reused by the neighbouring pairs
+                        ms_split = split_product(split_cache, snap_ms, relOrbs[0], date2, iw, p, iw_bursts_ms[iw] if shapefile else None,
+                                                 orbitType, osvFail, graph_dir, gpt_paras)
+                        slv_split = split_product(split_cache, snap_slv, relOrbs[0], date1, iw, p, iw_bursts_slv[iw] if shapefile else None,
+                                                  orbitType, osvFail, graph_dir, gpt_paras)
+                        read_ms = parse_node("Read")
+                        read_ms.parameters["file"] = ms_split
+                        workflow_coh.insert_node(read_ms)
+                        read_slv = parse_node("Read")
+                        read_slv.parameters["file"] = slv_split
+                        workflow_coh.insert_node(read_slv)
+                        split_ids = [read_ms.id, read_slv.id]
                     else:
-                        query_fps_ms = slcAs_fps_ms
-
-                    if pathlib.Path(query_fps_ms).suffix != file_end:
-                        read1.parameters["formatName"]= formatName
-
-                    workflow_coh.insert_node(read1)
-
-                    aof=parse_node("Apply-Orbit-File")
-                    aof.parameters["orbitType"]= orbitType
-                    aof.parameters["polyDegree"]= 3
-                    aof.parameters["continueOnFail"]= osvFail
-
-                    workflow_coh.insert_node(aof, before= read1.id)
+                        last_node = read_slices(workflow_coh, snap_ms, pol, formatName)
 
-                    ts=parse_node("TOPSAR-Split")
-                    ts.parameters["subswath"]= iw
-                    ts.parameters["selectedPolarisations"]= p
-                    
+                        aof=parse_node("Apply-Orbit-File")
+                        aof.parameters["orbitType"]= orbitType
+                        aof.parameters["polyDegree"]= 3
+                        aof.parameters["continueOnFail"]= osvFail
 
-                    workflow_coh.insert_node(ts, before= aof.id)
+                        workflow_coh.insert_node(aof, before= last_node)
 
-                    if isinstance(slcAs_fps_slv,list):
-                        query_fps_slv = slcAs_fps_slv[0]
-                    else:
-                        query_fps_slv = slcAs_fps_slv
+                        ts=parse_node("TOPSAR-Split")
+                        ts.parameters["subswath"]= iw
+                        ts.parameters["selectedPolarisations"]= p
+                        if shapefile:
+                            ts.parameters["firstBurstIndex"]= iw_bursts_ms[iw][0]
+                            ts.parameters["lastBurstIndex"]= iw_bursts_ms[iw][1]
 
-                    read2 = parse_node('Read')
-                    read2.parameters['file'] = slcAs_fps_slv
-                    
-                    if pathlib.Path(query_fps_slv).suffix != file_end:
-                        read2.parameters['formatName'] = formatName
+                        workflow_coh.insert_node(ts, before= aof.id)
 
-                    workflow_coh.insert_node(read2)
+                        last_node = read_slices(workflow_coh, snap_slv, pol, formatName)
 
-                    aof2= parse_node("Apply-Orbit-File")
-                    aof2.parameters["orbitType"]= orbitType #'Sentinel Restituted (Auto Download)' Sentinel Precise (Auto Download)
-                    aof2.parameters["polyDegree"]= 3
-                    aof2.parameters["continueOnFail"]= osvFail
+                        aof2= parse_node("Apply-Orbit-File")
+                        aof2.parameters["orbitType"]= orbitType #'Sentinel Restituted (Auto Download)' Sentinel Precise (Auto Download)
+                        aof2.parameters["polyDegree"]= 3
+                        aof2.parameters["continueOnFail"]= osvFail
 
-                    workflow_coh.insert_node(aof2, before=read2.id)
+                        workflow_coh.insert_node(aof2, before= last_node)
 
-                    ts2=parse_node("TOPSAR-Split")
-                    ts2.parameters["subswath"]= iw
-                    ts2.parameters["selectedPolarisations"]= p
-                    
+                        ts2=parse_node("TOPSAR-Split")
+                        ts2.parameters["subswath"]= iw
+                        ts2.parameters["selectedPolarisations"]= p
+                        if shapefile:
+                            ts2.parameters["firstBurstIndex"]= iw_bursts_slv[iw][0]
+                            ts2.parameters["lastBurstIndex"]= iw_bursts_slv[iw][1]
 
-                    workflow_coh.insert_node(ts2, before= aof2.id)
+                        workflow_coh.insert_node(ts2, before= aof2.id)
+                        split_ids = [ts.id, ts2.id]
 
                     bgc= parse_node("Back-Geocoding")
                     bgc.parameters["demName"]= demName
@@ -442,7 +367,7 @@ def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res
                     bgc.parameters["resamplingType"]= "BISINC_5_POINT_INTERPOLATION"
                     bgc.parameters["maskOutAreaWithoutElevation"]=msk_noDatVal
 
-                    workflow_coh.insert_node(bgc, before= [ts.id, ts2.id])
+                    workflow_coh.insert_node(bgc, before= split_ids)
 
                     coh= parse_node("Coherence")
                     coh.parameters["subtractFlatEarthPhase"]= True
@@ -467,7 +392,7 @@ def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res
 
                     workflow_coh.insert_node(write_coh, before= tpd.id)
                     workflow_coh.write("Coh_tmp_prep_graph")
-                    execute('Coh_tmp_prep_graph.xml', gpt_args= gpt_paras)
+                    execute('Coh_tmp_prep_graph.xml', gpt_args= admit_gpt(gpt_paras, "coh", n_bursts[iw]))
 
                 tmp_fps= glob.glob(tmpdir+"/"+"S1_relOrb_"+ str(relOrbs[0])+"*"+p +"_"+ date2+"_"+ date1+"_TPD"+ file_end)
 
@@ -478,7 +403,7 @@ def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res
 
                 out = "S1_"+ orbit+"_relOrb_"+ str(relOrbs[0])+"_COH_" + "_"+ p + "_"+ datetime2+"_"+ datetime1
                 
-                if shapefile is not None:
+                if shapefile is not None or native_postproc == True:
                     out_folder = f'{tmpdir}/{out}'
                 else:
                     out_folder = f'{out_dir}/{out}'
@@ -537,21 +462,54 @@ def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res
                 tc.parameters["saveSelectedSourceBand"]= True
                 tc.parameters["outputComplex"]= False
                 tc.parameters["nodataValueAtSea"]= msk_noDatVal
+                if grid_align == True:
+                    align_terrain_correction(tc, t_crs, t_res, grid_origin)
 
                 workflow_tpm.insert_node(tc, before= ml.id)
 
                 write_tpm=parse_node("Write")
                 write_tpm.parameters["file"]= out_path
-                write_tpm.parameters["formatName"]= out_format
+                if native_postproc == True:
+                    write_tpm.parameters["formatName"]= "GeoTIFF"
+                else:
+                    write_tpm.parameters["formatName"]= out_format
 
                 workflow_tpm.insert_node(write_tpm, before= tc.id)
 
                 ##write graph and execute graph
                 workflow_tpm.write("Coh_TPM_continued_proc_graph")
                 #breakpoint()    
-                execute('Coh_TPM_continued_proc_graph.xml', gpt_args= gpt_paras)
-
-                if shapefile is not None:
+                execute('Coh_TPM_continued_proc_graph.xml', gpt_args= admit_gpt(gpt_paras, "tc", sum(n_bursts.values())))
+
+                ##statistics for the STAC catalog are collected in the pass that writes the final output
+                stats = init_stats()
+                if native_postproc == True:
+                    ##dB conversion, nodata handling, AOI cut and masking and encoding in one streaming pass
+                    bounds = None
+                    grid = None
+                    if shapefile is not None:
+                        aoiname = os.path.splitext(os.path.basename(shapefile))[0]
+                        out_folder = f'{out_dir}/{aoiname}/{out}'
+                        final_out = os.path.join(out_folder, out_name)
+                        shp = Vector(shapefile)
+                        shp.reproject(epsg)
+                        extent = shp.extent
+                        bounds = [extent['xmin'], extent['ymin'], extent['xmax'], extent['ymax']]
+                        if grid_align == True:
+                            grid = get_grid(f'{out_dir}/{aoiname}', extent, t_crs, t_res, grid_origin)
+                    else:
+                        out_folder = f'{out_dir}/{out}'
+                        final_out = os.path.join(out_folder, out_name)+ ".tif"
+                    isExist = os.path.exists(out_folder)
+                    if not isExist:
+                        os.makedirs(out_folder)
+                    if out_encoding == "compact":
+                        pp_product= "coherence"
+                    else:
+                        pp_product= None
+                    postprocess(f'{out_path}.tif', final_out, shapefile= shapefile, bounds= bounds, grid= grid,
+                                product= pp_product, stats= stats, threads= postproc_threads)
+                elif shapefile is not None:
                     aoiname = os.path.splitext(os.path.basename(shapefile))[0]
                     out_folder = f'{out_dir}/{aoiname}/{out}'
                     isExist = os.path.exists(out_folder)
@@ -566,9 +524,49 @@ def S1_coh_proc(infiles, out_dir= "default", shapefile=None, tmpdir= None, t_res
                     bounds = [extent['xmin'], extent['ymin'], extent['xmax'], extent['ymax']]
                     with Raster(f'{out_path}.tif', list_separate=False) as ras:
                         source = ras.filename
+                    warp_options = {'format': 'GTiff', 'outputBounds': bounds}
+                    ##cut to the shared target grid of the AOI
+                    if grid_align == True:
+                        grid = get_grid(f'{out_dir}/{aoiname}', extent, t_crs, t_res, grid_origin)
+                        warp_options.update(grid_warp_options(grid))
                     gdalwarp(src=source, dst=out_path_aoi,
-                        options={'format': 'GTiff',
-                        'outputBounds': bounds})
+                        options= warp_options)
+                    final_out = out_path_aoi
+                else:
+                    final_out = f'{out_path}.tif'
+                ##compact encoding of final output
+                if out_encoding == "compact" and native_postproc == False:
+                    if shapefile is not None or out_format.startswith("GeoTIFF"):
+                        encode_raster(final_out, product="coherence", stats= stats)
+                    else:
+                        print('Compact encoding requires GeoTIFF output, keeping float32')
+                if out_stac == True and stats["total"] == 0 and (shapefile is not None or out_format.startswith("GeoTIFF")):
+                    raster_stats(final_out, stats)
+                cube_rasters[p] = final_out
+                stac_assets[p] = (final_out, stats)
+
+            ##append pair to datacube of AOI and relative orbit
+            if out_cube == True:
+                if shapefile is not None or out_format.startswith("GeoTIFF"):
+                    if out_encoding == "compact":
+                        cube_products = {p: "coherence" for p in pol}
+                    else:
+                        cube_products = None
+                    append_date(get_cube_path(out_dir, relOrbs[0], "COH", shapefile), datetime2, cube_rasters, variables= pol, products= cube_products)
+                else:
+                    print('Datacube output requires GeoTIFF output, skipping datacube')
+
+            ##add pair to STAC catalog of the output folder
+            if out_stac == True:
+                if shapefile is not None or out_format.startswith("GeoTIFF"):
+                    processing = {"t_res": t_res, "t_crs": t_crs, "cohWinRg": cohWinRg, "cohWinAz": cohWinAz,
+                                  "ml_RgLook": ml_RgLook, "ml_AzLook": ml_AzLook, "demName": demName,
+                                  "orbitType": orbitType, "out_encoding": out_encoding}
+                    update_catalog(get_catalog_dir(out_dir, shapefile), "S1_"+ orbit+"_relOrb_"+ str(relOrbs[0])+"_COH_"+ datetime2+"_"+ datetime1,
+                                   datetime2, stac_assets, product= "COH", sensor= info_lst[1].sensor, orbit= orbit,
+                                   relOrb= relOrbs[0], polarizations= pol, processing= processing, start_time= datetime1)
+                else:
+                    print('STAC catalog requires GeoTIFF output, skipping catalog')
 
             timeb =  datetime.datetime.now()
             proc_time = timeb - timea
@@ -1,5 +1,5 @@
 import pyroSAR
-from pyroSAR.snap.auxil import parse_recipe, parse_node, gpt, execute
+from pyroSAR.snap.auxil import parse_recipe, parse_node, execute
 from pyroSAR import  identify_many
 from spatialist.ancillary import finder
 from spatialist import crsConvert, Vector, Raster
@@ -9,13 +9,25 @@ import datetime
 import geopandas as gpd
 from spatialist import gdalwarp
 
-from auxils import get_burst_geometry, remove
+from .auxils import get_burst_geometry, remove
+from .encoding import encode_raster, init_stats, raster_stats
+from .datacube import get_cube_path, append_date
+from .stac import get_catalog_dir, update_catalog
+from .grid import get_grid, grid_warp_options, align_terrain_correction
+from .postproc import postprocess
+from .staging import stage_scenes
+from .resources import count_bursts
+from .scheduler import admit_gpt
+from .bursts import aoi_slices, assembly_burst_range, read_slices
+from .halpha import decompose_dimap, C2_BANDS
+from .speckle import speckle_filter_dimap, POL_FILTERS
 
 def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20, t_crs=32633,  out_format= "GeoTIFF", gpt_paras= None,\
                     IWs= ["IW1", "IW2", "IW3"], decompFeats= ["Alpha", "Entropy", "Anisotropy"], ext_DEM= False, ext_DEM_noDatVal= -9999, ext_Dem_file= None, msk_noDatVal= False,\
                     ext_DEM_EGM= True, imgResamp= "BICUBIC_INTERPOLATION", demResamp= "BILINEAR_INTERPOLATION",decomp_win_size= 5 ,\
                     speckFilter= "Box Car Filter", ml_RgLook= 4, ml_AzLook= 1, osvPath=None,\
-                    tpm_format= "BEAM-DIMAP", clean_tmpdir= True, osvFail= False):
+                    tpm_format= "BEAM-DIMAP", clean_tmpdir= True, osvFail= False, out_encoding= "float32", out_cube= False, out_stac= False, grid_align= False, grid_origin= (0, 0), native_postproc= False, postproc_threads= 4,\
+                    ha_engine= "snap", native_threads= 4, spk_engine= "snap", stage_dir= None, stage_gb= 100):
     
     """[S1_HA_proc]
     function for processing H-alpha features (Alpha, Entropy, Anisotropy) from S-1 SLC files in SNAP
@@ -33,8 +45,8 @@ def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20,
             EPSG code of target coordinate system, default is 4326
         out_format: str
             format of final output, formats supported by SNAP, default is GeoTiff
-        gpt_paras: none or list
-            a list of additional arguments to be passed to the gpt call
+        gpt_paras: none, list or "auto"
+            a list of additional arguments to be passed to the gpt call, "auto" sizes them per graph, see resources.gpt_args
         decompFeats: list of str
             containing H/a decompostion features: Alpha, Entropy and Anisotropy
         decomp_win_size: int
@@ -67,6 +79,35 @@ def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20,
             specify path to locally stored OSVs, if none default OSV path of SNAP is set
         tpm_format: str
             specify the SNAP format for temporary files: "BEAM-DIMAP" or "ZNAP". "BEAM-DIMAP" default.
+        out_encoding: str
+            "float32" keeps SNAP output, "compact" stores H/a features as scaled uint8 GeoTIFF, default is "float32"
+        out_cube: bool
+            append each date to a zarr datacube per AOI and relative orbit with one variable per H/a feature, requires grid_align, default false
+        out_stac: bool
+            add each date as item with band statistics to a static STAC catalog in the output folder, default false
+        grid_align: bool
+            snap Terrain-Correction to a pixel aligned grid and cut AOI outputs to the grid stored per AOI,
+            so all dates share identical geotransforms, default false
+        grid_origin: tuple
+            x and y of a corner of the target grid in the target CRS, default is (0, 0)
+        native_postproc: bool
+            replace SNAP dB conversion and the gdalwarp AOI cut by one streaming NumPy pass with AOI masking, default false
+        postproc_threads: int
+            number of threads of the native post-processing, default is 4
+        ha_engine: str
+            "snap" runs Polarimetric-Decomposition per feature, "native" decomposes the C2 matrix once with NumPy
+            and terrain corrects the features from the derived product, default is "snap"
+        native_threads: int
+            number of threads of native processing stages, default is 4
+        spk_engine: str
+            "native" replaces Polarimetric-Speckle-Filter by the NumPy filter of the C2 matrix ("Box Car Filter" and
+            "Refined Lee Filter" only), requires ha_engine "native", default is "snap"
+        stage_dir: str or None
+            folder on fast local disk the manifest, annotation and measurement members of the selected IWs and
+            polarizations are extracted to once per scene, SNAP then reads the staged .SAFE instead of inflating the
+            zip in every IW graph, default is None (SNAP reads the zip files)
+        stage_gb: int, float
+            size of stage_dir in GB, least recently used scenes are removed beyond, default is 100
         Returns
         -------
         Raster files of selected output format for selected H-alpha features
@@ -153,6 +194,11 @@ def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20,
     speckleFilter_options = ['Box Car Filter', 'IDAN Filter', 'Refined Lee Filter', 'Improved Lee Sigma Filter']
     if speckFilter not in speckleFilter_options:
             raise ValueError(message.format('speckleFilter', '\n- '.join(speckleFilter_options)))
+    if spk_engine == "native" and (ha_engine != "native" or speckFilter not in POL_FILTERS):
+            raise ValueError(message.format('speckleFilter of spk_engine native with ha_engine native', '\n- '.join(POL_FILTERS)))
+    ##all dates of a cube share one grid, so its origin must not depend on the scene
+    if out_cube == True and grid_align == False:
+        raise ValueError('out_cube requires grid_align')
     ##query unique dates of files: determine if sliceAssembly is required
     dates_info= []
     for d in info:
@@ -176,6 +222,11 @@ def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20,
     ##selection of paired files for sliceAssembly
     for i in range(0, len(pair_dates_idx)):
         fps_grp= list(map(fps_lst.__getitem__, pair_dates_idx[i]))
+        ##slices without bursts in the AOI are neither read nor assembled
+        if shapefile:
+            fps_grp = aoi_slices(fps_grp, IWs, "vv", shapefile)
+            if len(fps_grp) == 0:
+                continue
         #get relative orbit number of grouped files
         info_tmp=pyroSAR.identify(fps_grp[0])
         relOrb= info_tmp.orbitNumber_rel
@@ -194,92 +245,35 @@ def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20,
         ##exception handling of SNAP errors    
         try:
             timea = datetime.datetime.now()
-            slcAs_name= sensor +"_relOrb_"+ str(relOrb)+"_HA_"+unique_dates_info[i]+"_slcAs"
-            slcAs_out= os.path.join(tmpdir, slcAs_name)
             graph_dir = f'{tmpdir}/graphs'
             isExist = os.path.exists(graph_dir)
             if not isExist:
                 os.makedirs(graph_dir)
-            ## create workflow for sliceAssembly if more than 1 file is available per date
+            ##SliceAssembly of several slices per date is fused into the IW graphs below, so only the AOI bursts are read and written
             iw_bursts = None
             
             if len(fps_grp) > 1:
-
-                workflow = parse_recipe("blank")
-
-                read1 = parse_node('Read')
-                read1.parameters['file'] = fps_grp[0]
-                read1.parameters['formatName'] = formatName
-                readers = [read1.id]
-
-                workflow.insert_node(read1)
-                
-                if shapefile:
-                    bursts = get_burst_geometry(fps_grp[0], target_subswaths= [ x.lower() for x in IWs], polarization = 'vv')
-                    polygon = gpd.read_file(shapefile)
-                    inter = bursts.overlay(polygon, how='intersection')
-                    iw_list = inter['subswath'].unique()
-                    iw_bursts = dict()
-                    for ib in iw_list:
-                        iw_inter = inter[inter['subswath'] == ib.upper()]
-                        minb = iw_inter['burst'].min()
-                        maxb = iw_inter['burst'].max()
-                        iw_bursts[ib] =  [minb, maxb]
-
-
-                for r in range(1, len(fps_grp)):
-                    readn = parse_node('Read')
-                    readn.parameters['file'] = fps_grp[r]
-                    readn.parameters['formatName'] = formatName
-                    workflow.insert_node(readn, before= read1.id, resetSuccessorSource=False)
-                    readers.append(readn.id)
-
-                    if shapefile:
-                        bursts = get_burst_geometry(fps_grp[r], target_subswaths = [ x.lower() for x in IWs], polarization = "vv")
-                        polygon = gpd.read_file(shapefile)
-                        inter = bursts.overlay(polygon, how='intersection')
-                        iw_list = inter['subswath'].unique()
-                        for ib in iw_list:
-                            iw_inter = inter[inter['subswath'] == ib.upper()]
-                            minb = iw_inter['burst'].min()
-                            maxb = iw_inter['burst'].max()
-                            if ib in iw_bursts:
-                                iw_bursts[ib][1]  =  iw_bursts[ib][1] + maxb
-                            else:
-                                iw_bursts[ib] =  [minb, maxb]
-                        IWs = list(iw_bursts.keys())
-
-                slcAs=parse_node("SliceAssembly")
-                slcAs.parameters["selectedPolarisations"]= pol
-
-                workflow.insert_node(slcAs, before= readers)
-                read1= slcAs
-
-                write_slcAs=parse_node("Write")
-                write_slcAs.parameters["file"]= slcAs_out
-                write_slcAs.parameters["formatName"]= tpm_format
-
-                workflow.insert_node(write_slcAs, before= slcAs.id)
-                workflow.write(f"{graph_dir}/HA_slc_prep_graph")
-                gpt(f"{graph_dir}/HA_slc_prep_graph.xml", gpt_args= gpt_paras, tmpdir = tmpdir)
-
-                HA_proc_in= slcAs_out+ file_end
-            ##pass file path if no sliceAssembly required
-            else:
-                HA_proc_in = fps_grp[0]
+                ##burst range of the AOI in the assembled product, counted by burst ID across the slices
                 if shapefile:
-                    bursts = get_burst_geometry(fps_grp[0], target_subswaths = [ x.lower() for x in IWs], polarization = "vv")
-                    polygon = gpd.read_file(shapefile)
-                    inter = bursts.overlay(polygon, how='intersection')
-                    iw_list = inter['subswath'].unique()
-                    iw_bursts = dict()
-                    for ib in iw_list:
-                        iw_inter = inter[inter['subswath'] == ib.upper()]
-                        minb = iw_inter['burst'].min()
-                        maxb = iw_inter['burst'].max()
-                        iw_bursts[ib] =  [minb, maxb]
+                    iw_bursts = assembly_burst_range(fps_grp, IWs, "vv", shapefile)
                     IWs = list(iw_bursts.keys())
-
+            elif shapefile:
+                bursts = get_burst_geometry(fps_grp[0], target_subswaths = [ x.lower() for x in IWs], polarization = "vv")
+                polygon = gpd.read_file(shapefile)
+                inter = bursts.overlay(polygon, how='intersection')
+                iw_list = inter['subswath'].unique()
+                iw_bursts = dict()
+                for ib in iw_list:
+                    iw_inter = inter[inter['subswath'] == ib.upper()]
+                    minb = iw_inter['burst'].min()
+                    maxb = iw_inter['burst'].max()
+                    iw_bursts[ib] =  [minb, maxb]
+                IWs = list(iw_bursts.keys())
+
+            snap_in = fps_grp
+            if stage_dir is not None:
+                snap_in = stage_scenes(fps_grp, stage_dir, IWs, pol, stage_gb * 1024**3, native_threads)
+            n_bursts = count_bursts(iw_bursts, IWs, len(fps_grp))
 
             for iw in IWs:
                 print(f'IW : {iw}')
@@ -289,15 +283,13 @@ def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20,
                 ##generate workflow for IW splits 
                 workflow= parse_recipe("blank")
 
-                read= parse_node("Read")
-                read.parameters["file"]= HA_proc_in
-                workflow.insert_node(read)
+                last_node = read_slices(workflow, snap_in, pol, formatName)
 
                 aof=parse_node("Apply-Orbit-File")
                 aof.parameters["orbitType"]= orbitType
                 aof.parameters["polyDegree"]= 3
                 aof.parameters["continueOnFail"]= osvFail
-                workflow.insert_node(aof, before= read.id)
+                workflow.insert_node(aof, before= last_node)
                 ##TOPSAR split node
                 ts=parse_node("TOPSAR-Split")
                 ts.parameters["subswath"]= iw 
@@ -325,7 +317,7 @@ def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20,
 
                 workflow.write("HA_proc_IW_graph")
 
-                execute('HA_proc_IW_graph.xml', gpt_args= gpt_paras)    
+                execute('HA_proc_IW_graph.xml', gpt_args= admit_gpt(gpt_paras, "int", n_bursts[iw]))    
             
             
             if tpm_format == "BEAM-DIMAP":
@@ -333,63 +325,135 @@ def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20,
             elif tpm_format == "ZNAP":
                     file_end= ".znap.zip"
 
-            for dc in decompFeats:          
-                dc_label= dc.upper()[0:3]
-                ##load temporary files
+            ##native decomposition: C2 matrix, multilooking and speckle filtering run once in SNAP, all features
+            ##are computed in one pass over the memory mapped C2 bands
+            if ha_engine == "native":
                 tpm_in= glob.glob(tmpdir+"/"+sensor+"_HA_relOrb_"+ str(relOrb) + "_"+\
                         unique_dates_info[i]+ "*_2TPM"+file_end)
-                ## parse_workflow of INT processing
-                workflow_tpm = parse_recipe("blank")
+                c2_name= sensor +"_HA_relOrb_"+ str(relOrb) + "_"+ unique_dates_info[i]+ "_C2"
+                c2_out= os.path.join(tmpdir, c2_name)
+                workflow_c2 = parse_recipe("blank")
 
                 read1 = parse_node('Read')
                 read1.parameters['file'] = tpm_in[0]
-                workflow_tpm.insert_node(read1)
+                workflow_c2.insert_node(read1)
                 last_node= read1.id
-                ##merge IWs if multiple IWs were selected
                 if len(tpm_in) > 1:
                     readers= [read1.id]
 
                     for t in range(1, len(tpm_in)):
                         readn = parse_node('Read')
                         readn.parameters['file'] = tpm_in[t]
-                        workflow_tpm.insert_node(readn, before= last_node, resetSuccessorSource=False)
+                        workflow_c2.insert_node(readn, before= last_node, resetSuccessorSource=False)
                         readers.append(readn.id)
-                    ##TOPSAR merge     
                     tpm=parse_node("TOPSAR-Merge")
                     tpm.parameters["selectedPolarisations"]=pol
-                    workflow_tpm.insert_node(tpm, before=readers)
+                    workflow_c2.insert_node(tpm, before=readers)
                     last_node= tpm.id
-                
-                ##create C2 covariance matrix
+
                 polMat= parse_node("Polarimetric-Matrices")
                 polMat.parameters["matrix"]= "C2"
-                workflow_tpm.insert_node(polMat, before=last_node)
+                workflow_c2.insert_node(polMat, before=last_node)
                 last_node=polMat.id
-                
-                ##multi looking
+
                 ml= parse_node("Multilook")
                 ml.parameters["sourceBands"]=["C11", "C12_real", "C12_imag", "C22"]
                 ml.parameters["nRgLooks"]= ml_RgLook
                 ml.parameters["nAzLooks"]= ml_AzLook
                 ml.parameters["grSquarePixel"]= True
                 ml.parameters["outputIntensity"]= False
-                workflow_tpm.insert_node(ml,before= last_node)
+                workflow_c2.insert_node(ml,before= last_node)
                 last_node= ml.id
 
-                ##polaricmetric speckle filtering
-                polSpec= parse_node("Polarimetric-Speckle-Filter")
-                polSpec.parameters["filter"]= speckFilter
-                workflow_tpm.insert_node(polSpec, before= last_node)
-                last_node= polSpec.id
-
-                ##dual-pol H/a decomposition
-                polDecp= parse_node("Polarimetric-Decomposition")
-                polDecp.parameters["decomposition"]= "H-Alpha Dual Pol Decomposition"
-                polDecp.parameters["windowSize"]= decomp_win_size
-                polDecp.parameters["outputHAAlpha"]= True
-
-                workflow_tpm.insert_node(polDecp, before= last_node)
-                last_node= polDecp.id
+                if spk_engine == "snap":
+                    polSpec= parse_node("Polarimetric-Speckle-Filter")
+                    polSpec.parameters["filter"]= speckFilter
+                    workflow_c2.insert_node(polSpec, before= last_node)
+                    last_node= polSpec.id
+
+                ##the native stage memory maps the ENVI rasters, so the C2 product is always BEAM-DIMAP
+                write_c2=parse_node("Write")
+                write_c2.parameters["file"]= c2_out
+                write_c2.parameters["formatName"]= "BEAM-DIMAP"
+                workflow_c2.insert_node(write_c2, before= last_node)
+                workflow_c2.write(f"{graph_dir}/HA_C2_proc_graph")
+                execute(f"{graph_dir}/HA_C2_proc_graph.xml", gpt_args= admit_gpt(gpt_paras, "h2a", sum(n_bursts.values())))
+
+                c2_dim= c2_out+ ".dim"
+                if spk_engine == "native":
+                    c2_dim= speckle_filter_dimap(c2_dim, c2_out+ "_Spk.dim", C2_BANDS, speckFilter, enl= ml_RgLook* ml_AzLook,
+                                                 threads= native_threads)
+                ha_dim= os.path.join(tmpdir, sensor +"_HA_relOrb_"+ str(relOrb) + "_"+ unique_dates_info[i]+ "_HAA.dim")
+                decompose_dimap(c2_dim, ha_dim, win_size= decomp_win_size, features= decompFeats, threads= native_threads)
+
+            cube_rasters = dict()
+            stac_assets = dict()
+            for dc in decompFeats:          
+                dc_label= dc.upper()[0:3]
+                if ha_engine == "native":
+                    ##decomposition was computed natively, Terrain-Correction reads its derived product
+                    workflow_tpm = parse_recipe("blank")
+
+                    read1 = parse_node('Read')
+                    read1.parameters['file'] = ha_dim
+                    workflow_tpm.insert_node(read1)
+                    last_node= read1.id
+                else:
+                    ##load temporary files
+                    tpm_in= glob.glob(tmpdir+"/"+sensor+"_HA_relOrb_"+ str(relOrb) + "_"+\
+                            unique_dates_info[i]+ "*_2TPM"+file_end)
+                    ## parse_workflow of INT processing
+                    workflow_tpm = parse_recipe("blank")
+
+                    read1 = parse_node('Read')
+                    read1.parameters['file'] = tpm_in[0]
+                    workflow_tpm.insert_node(read1)
+                    last_node= read1.id
+                    ##merge IWs if multiple IWs were selected
+                    if len(tpm_in) > 1:
+                        readers= [read1.id]
+
+                        for t in range(1, len(tpm_in)):
+                            readn = parse_node('Read')
+                            readn.parameters['file'] = tpm_in[t]
+                            workflow_tpm.insert_node(readn, before= last_node, resetSuccessorSource=False)
+                            readers.append(readn.id)
+                        ##TOPSAR merge     
+                        tpm=parse_node("TOPSAR-Merge")
+                        tpm.parameters["selectedPolarisations"]=pol
+                        workflow_tpm.insert_node(tpm, before=readers)
+                        last_node= tpm.id
+                
+                    ##create C2 covariance matrix
+                    polMat= parse_node("Polarimetric-Matrices")
+                    polMat.parameters["matrix"]= "C2"
+                    workflow_tpm.insert_node(polMat, before=last_node)
+                    last_node=polMat.id
+                
+                    ##multi looking
+                    ml= parse_node("Multilook")
+                    ml.parameters["sourceBands"]=["C11", "C12_real", "C12_imag", "C22"]
+                    ml.parameters["nRgLooks"]= ml_RgLook
+                    ml.parameters["nAzLooks"]= ml_AzLook
+                    ml.parameters["grSquarePixel"]= True
+                    ml.parameters["outputIntensity"]= False
+                    workflow_tpm.insert_node(ml,before= last_node)
+                    last_node= ml.id
+
+                    ##polaricmetric speckle filtering
+                    polSpec= parse_node("Polarimetric-Speckle-Filter")
+                    polSpec.parameters["filter"]= speckFilter
+                    workflow_tpm.insert_node(polSpec, before= last_node)
+                    last_node= polSpec.id
+
+                    ##dual-pol H/a decomposition
+                    polDecp= parse_node("Polarimetric-Decomposition")
+                    polDecp.parameters["decomposition"]= "H-Alpha Dual Pol Decomposition"
+                    polDecp.parameters["windowSize"]= decomp_win_size
+                    polDecp.parameters["outputHAAlpha"]= True
+
+                    workflow_tpm.insert_node(polDecp, before= last_node)
+                    last_node= polDecp.id
 
                 #terrain correction
                 tc= parse_node("Terrain-Correction")
@@ -405,12 +469,14 @@ def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20,
                 tc.parameters["saveSelectedSourceBand"]= True
                # tc.parameters["outputComplex"]= False
                 tc.parameters["nodataValueAtSea"]= msk_noDatVal
+                if grid_align == True:
+                    align_terrain_correction(tc, t_crs, t_res, grid_origin)
 
                 workflow_tpm.insert_node(tc, before= last_node)
                 last_node= tc.id
 
                 out = sensor+"_"+ orbit+ "_relOrb_"+ str(relOrb) + "_HA_" + date_str + "_Orb_Cal_Deb_ML_Spk_TC"
-                if shapefile is not None:
+                if shapefile is not None or native_postproc == True:
                     out_folder = f'{tmpdir}/{out}'
                 else:
                     out_folder = f'{out_dir}/{out}'
@@ -423,14 +489,45 @@ def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20,
 
                 write_tpm=parse_node("Write")
                 write_tpm.parameters["file"]= out_path
-                write_tpm.parameters["formatName"]= out_format
+                if native_postproc == True:
+                    write_tpm.parameters["formatName"]= "GeoTIFF"
+                else:
+                    write_tpm.parameters["formatName"]= out_format
                 workflow_tpm.insert_node(write_tpm, before= last_node)
 
                 ##write graph and execute it
                 workflow_tpm.write(f"{graph_dir}/HA_TPM_continued_proc_graph")
-                execute(f"{graph_dir}/HA_TPM_continued_proc_graph.xml", gpt_args= gpt_paras)
-
-                if shapefile is not None:
+                execute(f"{graph_dir}/HA_TPM_continued_proc_graph.xml", gpt_args= admit_gpt(gpt_paras, "tc" if ha_engine == "native" else "h2a", sum(n_bursts.values())))
+
+                ##statistics for the STAC catalog are collected in the pass that writes the final output
+                stats = init_stats()
+                if native_postproc == True:
+                    ##dB conversion, nodata handling, AOI cut and masking and encoding in one streaming pass
+                    bounds = None
+                    grid = None
+                    if shapefile is not None:
+                        aoiname = os.path.splitext(os.path.basename(shapefile))[0]
+                        out_folder = f'{out_dir}/{aoiname}/{out}'
+                        final_out = os.path.join(out_folder, out_name)
+                        shp = Vector(shapefile)
+                        shp.reproject(epsg)
+                        extent = shp.extent
+                        bounds = [extent['xmin'], extent['ymin'], extent['xmax'], extent['ymax']]
+                        if grid_align == True:
+                            grid = get_grid(f'{out_dir}/{aoiname}', extent, t_crs, t_res, grid_origin)
+                    else:
+                        out_folder = f'{out_dir}/{out}'
+                        final_out = os.path.join(out_folder, out_name)+ ".tif"
+                    isExist = os.path.exists(out_folder)
+                    if not isExist:
+                        os.makedirs(out_folder)
+                    if out_encoding == "compact":
+                        pp_product= dc
+                    else:
+                        pp_product= None
+                    postprocess(f'{out_path}.tif', final_out, shapefile= shapefile, bounds= bounds, grid= grid,
+                                product= pp_product, stats= stats, threads= postproc_threads)
+                elif shapefile is not None:
                     aoiname = os.path.splitext(os.path.basename(shapefile))[0]
                     out_folder = f'{out_dir}/{aoiname}/{out}'
                     isExist = os.path.exists(out_folder)
@@ -445,9 +542,48 @@ def S1_HA_proc(infiles, out_dir= None, tmpdir= None, shapefile = None, t_res=20,
                     bounds = [extent['xmin'], extent['ymin'], extent['xmax'], extent['ymax']]
                     with Raster(f'{out_path}.tif', list_separate=False) as ras:
                         source = ras.filename
+                    warp_options = {'format': 'GTiff', 'outputBounds': bounds}
+                    ##cut to the shared target grid of the AOI
+                    if grid_align == True:
+                        grid = get_grid(f'{out_dir}/{aoiname}', extent, t_crs, t_res, grid_origin)
+                        warp_options.update(grid_warp_options(grid))
                     gdalwarp(src=source, dst=out_path_aoi,
-                        options={'format': 'GTiff',
-                        'outputBounds': bounds})
+                        options= warp_options)
+                    final_out = out_path_aoi
+                else:
+                    final_out = f'{out_path}.tif'
+                ##compact encoding of final output
+                if out_encoding == "compact" and native_postproc == False:
+                    if shapefile is not None or out_format.startswith("GeoTIFF"):
+                        encode_raster(final_out, product=dc, stats= stats)
+                    else:
+                        print('Compact encoding requires GeoTIFF output, keeping float32')
+                if out_stac == True and stats["total"] == 0 and (shapefile is not None or out_format.startswith("GeoTIFF")):
+                    raster_stats(final_out, stats)
+                cube_rasters[dc] = final_out
+                stac_assets[dc] = (final_out, stats)
+
+            ##append date to datacube of AOI and relative orbit
+            if out_cube == True:
+                if shapefile is not None or out_format.startswith("GeoTIFF"):
+                    if out_encoding == "compact":
+                        cube_products = {dc: dc for dc in decompFeats}
+                    else:
+                        cube_products = None
+                    append_date(get_cube_path(out_dir, relOrb, "HA", shapefile), date_str, cube_rasters, variables= decompFeats, products= cube_products)
+                else:
+                    print('Datacube output requires GeoTIFF output, skipping datacube')
+
+            ##add date to STAC catalog of the output folder
+            if out_stac == True:
+                if shapefile is not None or out_format.startswith("GeoTIFF"):
+                    processing = {"t_res": t_res, "t_crs": t_crs, "speckFilter": speckFilter, "decomp_win_size": decomp_win_size,
+                                  "ml_RgLook": ml_RgLook, "ml_AzLook": ml_AzLook, "demName": demName,
+                                  "orbitType": orbitType, "out_encoding": out_encoding}
+                    update_catalog(get_catalog_dir(out_dir, shapefile), out, date_str, stac_assets, product= "HA",
+                                   sensor= sensor, orbit= orbit, relOrb= relOrb, polarizations= pol, processing= processing)
+                else:
+                    print('STAC catalog requires GeoTIFF output, skipping catalog')
                    
             timeb =  datetime.datetime.now()
             proc_time = timeb - timea
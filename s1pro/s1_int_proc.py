@@ -1,6 +1,6 @@
 
 import pyroSAR
-from pyroSAR.snap.auxil import parse_recipe, parse_node, gpt, execute
+from pyroSAR.snap.auxil import parse_recipe, parse_node, execute
 from pyroSAR import  identify_many
 from spatialist.ancillary import finder
 from spatialist import crsConvert, Vector, Raster
@@ -10,14 +10,28 @@ import datetime
 import geopandas as gpd
 from spatialist import gdalwarp
 
-from auxils import get_burst_geometry, remove
+from .auxils import get_burst_geometry, remove
+from .encoding import encode_raster, init_stats, raster_stats
+from .datacube import get_cube_path, append_date
+from .stac import get_catalog_dir, update_catalog
+from .grid import get_grid, grid_warp_options, align_terrain_correction
+from .postproc import postprocess
+from .speckle import speckle_filter_dimap, NATIVE_FILTERS
+from .multitemporal import filter_tracks
+from .geometry_cache import geometry_lut, read_orbit, track_key
+from .staging import stage_scenes
+from .resources import count_bursts
+from .scheduler import admit_gpt
+from .bursts import aoi_bursts, aoi_slices, assembly_burst_range, index_bursts, iw_burst_ids, mosaic_bursts, process_burst, read_slices
 
 
 def S1_INT_proc(infiles, out_dir= None, tmpdir= None, shapefile=None, t_res=20, t_crs=32633,  out_format= "GeoTIFF", gpt_paras= None, pol= 'full',\
                     IWs= ["IW1", "IW2", "IW3"], burst_reduce=False, ext_DEM= False, ext_DEM_noDatVal= -9999, ext_Dem_file= None, msk_noDatVal= False,\
                     ext_DEM_EGM= True, imgResamp= "BICUBIC_INTERPOLATION", demResamp= "BILINEAR_INTERPOLATION",\
                     speckFilter= "Boxcar", filterSizeX= 5, filterSizeY= 5, ml_RgLook= 4, ml_AzLook= 1, ref_plain= "gamma",\
-                    l2dB_arg= True, osvPath= None, clean_tmpdir= True, osvFail= False, tpm_format = "BEAM-DIMAP"):
+                    l2dB_arg= True, osvPath= None, clean_tmpdir= True, osvFail= False, tpm_format = "BEAM-DIMAP", out_encoding= "float32", out_cube= False, out_stac= False, grid_align= False, grid_origin= (0, 0), native_postproc= False, postproc_threads= 4,\
+                    spk_engine= "snap", native_threads= 4, mt_speckle= False, mt_win_size= 5,\
+                    geo_cache= None, orbit_tolerance= 250, burst_cache= None, stage_dir= None, stage_gb= 100):
     
     """[S1_INT_proc]
     function for processing backscatter intensities VV and VH from S-1 SLC files in SNAP
@@ -35,12 +49,14 @@ def S1_INT_proc(infiles, out_dir= None, tmpdir= None, shapefile=None, t_res=20,
             EPSG code of target coordinate system, default is 4326
         out_format: str
             format of final output, formats supported by SNAP, default is GeoTiff
-        gpt_paras: none or list
-            a list of additional arguments to be passed to the gpt call
+        gpt_paras: none, list or "auto"
+            a list of additional arguments to be passed to the gpt call, "auto" sizes them per graph, see resources.gpt_args
         pol: str or list or "full"
             polaristations to process, "full" processes all available polarizations, default is "full"
         IWs: str or list
             selected subswath for processing, default is all 3
+        burst_reduce: bool
+            deprecated and without effect, with a shapefile the bursts are always reduced to the AOI
         extDEM: bool
             set to true if external DEM should be used in processing
         ext_DEM_noDatVal: int or float
@@ -73,6 +89,51 @@ def S1_INT_proc(infiles, out_dir= None, tmpdir= None, shapefile=None, t_res=20,
             specify path to locally stored OSVs, if none default OSV path of SNAP is set
         tpm_format: str
             specify the SNAP format for temporary files: "BEAM-DIMAP" or "ZNAP". "BEAM-DIMAP" default.
+        out_encoding: str
+            "float32" keeps SNAP output, "compact" stores dB backscatter as scaled int16 GeoTIFF, default is "float32"
+        out_cube: bool
+            append each date to a zarr datacube per AOI and relative orbit with one variable per polarization, requires grid_align, default false
+        out_stac: bool
+            add each date as item with band statistics to a static STAC catalog in the output folder, default false
+        grid_align: bool
+            snap Terrain-Correction to a pixel aligned grid and cut AOI outputs to the grid stored per AOI,
+            so all dates share identical geotransforms, default false
+        grid_origin: tuple
+            x and y of a corner of the target grid in the target CRS, default is (0, 0)
+        native_postproc: bool
+            replace SNAP dB conversion and the gdalwarp AOI cut by one streaming NumPy pass with AOI masking, default false
+        postproc_threads: int
+            number of threads of the native post-processing, default is 4
+        spk_engine: str
+            "snap" runs Speckle-Filter inside the graph, "native" writes the terrain flattened backscatter and filters
+            it with NumPy ("Boxcar", "Lee" and "Refined Lee" only), default is "snap"
+        native_threads: int
+            number of threads of native processing stages, default is 4
+        mt_speckle: bool
+            filter the time series of each relative orbit and polarization with the multi-temporal filter of Quegan
+            after all dates are processed, the filtered outputs are written with the same names to the folder MT
+            next to the outputs, requires a shapefile and grid_align, default false
+        mt_win_size: int
+            window size of the local means of the multi-temporal filter, default is 5
+        geo_cache: str or None
+            folder of a per-track geometry cache: the illuminated area normalization of Terrain-Flattening is computed
+            once per relative orbit, IWs and burst range in map geometry and reused for all dates, Terrain-Flattening
+            is then replaced by dividing the terrain corrected beta0 by it. Needs native_postproc, grid_align and
+            ref_plain "gamma", default is None (Terrain-Flattening for every date)
+        orbit_tolerance: float
+            largest deviation of the orbit of a date from the orbit a cached normalization was computed for in meters,
+            it is computed again for dates beyond, default is 250
+        burst_cache: str or None
+            folder of a burst cache: every burst of the AOI, identified by its ESA burst ID, is processed on its own
+            once per date and reused by reruns and other AOIs, dates are mosaicked from the cached bursts. Needs a
+            shapefile, native_postproc and grid_align and uses SNAP Speckle-Filter, default is None (processing of
+            burst ranges per IW)
+        stage_dir: str or None
+            folder on fast local disk the manifest, annotation and measurement members of the selected IWs and
+            polarizations are extracted to once per scene, SNAP then reads the staged .SAFE instead of inflating the
+            zip in every IW graph, default is None (SNAP reads the zip files)
+        stage_gb: int, float
+            size of stage_dir in GB, least recently used scenes are removed beyond, default is 100
         Returns
         -------
         Raster files of selected output format for selected H-alpha features
@@ -172,6 +233,18 @@ def S1_INT_proc(infiles, out_dir= None, tmpdir= None, shapefile=None, t_res=20,
     speckleFilter_options = ['Boxcar', 'Median', 'Frost', 'Gamma Map', 'Refined Lee', 'Lee', 'Lee Sigma']
     if speckFilter not in speckleFilter_options:
             raise ValueError(message.format('speckleFilter', '\n- '.join(speckleFilter_options)))
+    if spk_engine == "native" and speckFilter not in NATIVE_FILTERS:
+            raise ValueError(message.format('speckleFilter of spk_engine native', '\n- '.join(NATIVE_FILTERS)))
+    if burst_cache is not None and (shapefile is None or native_postproc == False or grid_align == False):
+        raise ValueError('burst_cache requires a shapefile, native_postproc and grid_align')
+    if geo_cache is not None and (native_postproc == False or grid_align == False or ref_plain != "gamma"):
+        raise ValueError('geo_cache requires native_postproc, grid_align and ref_plain "gamma"')
+    ##all dates of a cube share one grid, so its origin must not depend on the scene
+    if out_cube == True and grid_align == False:
+        raise ValueError('out_cube requires grid_align')
+    ##the multi-temporal filter needs dates on one grid, whole scenes of different dates never share it
+    if mt_speckle == True and (shapefile is None or grid_align == False):
+        raise ValueError('mt_speckle requires a shapefile and grid_align')
     ##query unique dates of files: determine if sliceAssembly is required
     dates_info= []
     for d in info:
@@ -194,6 +267,11 @@ def S1_INT_proc(infiles, out_dir= None, tmpdir= None, shapefile=None, t_res=20,
     ##selection of paired files for sliceAssembly
     for i in range(0, len(pair_dates_idx)):
         fps_grp= list(map(fps_lst.__getitem__, pair_dates_idx[i]))
+        ##slices without bursts in the AOI are neither read nor assembled
+        if shapefile:
+            fps_grp = aoi_slices(fps_grp, IWs, pol[0], shapefile)
+            if len(fps_grp) == 0:
+                continue
         #get relative orbit number of grouped files
         info_tmp=pyroSAR.identify(fps_grp[0])
         relOrb= info_tmp.orbitNumber_rel
@@ -209,9 +287,6 @@ def S1_INT_proc(infiles, out_dir= None, tmpdir= None, shapefile=None, t_res=20,
             info_tmp.getOSV(osvType='RES', osvdir=osvPath)
             orbitType = 'Sentinel Restituted (Auto Download)'
         
-        slcAs_name= sensor +"_relOrb_"+ str(relOrb)+"_INT_"+unique_dates_info[i]+"_slcAs"
-        slcAs_out= os.path.join(tmpdir, slcAs_name)
-
         graph_dir = f'{tmpdir}/graphs'
         isExist = os.path.exists(graph_dir)
         if not isExist:
@@ -237,69 +312,20 @@ def S1_INT_proc(infiles, out_dir= None, tmpdir= None, shapefile=None, t_res=20,
             timea = datetime.datetime.now()
             ## create workflow for sliceAssembly if more than 1 file is available per date
             
-            if len(fps_grp) > 1:
-                print(fps_grp[0])
-                workflow = parse_recipe("blank")
-                read1 = parse_node('Read')
-                read1.parameters['file'] = fps_grp[0]
-                read1.parameters['formatName'] = formatName
-                read1.parameters["copyMetadata"]= "true"
-                workflow.insert_node(read1)
-                readers = [read1.id]
+            if burst_cache is not None:
+                ##bursts of the AOI and their scenes, processed per polarization below
+                date_bursts = aoi_bursts(fps_grp, IWs, pol[0], shapefile)
+                index_bursts(os.path.join(burst_cache, "bursts.db"), date_bursts)
+                INT_proc_in = fps_grp[0]
+            elif len(fps_grp) > 1:
+                ##SliceAssembly is fused into the IW graphs below, so only the AOI bursts are read and written
+                for fp in fps_grp:
+                    print(fp)
+                ##burst range of the AOI in the assembled product, counted by burst ID across the slices
                 if shapefile:
-                    bursts = get_burst_geometry(fps_grp[0], target_subswaths = [ x.lower() for x in IWs], polarization = pol[0])
-                    polygon = gpd.read_file(shapefile)
-                    inter = bursts.overlay(polygon, how='intersection')
-                    iw_list = inter['subswath'].unique()
-                    iw_bursts = dict()
-                    for ib in iw_list:
-                        iw_inter = inter[inter['subswath'] == ib.upper()]
-                        minb = iw_inter['burst'].min()
-                        maxb = iw_inter['burst'].max()
-                        iw_bursts[ib] =  [minb, maxb]
-
-                for r in range(1, len(fps_grp)):
-                    print(fps_grp[r])
-                    readn = parse_node('Read')
-                    readn.parameters['file'] = fps_grp[r]
-                    readn.parameters['formatName'] = formatName
-                    readn.parameters["copyMetadata"]= "true"
-                    workflow.insert_node(readn, before= read1.id, resetSuccessorSource=False)
-                    readers.append(readn.id)
-                    if burst_reduce:
-                        bursts = get_burst_geometry(fps_grp[r], target_subswaths = [ x.lower() for x in IWs], polarization = pol[0])
-                        polygon = gpd.read_file(shapefile)
-                        inter = bursts.overlay(polygon, how='intersection')
-                        iw_list = inter['subswath'].unique()
-                        for ib in iw_list:
-                            iw_inter = inter[inter['subswath'] == ib.upper()]
-                            minb = iw_inter['burst'].min()
-                            maxb = iw_inter['burst'].max()
-                            if ib in iw_bursts:
-                                iw_bursts[ib][1]  =  iw_bursts[ib][1] + maxb
-                            else:
-                                iw_bursts[ib] =  [minb, maxb]
-
-                        IWs = list(iw_bursts.keys())
-                
-                slcAs=parse_node("SliceAssembly")
-                slcAs.parameters["selectedPolarisations"]= pol
-                workflow.insert_node(slcAs, before= readers)
-                read1= slcAs
-                last_node= slcAs.id
-
-                write_slcAs=parse_node("Write")
-                write_slcAs.parameters["file"]= slcAs_out
-                write_slcAs.parameters["formatName"]= tpm_format
-
-                workflow.insert_node(write_slcAs, before= last_node)
-                workflow.write(f"{graph_dir}/INT_slc_prep_graph")
-                gpt(f"{graph_dir}/INT_slc_prep_graph.xml", gpt_args= gpt_paras, tmpdir = tmpdir)    
-                
-                if tpm_format == "BEAM-DIMAP":
-                    INT_proc_in= slcAs_out+".dim"
-                elif tpm_format == "ZNAP":
-                    INT_proc_in= slcAs_out+".znap.zip"
+                    iw_bursts = assembly_burst_range(fps_grp, IWs, pol[0], shapefile)
+                    IWs = list(iw_bursts.keys())
+                INT_proc_in = fps_grp[0]
                 
             else:
                 INT_proc_in = fps_grp[0]
@@ -319,192 +345,288 @@ def S1_INT_proc(infiles, out_dir= None, tmpdir= None, shapefile=None, t_res=20,
                 
             scene = INT_proc_in.split('/')[-1]
             print(f'Processing: {scene}')
+            snap_in = fps_grp
+            if stage_dir is not None and burst_cache is None:
+                snap_in = stage_scenes(fps_grp, stage_dir, IWs, pol, stage_gb * 1024**3, native_threads)
+            cube_rasters = dict()
+            stac_assets = dict()
             for p in pol:
                 print(f'Polariztaion: {p}')
-                for iw in IWs:
-                    print(f'IW : {iw}')
-                    tpm_name= sensor+"_" + p +"_INT_relOrb_"+ str(relOrb) + "_"+\
-                        unique_dates_info[i]+ "_"+iw+"_2TPM"
-                    tpm_out= os.path.join(tmpdir, tpm_name)
-                        ##generate workflow for IW splits 
-                    workflow= parse_recipe("blank")
-
-                    read= parse_node("Read")
-                    read.parameters["file"]= INT_proc_in
-                    read.parameters["copyMetadata"]= "true"
-                    workflow.insert_node(read)
-                    last_node = read.id
-
-                    ts1=parse_node("TOPSAR-Split")
-                    ts1.parameters["subswath"] = iw
-                    if shapefile:
-                        ts1.parameters["firstBurstIndex"]= iw_bursts[iw][0]
-                        ts1.parameters["lastBurstIndex"]= iw_bursts[iw][1] 
-                    workflow.insert_node(ts1, before=read.id)
-                    last_node = ts1.id
+                if burst_cache is None:
+                    n_bursts = count_bursts(iw_bursts if shapefile else None, IWs, len(fps_grp))
+                    for iw in IWs:
+                        print(f'IW : {iw}')
+                        tpm_name= sensor+"_" + p +"_INT_relOrb_"+ str(relOrb) + "_"+\
+                            unique_dates_info[i]+ "_"+iw+"_2TPM"
+                        tpm_out= os.path.join(tmpdir, tpm_name)
+                            ##generate workflow for IW splits 
+                        workflow= parse_recipe("blank")
+
+                        last_node = read_slices(workflow, snap_in, pol, formatName)
+
+                        ts1=parse_node("TOPSAR-Split")
+                        ts1.parameters["subswath"] = iw
+                        if shapefile:
+                            ts1.parameters["firstBurstIndex"]= iw_bursts[iw][0]
+                            ts1.parameters["lastBurstIndex"]= iw_bursts[iw][1] 
+                        workflow.insert_node(ts1, before=last_node)
+                        last_node = ts1.id
                         
-                    aof=parse_node("Apply-Orbit-File")
-                    aof.parameters["orbitType"]= orbitType
-                    aof.parameters["polyDegree"]= 3
-                    aof.parameters["continueOnFail"]= osvFail
-                    workflow.insert_node(aof, before= last_node)
-
-                    cal= parse_node("Calibration")
-                    cal.parameters["selectedPolarisations"]= p
-                    cal.parameters["createBetaBand"]= False
-                    cal.parameters["outputBetaBand"]= True
-                    cal.parameters["outputSigmaBand"]= False
+                        aof=parse_node("Apply-Orbit-File")
+                        aof.parameters["orbitType"]= orbitType
+                        aof.parameters["polyDegree"]= 3
+                        aof.parameters["continueOnFail"]= osvFail
+                        workflow.insert_node(aof, before= last_node)
+
+                        cal= parse_node("Calibration")
+                        cal.parameters["selectedPolarisations"]= p
+                        cal.parameters["createBetaBand"]= False
+                        cal.parameters["outputBetaBand"]= True
+                        cal.parameters["outputSigmaBand"]= False
                         
-                    workflow.insert_node(cal, before= aof.id)
+                        workflow.insert_node(cal, before= aof.id)
 
-                    tpd=parse_node("TOPSAR-Deburst")
-                    tpd.parameters["selectedPolarisations"]= p
-                    workflow.insert_node(tpd, before=cal.id)
+                        tpd=parse_node("TOPSAR-Deburst")
+                        tpd.parameters["selectedPolarisations"]= p
+                        workflow.insert_node(tpd, before=cal.id)
 
-                    write_tmp = parse_node("Write")
-                    write_tmp.parameters["file"]= tpm_out
-                    write_tmp.parameters["formatName"]= tpm_format
-                    workflow.insert_node(write_tmp, before=tpd.id)
+                        write_tmp = parse_node("Write")
+                        write_tmp.parameters["file"]= tpm_out
+                        write_tmp.parameters["formatName"]= tpm_format
+                        workflow.insert_node(write_tmp, before=tpd.id)
 
-                    workflow.write(f"{graph_dir}/Int_proc_IW_graph")
-                    execute(f"{graph_dir}/Int_proc_IW_graph.xml", gpt_args= gpt_paras)    
+                        workflow.write(f"{graph_dir}/Int_proc_IW_graph")
+                        execute(f"{graph_dir}/Int_proc_IW_graph.xml", gpt_args= admit_gpt(gpt_paras, "int", n_bursts[iw]))    
             
-                ##load temporary files
+                    ##load temporary files
                 
 
-                tpm_in= glob.glob(tmpdir+"/"+sensor+"_" + p +"_INT_relOrb_"+ str(relOrb) + "_"+\
-                            unique_dates_info[i]+ "*_2TPM"+file_end)
+                    tpm_in= glob.glob(tmpdir+"/"+sensor+"_" + p +"_INT_relOrb_"+ str(relOrb) + "_"+\
+                                unique_dates_info[i]+ "*_2TPM"+file_end)
                 
-                ##specify sourceBands for reference lvl beta and gamma
-                if len(IWs)== 1:
-                   ref= dict()
-                   ref["beta"]= ["Beta0_"+IWs[0]+ "_" + p]
-                   ref["gamma"]= ["Gamma0_"+IWs[0]+ "_"+ p]
-                   ref["sigma"]= ["Sigma0_"+IWs[0]+ "_"+ p]
-                else:    
-                    ref= dict()
-                    ref["beta"]= ["Beta0_"+ p]
-                    ref["gamma"]= ["Gamma0_"+ p]
-                    ref["sigma"]= ["Sigma0_"+ p]
-                    ##assign sourceBands of nodes depending on reference lvl
-                if ref_plain == "gamma":
-                    ref_pl_ml= ref["beta"]
-                    ref_pl= ref["gamma"]
-                elif ref_plain == "sigma":
-                    ref_pl_ml = ref["beta"]
-                    ref_pl= ref["sigma"]
+                    ##specify sourceBands for reference lvl beta and gamma
+                    if len(IWs)== 1:
+                       ref= dict()
+                       ref["beta"]= ["Beta0_"+IWs[0]+ "_" + p]
+                       ref["gamma"]= ["Gamma0_"+IWs[0]+ "_"+ p]
+                       ref["sigma"]= ["Sigma0_"+IWs[0]+ "_"+ p]
+                    else:    
+                        ref= dict()
+                        ref["beta"]= ["Beta0_"+ p]
+                        ref["gamma"]= ["Gamma0_"+ p]
+                        ref["sigma"]= ["Sigma0_"+ p]
+                        ##assign sourceBands of nodes depending on reference lvl
+                    if ref_plain == "gamma":
+                        ref_pl_ml= ref["beta"]
+                        ref_pl= ref["gamma"]
+                    elif ref_plain == "sigma":
+                        ref_pl_ml = ref["beta"]
+                        ref_pl= ref["sigma"]
                         
-                    ## parse_workflow of INT processing
-                workflow = parse_recipe("blank")
-
-                read1 = parse_node('Read')
-                read1.parameters['file'] = tpm_in[0]
-                read.parameters['formatName'] = tpm_format
-                workflow.insert_node(read1)
-                last_node= read1.id
-                #merge IWs if multiple IWs were selected
-                if len(tpm_in) > 1:
-                    readers= [read1.id]
-
-                    for t in range(1, len(tpm_in)):
-                        print(tpm_in)
-                        readn = parse_node('Read')
-                        readn.parameters['file'] = tpm_in[t]
-                        read.parameters['formatName'] = tpm_format
-                        workflow.insert_node(readn, before= last_node, resetSuccessorSource=False)
-                        readers.append(readn.id)
-
-                    ##TOPSAR merge     
-                    tpm=parse_node("TOPSAR-Merge")
-                    tpm.parameters["selectedPolarisations"]=p
-                    workflow.insert_node(tpm, before=readers)
-                    last_node= tpm.id
+                        ## parse_workflow of INT processing
+                    workflow = parse_recipe("blank")
+
+                    read1 = parse_node('Read')
+                    read1.parameters['file'] = tpm_in[0]
+                    read1.parameters['formatName'] = tpm_format
+                    workflow.insert_node(read1)
+                    last_node= read1.id
+                    #merge IWs if multiple IWs were selected
+                    if len(tpm_in) > 1:
+                        readers= [read1.id]
+
+                        for t in range(1, len(tpm_in)):
+                            print(tpm_in)
+                            readn = parse_node('Read')
+                            readn.parameters['file'] = tpm_in[t]
+                            readn.parameters['formatName'] = tpm_format
+                            workflow.insert_node(readn, before= last_node, resetSuccessorSource=False)
+                            readers.append(readn.id)
+
+                        ##TOPSAR merge     
+                        tpm=parse_node("TOPSAR-Merge")
+                        tpm.parameters["selectedPolarisations"]=p
+                        workflow.insert_node(tpm, before=readers)
+                        last_node= tpm.id
             
-                ##multi looking
-                ml= parse_node("Multilook")
-                ml.parameters["sourceBands"]= ref_pl_ml
-                ml.parameters["nRgLooks"]= ml_RgLook
-                ml.parameters["nAzLooks"]= ml_AzLook
-                ml.parameters["grSquarePixel"]= True
-                ml.parameters["outputIntensity"]= False
-                workflow.insert_node(ml,before= last_node)
-                last_node = ml.id
-
-                ##terrain flattening
-                tf= parse_node("Terrain-Flattening")
-                tf.parameters["sourceBands"]= ref_pl_ml
-                tf.parameters["demName"]= demName
-                tf.parameters["demResamplingMethod"]= demResamp
-                tf.parameters["externalDEMFile"]= ext_Dem_file
-                tf.parameters["externalDEMNoDataValue"]= ext_DEM_noDatVal
-                tf.parameters["externalDEMApplyEGM"]= True
-                tf.parameters["additionalOverlap"]= 0.1
-                tf.parameters["oversamplingMultiple"]= 1.0
-                if ref_plain == "sigma":
-                    tf.parameters["outputSigma0"]= True
-
-                workflow.insert_node(tf, before= last_node)
-                #speckle filtering
-                sf= parse_node("Speckle-Filter")
-                sf.parameters["sourceBands"]=ref_pl
-                sf.parameters["filter"]= speckFilter
-                sf.parameters["filterSizeX"]= filterSizeX
-                sf.parameters["filterSizeY"]= filterSizeY
-
-                workflow.insert_node(sf, before= tf.id)
-                #terrain correction
-                tc= parse_node("Terrain-Correction")
-                tc.parameters["sourceBands"]= ref_pl
-                tc.parameters["demName"]= demName
-                tc.parameters["externalDEMFile"]= ext_Dem_file
-                tc.parameters["externalDEMNoDataValue"]= ext_DEM_noDatVal
-                tc.parameters["externalDEMApplyEGM"]= ext_DEM_EGM
-                tc.parameters["imgResamplingMethod"]= imgResamp
-                tc.parameters["demResamplingMethod"]= demResamp
-                tc.parameters["pixelSpacingInMeter"]= t_res
-                tc.parameters["mapProjection"]= t_crs
-                tc.parameters["saveSelectedSourceBand"]= True
-                #tc.parameters["outputComplex"]= False
-                tc.parameters["nodataValueAtSea"]= msk_noDatVal
-
-                workflow.insert_node(tc, before= sf.id)
-                last_node= tc.id
+                    ##multi looking
+                    ml= parse_node("Multilook")
+                    ml.parameters["sourceBands"]= ref_pl_ml
+                    ml.parameters["nRgLooks"]= ml_RgLook
+                    ml.parameters["nAzLooks"]= ml_AzLook
+                    ml.parameters["grSquarePixel"]= True
+                    ml.parameters["outputIntensity"]= False
+                    workflow.insert_node(ml,before= last_node)
+                    last_node = ml.id
+
+                    if geo_cache is not None:
+                        ##Terrain-Flattening is replaced by the cached normalization of the track after Terrain-Correction,
+                        ##so the speckle filter below runs on beta0 instead of gamma0: the normalization is applied in the
+                        ##native post-processing after Terrain-Correction and varies slowly against the filter window
+                        geo_params = {"demName": demName, "externalDEMFile": ext_Dem_file, "externalDEMNoDataValue": ext_DEM_noDatVal,
+                                      "externalDEMApplyEGM": ext_DEM_EGM, "demResamplingMethod": demResamp,
+                                      "nRgLooks": ml_RgLook, "nAzLooks": ml_AzLook, "t_crs": t_crs, "t_res": t_res,
+                                      "grid_origin": grid_origin}
+                        geo_key = track_key(relOrb, IWs, iw_burst_ids(fps_grp, IWs, pol[0], shapefile))
+                        lut = geometry_lut(geo_cache, geo_key, geo_params, read_orbit(fps_grp[0]), date_str, tpm_in,
+                                           ref_pl_ml, graph_dir, gpt_paras= gpt_paras, tolerance= orbit_tolerance,
+                                           bursts= sum(n_bursts.values()))
+                        tc_bands = ref_pl_ml
+                    else:
+                        lut = None
+                        tc_bands = ref_pl
+                        ##terrain flattening
+                        tf= parse_node("Terrain-Flattening")
+                        tf.parameters["sourceBands"]= ref_pl_ml
+                        tf.parameters["demName"]= demName
+                        tf.parameters["demResamplingMethod"]= demResamp
+                        tf.parameters["externalDEMFile"]= ext_Dem_file
+                        tf.parameters["externalDEMNoDataValue"]= ext_DEM_noDatVal
+                        tf.parameters["externalDEMApplyEGM"]= True
+                        tf.parameters["additionalOverlap"]= 0.1
+                        tf.parameters["oversamplingMultiple"]= 1.0
+                        if ref_plain == "sigma":
+                            tf.parameters["outputSigma0"]= True
+
+                        workflow.insert_node(tf, before= last_node)
+                        last_node= tf.id
+                    if spk_engine == "native":
+                        ##terrain flattened backscatter is written, filtered natively and read again for Terrain-Correction
+                        tf_out= os.path.join(tmpdir, sensor+"_" + p +"_INT_relOrb_"+ str(relOrb) + "_"+ unique_dates_info[i]+ "_TF")
+                        write_tf=parse_node("Write")
+                        write_tf.parameters["file"]= tf_out
+                        write_tf.parameters["formatName"]= "BEAM-DIMAP"
+                        workflow.insert_node(write_tf, before= last_node)
+                        workflow.write(f"{graph_dir}/Int_TF_proc_graph")
+                        execute(f"{graph_dir}/Int_TF_proc_graph.xml", gpt_args= admit_gpt(gpt_paras, "tc", sum(n_bursts.values())))
+
+                        spk_dim= tf_out+ "_Spk.dim"
+                        speckle_filter_dimap(tf_out+ ".dim", spk_dim, tc_bands, speckFilter, filterSizeX, filterSizeY,
+                                             enl= ml_RgLook* ml_AzLook, threads= native_threads)
+                        workflow = parse_recipe("blank")
+                        read_spk = parse_node('Read')
+                        read_spk.parameters['file'] = spk_dim
+                        workflow.insert_node(read_spk)
+                        last_node= read_spk.id
+                    else:
+                        #speckle filtering
+                        sf= parse_node("Speckle-Filter")
+                        sf.parameters["sourceBands"]=tc_bands
+                        sf.parameters["filter"]= speckFilter
+                        sf.parameters["filterSizeX"]= filterSizeX
+                        sf.parameters["filterSizeY"]= filterSizeY
+
+                        workflow.insert_node(sf, before= last_node)
+                        last_node= sf.id
+                    #terrain correction
+                    tc= parse_node("Terrain-Correction")
+                    tc.parameters["sourceBands"]= tc_bands
+                    tc.parameters["demName"]= demName
+                    tc.parameters["externalDEMFile"]= ext_Dem_file
+                    tc.parameters["externalDEMNoDataValue"]= ext_DEM_noDatVal
+                    tc.parameters["externalDEMApplyEGM"]= ext_DEM_EGM
+                    tc.parameters["imgResamplingMethod"]= imgResamp
+                    tc.parameters["demResamplingMethod"]= demResamp
+                    tc.parameters["pixelSpacingInMeter"]= t_res
+                    tc.parameters["mapProjection"]= t_crs
+                    tc.parameters["saveSelectedSourceBand"]= True
+                    #tc.parameters["outputComplex"]= False
+                    tc.parameters["nodataValueAtSea"]= msk_noDatVal
+                    if grid_align == True:
+                        align_terrain_correction(tc, t_crs, t_res, grid_origin)
+
+                    workflow.insert_node(tc, before= last_node)
+                    last_node= tc.id
                 
-                out = sensor+"_"+ orbit+ "_relOrb_"+ str(relOrb) + "_INT_" + date_str + "_Orb_Cal_Deb_ML_TF_Spk_TC"
-                if shapefile is not None:
-                    out_folder = f'{tmpdir}/{out}'
-                else:
-                    out_folder = f'{out_dir}/{out}'
-                isExist = os.path.exists(out_folder)
-                if not isExist:
-                    os.makedirs(out_folder)
-                
-                out_name = sensor+"_"+ orbit+ "_relOrb_"+ str(relOrb) + "_INT_"+ p + "_" + date_str + "_Orb_Cal_Deb_ML_TF_Spk_TC"
+                    out = sensor+"_"+ orbit+ "_relOrb_"+ str(relOrb) + "_INT_" + date_str + "_Orb_Cal_Deb_ML_TF_Spk_TC"
+                    if shapefile is not None or native_postproc == True:
+                        out_folder = f'{tmpdir}/{out}'
+                    else:
+                        out_folder = f'{out_dir}/{out}'
+                    isExist = os.path.exists(out_folder)
+                    if not isExist:
+                        os.makedirs(out_folder)
                 
+                    out_name = sensor+"_"+ orbit+ "_relOrb_"+ str(relOrb) + "_INT_"+ p + "_" + date_str + "_Orb_Cal_Deb_ML_TF_Spk_TC"
                 
-                ##conversion from linear to dB if selected
-                if l2dB_arg == True:
                 
-                    l2DB= parse_node("LinearToFromdB")
-                    l2DB.parameters["sourceBands"]= ref_pl
-                    workflow.insert_node(l2DB, before= last_node)
-                    last_node= l2DB.id
-                    ##change output name to reflect dB conversion
-                    out_name= out_name+ "_dB"
+                    ##conversion from linear to dB if selected
+                    if l2dB_arg == True:
+                        ##the native post-processing converts to dB instead
+                        if native_postproc == False:
+                            l2DB= parse_node("LinearToFromdB")
+                            l2DB.parameters["sourceBands"]= ref_pl
+                            workflow.insert_node(l2DB, before= last_node)
+                            last_node= l2DB.id
+                        ##change output name to reflect dB conversion
+                        out_name= out_name+ "_dB"
                   
-                out_path= os.path.join(out_folder, out_name) 
+                    out_path= os.path.join(out_folder, out_name) 
 
-                write_tpm=parse_node("Write")
-                write_tpm.parameters["file"]= out_path
-                write_tpm.parameters["formatName"]= out_format
-                workflow.insert_node(write_tpm, before= last_node)
+                    write_tpm=parse_node("Write")
+                    write_tpm.parameters["file"]= out_path
+                    if native_postproc == True:
+                        write_tpm.parameters["formatName"]= "GeoTIFF"
+                    else:
+                        write_tpm.parameters["formatName"]= out_format
+                    workflow.insert_node(write_tpm, before= last_node)
 
-                    ##write graph and execute it
-                workflow.write(f"{graph_dir}/Int_TPM_continued_proc_graph")
+                        ##write graph and execute it
+                    workflow.write(f"{graph_dir}/Int_TPM_continued_proc_graph")
 
-                execute(f"{graph_dir}/Int_TPM_continued_proc_graph.xml", gpt_args= gpt_paras)
+                    execute(f"{graph_dir}/Int_TPM_continued_proc_graph.xml", gpt_args= admit_gpt(gpt_paras, "tc", sum(n_bursts.values())))
+                else:
+                    ##burst level processing: only bursts of the AOI missing in the cache are processed, the date is
+                    ##mosaicked from the cached bursts
+                    out = sensor+"_"+ orbit+ "_relOrb_"+ str(relOrb) + "_INT_" + date_str + "_Orb_Cal_Deb_ML_TF_Spk_TC"
+                    out_folder = f'{tmpdir}/{out}'
+                    isExist = os.path.exists(out_folder)
+                    if not isExist:
+                        os.makedirs(out_folder)
+                    out_name = sensor+"_"+ orbit+ "_relOrb_"+ str(relOrb) + "_INT_"+ p + "_" + date_str + "_Orb_Cal_Deb_ML_TF_Spk_TC"
+                    if l2dB_arg == True:
+                        out_name= out_name+ "_dB"
+                    out_path= os.path.join(out_folder, out_name)
+                    burst_params = {"orbitType": orbitType, "osvFail": osvFail, "ml_RgLook": ml_RgLook, "ml_AzLook": ml_AzLook,
+                                    "ref_plain": ref_plain, "demName": demName, "ext_Dem_file": ext_Dem_file,
+                                    "ext_DEM_noDatVal": ext_DEM_noDatVal, "ext_DEM_EGM": ext_DEM_EGM, "demResamp": demResamp,
+                                    "imgResamp": imgResamp, "speckFilter": speckFilter, "filterSizeX": filterSizeX,
+                                    "filterSizeY": filterSizeY, "t_res": t_res, "t_crs": t_crs, "grid_origin": list(grid_origin),
+                                    "msk_noDatVal": msk_noDatVal}
+                    burst_tifs = [process_burst(burst_cache, b, unique_dates_info[i], p, burst_params, graph_dir, gpt_paras)
+                                  for b in date_bursts.itertuples()]
+                    mosaic_bursts(burst_tifs, f'{out_path}.tif')
+                    lut = None
             
-                if shapefile is not None:
+                ##statistics for the STAC catalog are collected in the pass that writes the final output
+                stats = init_stats()
+                if native_postproc == True:
+                    ##dB conversion, nodata handling, AOI cut and masking and encoding in one streaming pass
+                    bounds = None
+                    grid = None
+                    if shapefile is not None:
+                        aoiname = os.path.splitext(os.path.basename(shapefile))[0]
+                        out_folder = f'{out_dir}/{aoiname}/{out}'
+                        final_out = os.path.join(out_folder, out_name)
+                        shp = Vector(shapefile)
+                        shp.reproject(epsg)
+                        extent = shp.extent
+                        bounds = [extent['xmin'], extent['ymin'], extent['xmax'], extent['ymax']]
+                        if grid_align == True:
+                            grid = get_grid(f'{out_dir}/{aoiname}', extent, t_crs, t_res, grid_origin)
+                    else:
+                        out_folder = f'{out_dir}/{out}'
+                        final_out = os.path.join(out_folder, out_name)+ ".tif"
+                    isExist = os.path.exists(out_folder)
+                    if not isExist:
+                        os.makedirs(out_folder)
+                    if out_encoding == "compact" and l2dB_arg == True:
+                        pp_product= "dB"
+                    else:
+                        pp_product= None
+                    postprocess(f'{out_path}.tif', final_out, l2dB= l2dB_arg, shapefile= shapefile, bounds= bounds, grid= grid,
+                                product= pp_product, stats= stats, normalize= lut, threads= postproc_threads)
+                elif shapefile is not None:
                     aoiname = os.path.splitext(os.path.basename(shapefile))[0]
                     out_folder = f'{out_dir}/{aoiname}/{out}'
                     isExist = os.path.exists(out_folder)
@@ -517,10 +639,49 @@ def S1_INT_proc(infiles, out_dir= None, tmpdir= None, shapefile=None, t_res=20,
                     bounds = [extent['xmin'], extent['ymin'], extent['xmax'], extent['ymax']]
                     with Raster(f'{out_path}.tif', list_separate=False) as ras:
                         source = ras.filename
+                    warp_options = {'format': 'GTiff', 'outputBounds': bounds}
+                    ##cut to the shared target grid of the AOI
+                    if grid_align == True:
+                        grid = get_grid(f'{out_dir}/{aoiname}', extent, t_crs, t_res, grid_origin)
+                        warp_options.update(grid_warp_options(grid))
                     gdalwarp(src=source, dst=out_path_aoi,
-                        options={'format': 'GTiff',
-                        'outputBounds': bounds})
-                   
+                        options= warp_options)
+                    final_out = out_path_aoi
+                else:
+                    final_out = f'{out_path}.tif'
+                ##compact encoding of final output
+                if out_encoding == "compact" and native_postproc == False:
+                    if l2dB_arg == True and (shapefile is not None or out_format.startswith("GeoTIFF")):
+                        encode_raster(final_out, product="dB", stats= stats)
+                    else:
+                        print('Compact encoding requires dB GeoTIFF output, keeping float32')
+                if out_stac == True and stats["total"] == 0 and (shapefile is not None or out_format.startswith("GeoTIFF")):
+                    raster_stats(final_out, stats)
+                cube_rasters[p] = final_out
+                stac_assets[p] = (final_out, stats)
+
+            ##append date to datacube of AOI and relative orbit
+            if out_cube == True:
+                if shapefile is not None or out_format.startswith("GeoTIFF"):
+                    if out_encoding == "compact" and l2dB_arg == True:
+                        cube_products = {p: "dB" for p in pol}
+                    else:
+                        cube_products = None
+                    append_date(get_cube_path(out_dir, relOrb, "INT", shapefile), date_str, cube_rasters, variables= pol, products= cube_products)
+                else:
+                    print('Datacube output requires GeoTIFF output, skipping datacube')
+
+            ##add date to STAC catalog of the output folder
+            if out_stac == True:
+                if shapefile is not None or out_format.startswith("GeoTIFF"):
+                    processing = {"t_res": t_res, "t_crs": t_crs, "ref_plain": ref_plain, "speckFilter": speckFilter,
+                                  "filterSizeX": filterSizeX, "filterSizeY": filterSizeY, "ml_RgLook": ml_RgLook,
+                                  "ml_AzLook": ml_AzLook, "l2dB": l2dB_arg, "demName": demName, "orbitType": orbitType,
+                                  "out_encoding": out_encoding}
+                    update_catalog(get_catalog_dir(out_dir, shapefile), out, date_str, stac_assets, product= "INT",
+                                   sensor= sensor, orbit= orbit, relOrb= relOrb, polarizations= pol, processing= processing)
+                else:
+                    print('STAC catalog requires GeoTIFF output, skipping catalog')
 
             #exception for SNAP errors & creating error log        
         except RuntimeError as e:
@@ -538,4 +699,9 @@ def S1_INT_proc(infiles, out_dir= None, tmpdir= None, shapefile=None, t_res=20,
 
         timeb =  datetime.datetime.now()
         proc_time = timeb - timea
-        print(f'Processing time: {proc_time}')
\ No newline at end of file
+        print(f'Processing time: {proc_time}')
+
+    ##multi-temporal speckle filter of the time series of each relative orbit and polarization
+    if mt_speckle == True:
+        filter_tracks(out_dir, shapefile, [i.orbitNumber_rel for i in info], pol, size= mt_win_size, dB= l2dB_arg,
+                      threads= native_threads)
@@ -0,0 +1,258 @@
+import os
+import io
+import re
+import math
+import threading
+import numpy as np
+import xml.etree.ElementTree as ET
+from zipfile import ZipFile
+from osgeo import gdal, osr
+import pyroSAR
+from spatialist import Vector
+
+from .auxils import load_metadata, parse_gcps
+from .blocks import row_blocks, run_blocks
+from .grid import grid_resolution
+
+
+##elements of the calibration vectors per reference plain
+_CAL_ELEMENTS = {"beta": "betaNought", "sigma": "sigmaNought", "gamma": "gamma"}
+
+
+## path of the first member of a zipped or unpacked SAFE product matching a regex
+def _zip_member(zip_path, regex):
+    if os.path.isdir(zip_path):
+        names = [os.path.relpath(os.path.join(root, f), zip_path) for root, dirs, files in os.walk(zip_path) for f in files]
+    else:
+        names = ZipFile(zip_path).namelist()
+    names = sorted(n for n in names if re.search(regex, n))
+    if len(names) == 0:
+        raise RuntimeError(f'no file matching {regex} in {zip_path}')
+    return names[0]
+
+## open a member of a zipped or unpacked SAFE product
+def _open_member(zip_path, name):
+    if os.path.isdir(zip_path):
+        return open(os.path.join(zip_path, name), "rb")
+    return ZipFile(zip_path).open(name)
+
+## indices and weights of linear interpolation of x between sorted nodes, clamped at the ends
+def _interp_weights(nodes, x):
+    i = np.clip(np.searchsorted(nodes, x, side="right") - 1, 0, len(nodes) - 2)
+    w = np.clip((x - nodes[i]) / (nodes[i + 1] - nodes[i]), 0, 1)
+    return i, w
+
+
+def read_calibration(zip_path, subswath, polarization, ref_plain= "sigma"):
+    """[read_calibration]
+    calibration vectors of a subswath and polarization of a zipped SLC
+    Parameters
+    ----------
+        zip_path: str
+            SLC zip file or .SAFE folder
+        subswath: str
+            e.g. "IW1"
+        polarization: str
+            e.g. "VV"
+        ref_plain: str
+            "beta", "sigma" or "gamma" (ellipsoid based), default is "sigma"
+        Returns
+        -------
+        tuple of lines (n), pixels (m) and the calibration constants (n, m)
+    """
+    regex = rf'annotation/calibration/calibration-s1[a-d]-{subswath.lower()}-slc-{polarization.lower()}-.*\.xml$'
+    with _open_member(zip_path, _zip_member(zip_path, regex)) as f:
+        root = ET.parse(f).getroot()
+    lines, values = [], []
+    for vector in root.iter('calibrationVector'):
+        lines.append(float(vector.find('line').text))
+        pixels = np.array(vector.find('pixel').text.split(), dtype=np.float64)
+        values.append(np.array(vector.find(_CAL_ELEMENTS[ref_plain]).text.split(), dtype=np.float64))
+    return np.array(lines), pixels, np.array(values)
+
+
+def multilook_intensity(zip_path, subswath, polarization, rg_looks, az_looks, block_rows= 64, threads= 4):
+    """[multilook_intensity]
+    mean |DN|^2 of the measurement of a zipped SLC over rg_looks x az_looks windows, without deburst
+    Parameters
+    ----------
+        zip_path: str
+            SLC zip file or .SAFE folder
+        subswath, polarization: str
+            e.g. "IW1" and "VV"
+        rg_looks, az_looks: int
+            looks in range and azimuth
+        block_rows: int
+            multilooked rows per block, default is 64
+        threads: int
+            number of worker threads, default is 4
+        Returns
+        -------
+        float32 array, 0 where all samples of a window are 0
+    """
+    regex = rf'measurement/s1[a-d]-{subswath.lower()}-slc-{polarization.lower()}-.*\.tiff$'
+    if os.path.isdir(zip_path):
+        src = os.path.join(zip_path, _zip_member(zip_path, regex))
+    else:
+        src = f'/vsizip/{zip_path}/{_zip_member(zip_path, regex)}'
+    ds = gdal.Open(src)
+    nrows, ncols = ds.RasterYSize // az_looks, ds.RasterXSize // rg_looks
+    ds = None
+    out = np.zeros((nrows, ncols), dtype=np.float32)
+    local = threading.local()
+
+    def _process(row, n, read_row, read_n):
+        if not hasattr(local, "band"):
+            local.ds = gdal.Open(src)
+            local.band = local.ds.GetRasterBand(1)
+        slc = local.band.ReadAsArray(0, row * az_looks, ncols * rg_looks, n * az_looks)
+        power = (np.square(slc.real, dtype=np.float32) + np.square(slc.imag, dtype=np.float32)).reshape(n, az_looks, ncols, rg_looks)
+        count = (power > 0).sum(axis=(1, 3))
+        return np.where(count > 0, power.sum(axis=(1, 3)) / np.maximum(count, 1), 0).astype(np.float32)
+
+    def _write(block, arr):
+        out[block[0]:block[0] + block[1]] = arr
+
+    run_blocks(_process, row_blocks(nrows, block_rows), _write, threads=threads)
+    return out
+
+
+def preview_subswath(zip_path, subswath, polarization, t_res= 100, ref_plain= "sigma", threads= 4):
+    """[preview_subswath]
+    calibrated multilooked backscatter of a subswath in radar geometry with the geolocation grid as GCPs
+    Parameters
+    ----------
+        zip_path: str
+            SLC zip file or .SAFE folder
+        subswath, polarization: str
+            e.g. "IW1" and "VV"
+        t_res: int, float
+            resolution in meters the looks are derived from, default is 100
+        ref_plain: str
+            "beta", "sigma" or "gamma", default is "sigma"
+        threads: int
+            number of worker threads, default is 4
+        Returns
+        -------
+        GDAL MEM dataset with nodata 0 and GCPs in WGS84
+    """
+    annotation = load_metadata(zip_path, subswath, polarization).read()
+    info = ET.fromstring(annotation).find('imageAnnotation/imageInformation')
+    rg_spacing = float(info.find('rangePixelSpacing').text)
+    az_spacing = float(info.find('azimuthPixelSpacing').text)
+    incidence = float(info.find('incidenceAngleMidSwath').text)
+    ##slant range spacing projected to ground at mid swath
+    rg_looks = max(int(round(t_res * math.sin(math.radians(incidence)) / rg_spacing)), 1)
+    az_looks = max(int(round(t_res / az_spacing)), 1)
+
+    intensity = multilook_intensity(zip_path, subswath, polarization, rg_looks, az_looks, threads=threads)
+    lines, pixels, lut = read_calibration(zip_path, subswath, polarization, ref_plain)
+    ##calibration constants at the centres of the multilooked pixels, separable bilinear interpolation
+    yi, yw = _interp_weights(lines, np.arange(intensity.shape[0]) * az_looks + (az_looks - 1) / 2)
+    xi, xw = _interp_weights(pixels, np.arange(intensity.shape[1]) * rg_looks + (rg_looks - 1) / 2)
+    lut = lut[:, xi] * (1 - xw) + lut[:, xi + 1] * xw
+    lut = lut[yi] * (1 - yw[:, np.newaxis]) + lut[yi + 1] * yw[:, np.newaxis]
+    backscatter = (intensity / np.square(lut)).astype(np.float32)
+
+    ds = gdal.GetDriverByName("MEM").Create("", backscatter.shape[1], backscatter.shape[0], 1, gdal.GDT_Float32)
+    band = ds.GetRasterBand(1)
+    band.WriteArray(backscatter)
+    band.SetNoDataValue(0)
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(4326)
+    ##annotation pixels and lines index sample centres, GDAL GCPs refer to pixel corners
+    gcps = [gdal.GCP(lon, lat, h, (pixel + 0.5) / rg_looks, (line + 0.5) / az_looks)
+            for pixel, line, lon, lat, h in parse_gcps(io.BytesIO(annotation))]
+    ds.SetGCPs(gcps, wgs84.ExportToWkt())
+    return ds
+
+
+def S1_preview_proc(infiles, out_dir= None, shapefile= None, t_res= 100, t_crs= 4326, pol= "full",
+                    IWs= ["IW1", "IW2", "IW3"], ref_plain= "sigma", l2dB_arg= True, threads= 4):
+    """[S1_preview_proc]
+    quick look of calibrated, multilooked backscatter of S-1 SLC files geocoded with the annotation geolocation grid,
+    without Terrain-Flattening and DEM based Terrain-Correction
+    Parameters
+    ----------
+        infiles: list or str
+            filepaths of SLC zip files
+        out_dir: str
+            output folder of the preview tree, outputs are written to out_dir/(AOI)/<scene>_PRV_<date>
+        shapefile: str or None
+            AOI the preview is cut to
+        t_res: int, float
+            resolution in meters, default is 100
+        t_crs: int
+            EPSG code of target coordinate system, default is 4326
+        pol: str or list or "full"
+            polarizations to process, default is "full"
+        IWs: list
+            subswaths, default is all 3
+        ref_plain: str
+            "beta", "sigma" or "gamma" of the calibration vectors, default is "sigma"
+        l2dB_arg: bool
+            convert to dB, default true
+        threads: int
+            number of worker threads, default is 4
+        Returns
+        -------
+        list of written previews
+        Note
+        ----
+        Bursts are not debursted and the geolocation grid ignores the terrain, so positions can be off by a few pixels
+        in mountains and at burst overlaps. The preview is meant for triage only.
+    """
+    if isinstance(infiles, str):
+        infiles = [infiles]
+    if isinstance(IWs, str):
+        IWs = [IWs]
+    res = grid_resolution(t_crs, t_res)
+    bounds = None
+    if shapefile is not None:
+        shp = Vector(shapefile)
+        shp.reproject(t_crs)
+        extent = shp.extent
+        bounds = [extent['xmin'], extent['ymin'], extent['xmax'], extent['ymax']]
+    outputs = []
+    for infile in infiles:
+        info = pyroSAR.identify(infile)
+        if pol == "full":
+            pols = info.polarizations
+        elif isinstance(pol, str):
+            pols = [pol]
+        else:
+            pols = pol
+        pols = [p for p in pols if p in info.polarizations]
+        out = f'{info.sensor}_{info.orbit}_relOrb_{info.orbitNumber_rel}_PRV_{info.start}'
+        if shapefile is not None:
+            aoiname = os.path.splitext(os.path.basename(shapefile))[0]
+            out_folder = f'{out_dir}/{aoiname}/{out}'
+        else:
+            out_folder = f'{out_dir}/{out}'
+        os.makedirs(out_folder, exist_ok=True)
+        for p in pols:
+            out_name = f'{info.sensor}_{info.orbit}_relOrb_{info.orbitNumber_rel}_PRV_{p}_{info.start}_{ref_plain}0'
+            if l2dB_arg == True:
+                out_name = out_name + "_dB"
+            out_path = os.path.join(out_folder, out_name + ".tif")
+            if os.path.isfile(out_path):
+                print(f'Skip: {out_name} already exists')
+                continue
+            print(f'Preview: {out_name}')
+            sources = [preview_subswath(infile, iw, p, t_res, ref_plain, threads) for iw in IWs]
+            options = gdal.WarpOptions(format="GTiff", dstSRS=f'EPSG:{t_crs}', xRes=res, yRes=res,
+                                       targetAlignedPixels=True, outputBounds=bounds, tps=True, resampleAlg="bilinear",
+                                       srcNodata=0, dstNodata=0, outputType=gdal.GDT_Float32, multithread=True,
+                                       creationOptions=["COMPRESS=DEFLATE", "TILED=YES"])
+            ds = gdal.Warp(out_path, sources, options=options)
+            sources = None
+            if l2dB_arg == True:
+                band = ds.GetRasterBand(1)
+                arr = band.ReadAsArray()
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    arr = np.where(arr > 0, 10 * np.log10(arr), np.nan).astype(np.float32)
+                band.WriteArray(arr)
+                band.SetNoDataValue(float("nan"))
+            ds = None
+            outputs.append(out_path)
+    return outputs
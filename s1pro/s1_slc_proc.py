@@ -1,6 +1,6 @@
 from operator import is_
 from pyroSAR.snap.auxil import parse_recipe, parse_node, gpt, execute
-from pyroSAR import Archive, identify_many
+from pyroSAR import Archive, identify, identify_many
 from spatialist.ancillary import finder
 from spatialist import crsConvert, Vector, Raster, bbox, intersect
 import os
@@ -16,6 +16,22 @@ from .auxils import get_burst_geometry, remove, group_by_info
 from .s1_coh_proc import S1_coh_proc
 from .s1_h2a_proc import S1_HA_proc
 from .s1_int_proc import S1_INT_proc
+from .s1_preview_proc import S1_preview_proc
+from .resources import set_workers
+from .scheduler import set_admission
+
+
+## true if at least one burst of the selected subswaths of a scene intersects the AOI, reduced .SAFE folders only
+## contain the selected subswaths and polarizations
+def _intersects_aoi(slc, shapefile, iws= ["IW1", "IW2", "IW3"], pol= 'full'):
+    if pol == 'full':
+        pol = identify(slc).polarizations[0]
+    elif isinstance(pol, list):
+        pol = pol[0]
+    bursts = get_burst_geometry(slc, target_subswaths = [iw.lower() for iw in iws], polarization = pol.lower())
+    polygon = gpd.read_file(shapefile)
+    inter = bursts.overlay(polygon, how='intersection')
+    return not inter.empty
 
 
 def S1_SLC_proc(data, maxdate = None, mindate = None , shapefile = None, int_proc = False, coh_proc= False, ha_proc= False, INT_Test= False, outdir_int= None, outdir_coh= None, outdir_ha= None, INT_test_dir= None, tmpdir= None, res_int= 20, res_coh= 20, res_ha= 20, t_crs= 4326, out_format= "GeoTIFF",\
@@ -23,7 +39,10 @@ def S1_SLC_proc(data, maxdate = None, mindate = None , shapefile = None, int_pro
                     decompfeats= ["Alpha", "Entropy", "Anisotropy"], ha_speckfilter= "Box Car Filter", decomp_win_size= 5, osvpath= None,\
                     imgresamp= "BICUBIC_INTERPOLATION", demresamp= "BILINEAR_INTERPOLATION", bgc_demresamp= "BICUBIC_INTERPOLATION", tc_demresamp= "BILINEAR_INTERPOLATION", \
                     cohwinrg= 11, cohwinaz= 3, speckfilter= "Boxcar", filtersizex= 5, filtersizey= 5, ml_rglook= 4, ml_azlook= 1,\
-                    l2db_arg= True, ref_plain= "gamma",clean_tmpdir= True, osvfail= False, tmp_format = "BEAM-DIMAP"):
+                    l2db_arg= True, ref_plain= "gamma",clean_tmpdir= True, osvfail= False, tmp_format = "BEAM-DIMAP", out_encoding= "float32", out_cube= False, out_stac= False, grid_align= False, grid_origin_x= 0, grid_origin_y= 0, native_postproc= False, postproc_threads= 4,\
+                    ha_engine= "snap", native_threads= 4, spk_engine= "snap", mt_speckle= False, mt_win_size= 5,\
+                    geo_cache= None, orbit_tolerance= 250, burst_cache= None, preview_proc= False, outdir_preview= None, res_preview= 100,\
+                    stage_dir= None, stage_gb= 100, split_cache= None, gpt_workers= 1, admission= False, admission_wait= 1800, scenes= None):
     
     if tmpdir is not None:
         td = Path(tmpdir)
@@ -31,31 +50,35 @@ def S1_SLC_proc(data, maxdate = None, mindate = None , shapefile = None, int_pro
         tmpdir = os.path.join(os.getcwd(), "tmp_dir")
         td = Path(tmpdir)
     td.mkdir(parents=True, exist_ok=True)
+    ##share of the host of every gpt call with gpt_paras "auto"
+    set_workers(gpt_workers)
+    ##gpt calls wait for memory of the host
+    set_admission(admission, admission_wait)
     
-    if shapefile:
-        site = Vector(shapefile)
-    scenes = finder(data, [r'^S1[AB].*(SAFE|zip)$'],regex=True, recursive=True, foldermode=1)
-    dbfile = f"{tmpdir}/scene.db"
-    
-    with Archive(dbfile) as archive:
-        archive.insert(scenes)
+    if scenes is not None:
+        ##scenes handed over e.g. by the download pipeline, only checked against the AOI
+        slc_lst = [slc for slc in scenes if not shapefile or _intersects_aoi(slc, shapefile, iws, pol)]
+    else:
         if shapefile:
-            lst = archive.select(vectorobject=site,
-                                   product='SLC', acquisition_mode='IW',
-                                   mindate=mindate, maxdate=maxdate)
-            slc_lst = []
-            for slc in lst:
-                bursts = get_burst_geometry(slc, target_subswaths = ['iw1', 'iw2', 'iw3'], polarization = 'vv')
-                polygon = gpd.read_file(shapefile)
-                inter = bursts.overlay(polygon, how='intersection')
-                if not inter.empty:
-                    slc_lst.append(slc)
-        else:
-            lst = archive.select(product='SLC', acquisition_mode='IW',
-                                   mindate=mindate, maxdate=maxdate)
-            slc_lst = lst
+            site = Vector(shapefile)
+        scenes = finder(data, [r'^S1[AB].*(SAFE|zip)$'],regex=True, recursive=True, foldermode=1)
+        dbfile = f"{tmpdir}/scene.db"
+        
+        with Archive(dbfile) as archive:
+            archive.insert(scenes)
+            if shapefile:
+                lst = archive.select(vectorobject=site,
+                                       product='SLC', acquisition_mode='IW',
+                                       mindate=mindate, maxdate=maxdate)
+                slc_lst = [slc for slc in lst if _intersects_aoi(slc, shapefile, iws, pol)]
+            else:
+                lst = archive.select(product='SLC', acquisition_mode='IW',
+                                       mindate=mindate, maxdate=maxdate)
+                slc_lst = lst
     
     print(f'Found {str(len(slc_lst))} scenes')
+    if len(slc_lst) == 0:
+        return
     if isinstance(slc_lst, str):
         ##handling one file being passed down
         grp_by_orb= [slc_lst]
@@ -78,24 +101,31 @@ def S1_SLC_proc(data, maxdate = None, mindate = None , shapefile = None, int_pro
                 grp_by_relOrb= [grp_by_relOrb]      
         for ro in range(0, len(grp_by_relOrb)):
         ##selected options for features to be processed
+            if preview_proc == True:
+                S1_preview_proc(infiles= grp_by_relOrb[ro], out_dir= outdir_preview, shapefile= shapefile, t_res= res_preview, t_crs= t_crs, pol= pol,\
+                        IWs= iws, ref_plain= ref_plain, l2dB_arg= l2db_arg, threads= native_threads)
             if int_proc == True:
                 S1_INT_proc(infiles= grp_by_relOrb[ro], out_dir= outdir_int, shapefile=shapefile, t_res= res_int, tmpdir= tmpdir, t_crs= t_crs, out_format=out_format, gpt_paras= gpt_paras, pol=pol,\
-                        IWs=iws,burst_reduce=True, ext_DEM=ext_dem, ext_DEM_noDatVal= ext_dem_nodatval, ext_Dem_file= ext_dem_file, msk_noDatVal= msk_nodatval, ext_DEM_EGM= ext_dem_egm,\
-                        imgResamp= imgresamp, demResamp=demresamp, speckFilter=speckfilter, osvPath= osvpath, ref_plain= ref_plain,\
+                        IWs=iws, ext_DEM=ext_dem, ext_DEM_noDatVal= ext_dem_nodatval, ext_Dem_file= ext_dem_file, msk_noDatVal= msk_nodatval, ext_DEM_EGM= ext_dem_egm,\
+                        imgResamp= imgresamp, demResamp=demresamp, speckFilter=speckfilter, osvPath= osvpath, ref_plain= ref_plain, spk_engine= spk_engine, native_threads= native_threads,\
                         filterSizeX= filtersizex, filterSizeY=filtersizey, ml_RgLook= ml_rglook, ml_AzLook=ml_azlook, l2dB_arg= l2db_arg,\
-                        clean_tmpdir=clean_tmpdir, osvFail= osvfail, tpm_format= tmp_format)
+                        clean_tmpdir=clean_tmpdir, osvFail= osvfail, tpm_format= tmp_format, out_encoding= out_encoding, out_cube= out_cube, out_stac= out_stac, grid_align= grid_align, grid_origin= (grid_origin_x, grid_origin_y), native_postproc= native_postproc, postproc_threads= postproc_threads,\
+                        mt_speckle= mt_speckle, mt_win_size= mt_win_size, geo_cache= geo_cache, orbit_tolerance= orbit_tolerance, burst_cache= burst_cache,\
+                        stage_dir= stage_dir, stage_gb= stage_gb)
             
             if coh_proc == True:
                 S1_coh_proc(infiles= grp_by_relOrb[ro], out_dir= outdir_coh, shapefile=shapefile, t_res= res_coh, tmpdir=tmpdir, t_crs= t_crs,  out_format=out_format, gpt_paras=gpt_paras,\
                                   pol= pol, IWs= iws, ext_DEM= ext_dem, ext_DEM_noDatVal=ext_dem_nodatval, ext_Dem_file=ext_dem_file, msk_noDatVal=msk_nodatval,\
                                   ext_DEM_EGM= ext_dem_egm, BGC_demResamp= bgc_demresamp, TC_demResamp= tc_demresamp, cohWinRg= cohwinrg, cohWinAz=cohwinaz, osvPath= osvpath,\
-                                  ml_RgLook= ml_rglook, ml_AzLook= ml_azlook, clean_tmpdir=clean_tmpdir, osvFail= osvfail, tpm_format= tmp_format)
+                                  ml_RgLook= ml_rglook, ml_AzLook= ml_azlook, clean_tmpdir=clean_tmpdir, osvFail= osvfail, tpm_format= tmp_format, out_encoding= out_encoding, out_cube= out_cube, out_stac= out_stac, grid_align= grid_align, grid_origin= (grid_origin_x, grid_origin_y), native_postproc= native_postproc, postproc_threads= postproc_threads,\
+                                  stage_dir= stage_dir, stage_gb= stage_gb, split_cache= split_cache)
             if ha_proc == True:
                 S1_HA_proc(infiles= grp_by_relOrb[ro], out_dir= outdir_ha, shapefile=shapefile, t_res= res_ha, tmpdir= tmpdir, t_crs= t_crs, out_format=out_format, gpt_paras= gpt_paras,\
                         IWs=iws, ext_DEM=ext_dem, ext_DEM_noDatVal= ext_dem_nodatval, ext_Dem_file= ext_dem_file, msk_noDatVal= msk_nodatval, ext_DEM_EGM= ext_dem_egm,\
                         imgResamp= imgresamp, demResamp=demresamp, speckFilter= ha_speckfilter, decomp_win_size= decomp_win_size, decompFeats=decompfeats,\
                         ml_RgLook= ml_rglook, ml_AzLook=ml_azlook,osvPath= osvpath, osvFail= osvfail,\
-                        clean_tmpdir=clean_tmpdir, tpm_format= tmp_format)
+                        clean_tmpdir=clean_tmpdir, tpm_format= tmp_format, out_encoding= out_encoding, out_cube= out_cube, out_stac= out_stac, grid_align= grid_align, grid_origin= (grid_origin_x, grid_origin_y), native_postproc= native_postproc, postproc_threads= postproc_threads,\
+                        ha_engine= ha_engine, native_threads= native_threads, spk_engine= spk_engine, stage_dir= stage_dir, stage_gb= stage_gb)
 
              ##clean tmp folder to avoid overwriting errors even if exception is valid
         if clean_tmpdir: 
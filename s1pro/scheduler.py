@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import time
+import tempfile
+
+from .auxils import file_lock
+from .resources import gpt_args, _cgroup_memory
+
+
+##admissions of all s1pro processes of the host whose gpt process may not be running yet
+_STATE = os.path.join(tempfile.gettempdir(), "s1pro_admission.json")
+##seconds an admission is counted until its gpt process is found in /proc
+_PENDING = 60
+##memory of a JVM beyond its heap in bytes
+_JVM_OVERHEAD = 512 * 1024**2
+##smallest heap a graph is shrunk to in MB
+_MIN_HEAP = 2048
+##part of the memory kept free for the system and the native post-processing
+_RESERVE = 0.05
+##share of time in which tasks stalled on memory, in percent, above which no graph is admitted
+_MAX_PRESSURE = 10
+
+_enabled = False
+_max_wait = 1800
+
+
+def set_admission(enabled, max_wait= 1800):
+    """[set_admission]
+    switch the admission control of admit_gpt on or off
+    Parameters
+    ----------
+        enabled: bool
+        max_wait: int
+            seconds a graph waits for memory before it is shrunk or admitted anyway, default is 1800
+    """
+    global _enabled, _max_wait
+    _enabled = enabled
+    _max_wait = max_wait
+
+
+## /proc/meminfo in bytes
+def _meminfo():
+    info = dict()
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, value = line.split(":")
+            info[key] = int(value.split()[0]) * 1024
+    return info
+
+## memory left in the cgroup of the process in bytes, None without limit
+def _cgroup_available():
+    limit = _cgroup_memory()
+    if limit is None:
+        return None
+    for path in ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes"):
+        try:
+            with open(path) as f:
+                return limit - int(f.read())
+        except OSError:
+            continue
+    return None
+
+## share of the last 10 seconds in which tasks stalled on memory, in percent
+def _pressure():
+    try:
+        with open("/proc/pressure/memory") as f:
+            return float(re.search(r'some avg10=([\d.]+)', f.read()).group(1))
+    except (OSError, AttributeError):
+        return 0
+
+## bytes of a JVM size, e.g. 4096M or 75G
+def _jvm_bytes(value):
+    units = {"k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+    if value[-1].lower() in units:
+        return int(float(value[:-1]) * units[value[-1].lower()])
+    return int(value)
+
+## heap of gpt arguments in bytes, None if they do not set it
+def _args_heap(args):
+    for a in args or []:
+        if a.startswith("-J-Xmx"):
+            return _jvm_bytes(a[len("-J-Xmx"):])
+    return None
+
+## gpt arguments of resources.gpt_args with a smaller heap and tile cache
+def _shrink(args, heap_mb):
+    out = []
+    for a in args:
+        if a.startswith("-J-Xmx"):
+            a = f"-J-Xmx{heap_mb}M"
+        elif len(out) > 0 and out[-1] == "-c":
+            a = f"{int(heap_mb * 0.6)}M"
+        out.append(a)
+    return out
+
+def _alive(pid):
+    return os.path.exists(f"/proc/{pid}")
+
+
+def gpt_processes():
+    """[gpt_processes]
+    running SNAP JVMs of the host, e.g. of parallel runs of s1pro
+    Parameters
+    ----------
+        Returns
+        -------
+        list of dicts with the keys pid, rss and heap in bytes, heap is None if the JVM sets no -Xmx
+    """
+    procs = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmd = f.read().decode(errors="replace").split("\0")
+            with open(f"/proc/{pid}/status") as f:
+                rss = re.search(r'VmRSS:\s+(\d+)', f.read())
+        except OSError:
+            continue
+        ##the gpt launcher passes -J-Xmx on to the JVM as -Xmx, only the JVM is counted
+        if rss is None or "org.esa.snap" not in " ".join(cmd) or os.path.basename(cmd[0]) == "gpt":
+            continue
+        heap = [_jvm_bytes(c[len("-Xmx"):]) for c in cmd if c.startswith("-Xmx")]
+        procs.append({"pid": int(pid), "rss": int(rss.group(1)) * 1024, "heap": heap[-1] if heap else None})
+    return procs
+
+
+def available_memory():
+    """[available_memory]
+    memory a new gpt process can use: MemAvailable of the host, limited by the cgroup, minus the memory the running
+    JVMs will still allocate up to their heap
+    Parameters
+    ----------
+        Returns
+        -------
+        tuple of the available bytes and the number of running JVMs
+    """
+    info = _meminfo()
+    available = info["MemAvailable"]
+    cgroup = _cgroup_available()
+    if cgroup is not None:
+        available = min(available, cgroup)
+    running = gpt_processes()
+    for p in running:
+        if p["heap"] is not None:
+            available -= max(p["heap"] + _JVM_OVERHEAD - p["rss"], 0)
+    return available - int(info["MemTotal"] * _RESERVE), len(running)
+
+
+def admit_gpt(gpt_paras, graph, bursts= None):
+    """[admit_gpt]
+    arguments of gpt for a graph, see resources.gpt_args, returned once the estimated footprint of the graph fits
+    into the memory of the host
+    Parameters
+    ----------
+        gpt_paras: list, str or None
+            arguments of the config file or "auto"
+        graph: str
+            type of the graph, one of resources.GRAPH_COST
+        bursts: int or None
+            number of bursts read by the graph
+        Returns
+        -------
+        list of arguments or None
+        Note
+        ----
+        Without admission control (set_admission) the arguments are returned at once. Otherwise a graph waits while
+        memory is short or under pressure (PSI). Once max_wait has passed, or if no other JVM is left to free memory,
+        an "auto" sized heap is shrunk to the available memory and other graphs are admitted anyway.
+    """
+    args = gpt_args(gpt_paras, graph, bursts)
+    if _enabled == False:
+        return args
+    heap = _args_heap(args)
+    auto = gpt_paras == "auto"
+    if heap is None:
+        ##static arguments without heap are estimated like "auto"
+        heap = _args_heap(gpt_args("auto", graph, bursts))
+    start = time.time()
+    waiting = False
+    while True:
+        with file_lock(_STATE):
+            pending = []
+            if os.path.isfile(_STATE):
+                with open(_STATE) as f:
+                    pending = json.load(f)
+            ##graphs of one process run one after the other, so its earlier admissions have finished
+            pending = [p for p in pending if time.time() - p["time"] < _PENDING and _alive(p["pid"]) and p["pid"] != os.getpid()]
+            available, running = available_memory()
+            available -= sum(p["bytes"] for p in pending)
+            waited = time.time() - start >= _max_wait or running + len(pending) == 0
+            fits = heap + _JVM_OVERHEAD <= available and _pressure() < _MAX_PRESSURE
+            if fits == False and waited == True:
+                heap_mb = min(int((available - _JVM_OVERHEAD) / 1024**2), int(heap / 1024**2))
+                if auto == True and _MIN_HEAP <= heap_mb < int(heap / 1024**2):
+                    print(f'Admission: {graph} graph shrunk to a heap of {heap_mb / 1024:.1f} GiB')
+                    args = _shrink(args, heap_mb)
+                    heap = heap_mb * 1024**2
+                else:
+                    print(f'Admission: {graph} graph admitted with {max(available, 0) / 1024**3:.1f} GiB available')
+                fits = True
+            if fits == True:
+                pending.append({"pid": os.getpid(), "bytes": heap + _JVM_OVERHEAD, "time": time.time()})
+                with open(_STATE + ".tmp", "w") as f:
+                    json.dump(pending, f)
+                os.replace(_STATE + ".tmp", _STATE)
+                return args
+        if waiting == False:
+            print(f'Admission: {graph} graph waits for {(heap + _JVM_OVERHEAD) / 1024**3:.1f} GiB, '
+                  f'{max(available, 0) / 1024**3:.1f} GiB available, {running} SNAP processes running')
+            waiting = True
+        time.sleep(10)
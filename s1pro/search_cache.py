@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import hashlib
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import asf_search as asf
+
+from .auxils import file_lock
+
+
+class CachedProduct:
+    """ search result replayed from the cache, with properties and geometry like an asf_search product """
+    def __init__(self, feature):
+        self.properties = feature["properties"]
+        self.geometry = feature["geometry"]
+
+    def geojson(self):
+        return {"type": "Feature", "properties": self.properties, "geometry": self.geometry}
+
+
+## datetime of a datetime, date or ISO string, e.g. 2020-01-03T05:12:40.000Z
+def _to_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    return datetime.datetime.fromisoformat(str(value).replace("Z", "")).replace(tzinfo=None)
+
+## key of the normalized query parameters without the period
+def query_key(query):
+    normalized = {k: sorted(v) if isinstance(v, (list, tuple)) else v for k, v in query.items()}
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+## periods of at most chunk_days between start and end
+def _chunks(start, end, chunk_days):
+    out = []
+    while start < end:
+        stop = min(start + datetime.timedelta(days=chunk_days), end)
+        out.append((start, stop))
+        start = stop
+    return out
+
+
+def chunked_search(query, start, end, chunk_days= 30, threads= 4):
+    """[chunked_search]
+    asf.search over a long period as parallel queries of shorter periods
+    Parameters
+    ----------
+        query: dict
+            arguments of asf.search without start and end
+        start, end: datetime
+            period of acquisition
+        chunk_days: int
+            days per query, default is 30
+        threads: int
+            number of parallel queries, default is 4
+        Returns
+        -------
+        dict of fileID to GeoJSON feature
+    """
+    def _search(period):
+        return asf.search(start= period[0], end= period[1], **query)
+
+    features = dict()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for results in pool.map(_search, _chunks(start, end, chunk_days)):
+            for product in results:
+                feature = product.geojson()
+                features[feature["properties"]["fileID"]] = feature
+    return features
+
+
+def cached_search(cache_dir, query, start, end, ttl_hours= 24, offline= False, chunk_days= 30, threads= 4):
+    """[cached_search]
+    asf.search with a cache per query: only periods outside the cached window and, after ttl_hours, the period since
+    the last query are requested again
+    Parameters
+    ----------
+        cache_dir: str
+            cache folder
+        query: dict
+            arguments of asf.search without start and end, e.g. platform, processingLevel and intersectsWith
+        start, end: datetime, date or str
+            period of acquisition
+        ttl_hours: int, float
+            age after which acquisitions since the last query are requested again, default is 24
+        offline: bool
+            replay the cached results without any request, default false
+        chunk_days, threads: int
+            see chunked_search
+        Returns
+        -------
+        list of CachedProduct acquired between start and end, sorted by start time
+        Note
+        ----
+        Footprints, sizes and all other properties are stored as GeoJSON in <cache_dir>/<key>.json.
+    """
+    start, end = _to_datetime(start), _to_datetime(end)
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f'{query_key(query)}.json')
+    with file_lock(path):
+        entry = None
+        if os.path.isfile(path):
+            with open(path) as f:
+                entry = json.load(f)
+        if offline == True:
+            if entry is None:
+                raise RuntimeError(f'no cached search results of {query} in {cache_dir}')
+            if start < _to_datetime(entry["start"]) or end > _to_datetime(entry["end"]):
+                print(f'Offline: cached search covers {entry["start"]} to {entry["end"]} only')
+        else:
+            if entry is None:
+                periods = [(start, end)]
+                entry = {"query": query, "start": start.isoformat(), "end": end.isoformat(), "fetched": time.time(), "features": {}}
+            else:
+                cached_start, cached_end = _to_datetime(entry["start"]), _to_datetime(entry["end"])
+                periods = []
+                if start < cached_start:
+                    periods.append((start, cached_start))
+                ##acquisitions may be published late, so the period since the last query is refreshed after ttl_hours
+                if time.time() - entry["fetched"] > ttl_hours * 3600:
+                    refresh = min(cached_end, datetime.datetime.utcfromtimestamp(entry["fetched"]) - datetime.timedelta(hours=ttl_hours))
+                    periods.append((max(refresh, start), max(end, cached_end)))
+                elif end > cached_end:
+                    periods.append((cached_end, end))
+                entry["start"] = min(start, cached_start).isoformat()
+                entry["end"] = max(end, cached_end).isoformat()
+            periods = [p for p in periods if p[0] < p[1]]
+            if len(periods) > 0:
+                print(f'Search: {", ".join(f"{a:%Y-%m-%d} to {b:%Y-%m-%d}" for a, b in periods)}')
+                for period in periods:
+                    entry["features"].update(chunked_search(query, period[0], period[1], chunk_days, threads))
+                if any(p[1] >= _to_datetime(entry["end"]) for p in periods):
+                    entry["fetched"] = time.time()
+                with open(path + ".tmp", "w") as f:
+                    json.dump(entry, f, default=str)
+                os.replace(path + ".tmp", path)
+    products = [CachedProduct(f) for f in entry["features"].values()
+                if start <= _to_datetime(f["properties"]["startTime"]) <= end]
+    return sorted(products, key=lambda p: p.properties["startTime"])
@@ -0,0 +1,198 @@
+import numpy as np
+
+from .blocks import box_sum, row_blocks, run_blocks
+from .dimap import read_dimap, read_band, derive_dimap
+
+
+##filters of Speckle-Filter and Polarimetric-Speckle-Filter with a native implementation
+NATIVE_FILTERS = ["Boxcar", "Lee", "Refined Lee"]
+POL_FILTERS = {"Box Car Filter": "Boxcar", "Refined Lee Filter": "Refined Lee"}
+
+##window of the Refined Lee filter, fixed to 7x7 as in SNAP
+_RL_SIZE = 7
+
+
+## 8 edge aligned windows of the Refined Lee filter: left/right, top/bottom and the triangles of both diagonals
+def _refined_lee_masks():
+    y, x = np.mgrid[0:_RL_SIZE, 0:_RL_SIZE]
+    c = _RL_SIZE // 2
+    return np.array([x <= c, x >= c, y <= c, y >= c, x >= y, x <= y, x + y <= 2 * c, x + y >= 2 * c])
+
+_masks = _refined_lee_masks()
+
+
+## Lee weight of the deviation from the local mean, 0 in homogeneous and 1 in heterogeneous areas
+def _lee_weight(mean, meansq, enl):
+    cu2 = 1.0 / enl
+    var = meansq - mean ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        b = (var - mean ** 2 * cu2) / (var * (1 + cu2))
+    return np.clip(np.where(var > 0, b, 0), 0, 1)
+
+## windowed sums of arrays over a 7x7 mask from row-wise integral images, every row of a mask is one segment
+def _mask_sums(integrals, mask, n, m):
+    sums = [np.zeros((n, m)) for _ in integrals]
+    for dy in range(mask.shape[0]):
+        cols = np.nonzero(mask[dy])[0]
+        if cols.size == 0:
+            continue
+        x0, x1 = cols[0], cols[-1] + 1
+        for s, h in zip(sums, integrals):
+            s += h[dy:dy + n, x1:x1 + m] - h[dy:dy + n, x0:x0 + m]
+    return sums
+
+## cumulative sums along rows with a leading zero column
+def _row_integral(a):
+    return np.pad(np.cumsum(a, axis=1), [(0, 0), (1, 0)])
+
+
+def boxcar(bands, size_x, size_y, valid):
+    """[boxcar]
+    mean over a size_y x size_x window of each band, nodata pixels are not counted
+    """
+    count = box_sum(valid.astype(np.float64), size_x, size_y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return [np.where(count > 0, box_sum(np.where(valid, b, 0), size_x, size_y) / count, 0) for b in bands]
+
+
+def lee(bands, span, size_x, size_y, valid, enl= 1.0):
+    """[lee]
+    Lee filter with a size_y x size_x window, the weight is derived from span and applied to all bands
+    """
+    means = boxcar(bands + [span, span ** 2], size_x, size_y, valid)
+    b = _lee_weight(means[-2], means[-1], enl)
+    return [m + b * (x - m) for x, m in zip(bands, means[:-2])]
+
+
+def refined_lee(bands, span, valid, enl= 1.0):
+    """[refined_lee]
+    Refined Lee filter: the local statistics are taken from one of 8 edge aligned halves of a 7x7 window, chosen by
+    the strongest gradient of the 3x3 means of its sub-windows, weight and window are derived from span
+    """
+    n, m = span.shape
+    c = _RL_SIZE // 2
+    pad = lambda a: np.pad(np.where(valid, a, 0), c)
+    valid_p = np.pad(valid, c).astype(np.float64)
+    span_p = pad(span)
+
+    ##means of the 3x3 sub-windows centred at offsets -2, 0 and 2
+    count3 = box_sum(valid_p, 3, 3)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean3 = np.where(count3 > 0, box_sum(span_p, 3, 3) / count3, 0)
+    M = [[mean3[c + oy:c + oy + n, c + ox:c + ox + m] for ox in (-2, 0, 2)] for oy in (-2, 0, 2)]
+
+    ##gradients across vertical, horizontal and both diagonal edges
+    left, right = M[0][0] + M[1][0] + M[2][0], M[0][2] + M[1][2] + M[2][2]
+    top, bottom = M[0][0] + M[0][1] + M[0][2], M[2][0] + M[2][1] + M[2][2]
+    upper_right, lower_left = M[0][1] + M[0][2] + M[1][2], M[1][0] + M[2][0] + M[2][1]
+    upper_left, lower_right = M[0][0] + M[0][1] + M[1][0], M[1][2] + M[2][1] + M[2][2]
+    pairs = [(left, right), (top, bottom), (upper_right, lower_left), (upper_left, lower_right)]
+    direction = np.argmax(np.stack([np.abs(a - b) for a, b in pairs]), axis=0)
+    ##take the half of the window on the side that is closer to the centre
+    centre = 3 * M[1][1]
+    side = np.choose(direction, [np.abs(b - centre) < np.abs(a - centre) for a, b in pairs]).astype(int)
+    window = 2 * direction + side
+
+    integrals = [_row_integral(a) for a in [valid_p, span_p, span_p ** 2] + [pad(b) for b in bands]]
+    sel = lambda stack: np.take_along_axis(np.stack(stack), window[np.newaxis], axis=0)[0]
+    counts, span_sums, span_sq, band_sums = [], [], [], [[] for _ in bands]
+    for mask in _masks:
+        sums = _mask_sums(integrals, mask, n, m)
+        counts.append(sums[0])
+        span_sums.append(sums[1])
+        span_sq.append(sums[2])
+        for k, s in enumerate(sums[3:]):
+            band_sums[k].append(s)
+    count = sel(counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(count > 0, sel(span_sums) / count, 0)
+        meansq = np.where(count > 0, sel(span_sq) / count, 0)
+        b = _lee_weight(mean, meansq, enl)
+        out = []
+        for x, s in zip(bands, band_sums):
+            z = np.where(count > 0, sel(s) / count, 0)
+            out.append(z + b * (x - z))
+    return out
+
+
+def speckle_filter(bands, filter= "Boxcar", size_x= 5, size_y= 5, enl= 1.0, block_rows= 512, threads= 4, out= None):
+    """[speckle_filter]
+    blockwise speckle filtering of intensities or of the elements of a covariance matrix
+    Parameters
+    ----------
+        bands: list
+            2D arrays of the same shape, e.g. memory maps of dimap.read_band; several bands (e.g. C11, C12_real,
+            C12_imag, C22) are filtered with common weights derived from the span of the first and last band
+        filter: str
+            "Boxcar", "Lee" or "Refined Lee" of Speckle-Filter or "Box Car Filter" or "Refined Lee Filter" of
+            Polarimetric-Speckle-Filter, default is "Boxcar"
+        size_x, size_y: int
+            window size in columns and rows, Refined Lee always uses 7x7, default is 5
+        enl: float
+            equivalent number of looks of the input, default is 1
+        block_rows: int
+            number of rows per block, default is 512
+        threads: int
+            number of worker threads, default is 4
+        out: list or None
+            preallocated arrays per band, new float32 arrays are created if None
+        Returns
+        -------
+        list of filtered arrays, nodata (0) stays 0
+    """
+    filter = POL_FILTERS.get(filter, filter)
+    if filter not in NATIVE_FILTERS:
+        raise ValueError('{} has no native implementation, must be one of: {}'.format(filter, ', '.join(NATIVE_FILTERS + list(POL_FILTERS))))
+    shape = bands[0].shape
+    if out is None:
+        out = [np.zeros(shape, dtype=np.float32) for _ in bands]
+    halo = _RL_SIZE // 2 if filter == "Refined Lee" else size_y // 2
+
+    def _process(row, n, read_row, read_n):
+        block = [np.asarray(b[read_row:read_row + read_n], dtype=np.float64) for b in bands]
+        ##total power of intensities and of the diagonal of C2
+        span = block[0] + block[-1] if len(block) > 1 else block[0]
+        valid = np.isfinite(span) & (span != 0)
+        if filter == "Boxcar":
+            result = boxcar(block, size_x, size_y, valid)
+        elif filter == "Lee":
+            result = lee(block, span, size_x, size_y, valid, enl)
+        else:
+            result = refined_lee(block, span, valid, enl)
+        cut = slice(row - read_row, row - read_row + n)
+        return [np.where(valid[cut], r[cut], 0).astype(np.float32) for r in result]
+
+    def _write(block, result):
+        row, n = block[0], block[1]
+        for o, r in zip(out, result):
+            o[row:row + n] = r
+
+    run_blocks(_process, row_blocks(shape[0], block_rows, halo), _write, threads=threads)
+    return out
+
+
+def speckle_filter_dimap(src_dim, dst_dim, bands, filter= "Boxcar", size_x= 5, size_y= 5, enl= 1.0, block_rows= 512,
+                         threads= 4):
+    """[speckle_filter_dimap]
+    speckle filter bands of a BEAM-DIMAP product into a derived BEAM-DIMAP product with the same band names
+    Parameters
+    ----------
+        src_dim: str
+            .dim of the input, e.g. the Terrain-Flattening output or a C2 product
+        dst_dim: str
+            path of the derived .dim
+        bands: list
+            names of the bands to filter, e.g. ["Gamma0_VV"] or ["C11", "C12_real", "C12_imag", "C22"]
+        filter, size_x, size_y, enl, block_rows, threads:
+            see speckle_filter
+        Returns
+        -------
+        path of the derived .dim
+    """
+    meta = read_dimap(src_dim)
+    arrays = derive_dimap(src_dim, dst_dim, bands, unit=meta["bands"][bands[0]]["unit"])
+    speckle_filter([read_band(meta, b) for b in bands], filter, size_x, size_y, enl, block_rows=block_rows,
+                   threads=threads, out=[arrays[b] for b in bands])
+    for arr in arrays.values():
+        arr.flush()
+    return dst_dim
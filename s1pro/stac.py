@@ -0,0 +1,152 @@
+import os
+import datetime
+import pystac
+from osgeo import gdal, osr
+
+from .auxils import file_lock
+from .encoding import finalize_stats
+
+
+STAC_EXTENSIONS = ["https://stac-extensions.github.io/projection/v1.1.0/schema.json",
+                   "https://stac-extensions.github.io/sar/v1.0.0/schema.json",
+                   "https://stac-extensions.github.io/sat/v1.0.0/schema.json",
+                   "https://stac-extensions.github.io/raster/v1.1.0/schema.json"]
+
+_platforms = {"S1A": "sentinel-1a", "S1B": "sentinel-1b", "S1C": "sentinel-1c", "S1D": "sentinel-1d"}
+_orbit_states = {"A": "ascending", "D": "descending"}
+
+
+## parse acquisition time of pyroSAR, e.g. 20200103T051240
+def _parse_time(s):
+    return datetime.datetime.strptime(s, '%Y%m%dT%H%M%S').replace(tzinfo=datetime.timezone.utc)
+
+## footprint in WGS84 and projection info of a raster
+def _raster_info(path, densify= 10):
+    ds = gdal.Open(path)
+    gt = ds.GetGeoTransform()
+    ncols, nrows = ds.RasterXSize, ds.RasterYSize
+    srs = osr.SpatialReference(wkt=ds.GetProjection())
+    band = ds.GetRasterBand(1)
+    info = {"transform": list(gt), "shape": [nrows, ncols], "nodata": band.GetNoDataValue(),
+            "data_type": gdal.GetDataTypeName(band.DataType).lower(),
+            "scale": band.GetScale() or 1.0, "offset": band.GetOffset() or 0.0}
+    ds = None
+    srs.AutoIdentifyEPSG()
+    code = srs.GetAuthorityCode(None)
+    info["epsg"] = int(code) if code is not None else None
+    ##densified outline of the raster extent, transformed to lon/lat
+    edge = [i / densify for i in range(densify)]
+    pix = [(f * ncols, 0) for f in edge] + [(ncols, f * nrows) for f in edge] + \
+          [((1 - f) * ncols, nrows) for f in edge] + [(0, (1 - f) * nrows) for f in edge]
+    pts = [(gt[0] + c * gt[1] + r * gt[2], gt[3] + c * gt[4] + r * gt[5]) for c, r in pix]
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(4326)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    trans = osr.CoordinateTransformation(srs, wgs84)
+    lonlat = [trans.TransformPoint(x, y)[0:2] for x, y in pts]
+    lons = [p[0] for p in lonlat]
+    lats = [p[1] for p in lonlat]
+    info["bbox"] = [min(lons), min(lats), max(lons), max(lats)]
+    info["geometry"] = {"type": "Polygon", "coordinates": [[list(p) for p in lonlat] + [list(lonlat[0])]]}
+    return info
+
+
+def get_catalog_dir(out_dir, shapefile= None):
+    """[get_catalog_dir]
+    folder of the STAC catalog of an output folder and AOI
+    Parameters
+    ----------
+        out_dir: str
+            output folder of the product
+        shapefile: str or None
+            AOI shapefile, its name is used as subfolder like for the GeoTIFF outputs
+        Returns
+        -------
+        path of the catalog folder
+    """
+    if shapefile is not None:
+        aoiname = os.path.splitext(os.path.basename(shapefile))[0]
+        return f'{out_dir}/{aoiname}'
+    return out_dir
+
+
+def update_catalog(catalog_dir, item_id, time, assets, product, sensor, orbit, relOrb, polarizations,
+                   processing= None, start_time= None):
+    """[update_catalog]
+    add or replace one item of a static STAC catalog without reading the other items
+    Parameters
+    ----------
+        catalog_dir: str
+            folder of catalog.json, created if it does not exist
+        item_id: str
+            id of the item, e.g. the name of the output folder
+        time: str
+            acquisition time, e.g. "20200103T051240"
+        assets: dict
+            asset key and tuple of raster path and statistics accumulator of encoding.init_stats
+        product: str
+            "INT", "COH" or "HA"
+        sensor: str
+            e.g. "S1A"
+        orbit: str
+            "A" or "D"
+        relOrb: int
+            relative orbit
+        polarizations: list
+            processed polarizations
+        processing: dict or None
+            processing parameters stored as property "s1pro:processing"
+        start_time: str or None
+            earlier acquisition time of a coherence pair
+        Returns
+        -------
+        path of the item json
+    """
+    item_dir = os.path.join(catalog_dir, item_id)
+    item_path = os.path.join(item_dir, f'{item_id}.json')
+    catalog_path = os.path.join(catalog_dir, "catalog.json")
+    first = next(iter(assets.values()))[0]
+    info = _raster_info(first)
+
+    properties = {"platform": _platforms.get(sensor, sensor), "constellation": "sentinel-1",
+                  "instruments": ["c-sar"], "sar:instrument_mode": "IW", "sar:frequency_band": "C",
+                  "sar:product_type": product, "sar:polarizations": list(polarizations),
+                  "sat:relative_orbit": int(relOrb), "sat:orbit_state": _orbit_states.get(orbit, orbit),
+                  "proj:epsg": info["epsg"], "proj:shape": info["shape"], "proj:transform": info["transform"],
+                  "s1pro:processing": processing or {}}
+    if start_time is not None:
+        properties["start_datetime"] = _parse_time(start_time).isoformat()
+        properties["end_datetime"] = _parse_time(time).isoformat()
+
+    item = pystac.Item(id=item_id, geometry=info["geometry"], bbox=info["bbox"], datetime=_parse_time(time),
+                       properties=properties, stac_extensions=STAC_EXTENSIONS)
+    for key, (path, stats) in assets.items():
+        ras = _raster_info(path) if path != first else info
+        band_stats = finalize_stats(stats)
+        band = {"data_type": ras["data_type"], "scale": ras["scale"], "offset": ras["offset"],
+                "statistics": {"minimum": band_stats["minimum"], "maximum": band_stats["maximum"],
+                               "mean": band_stats["mean"], "stddev": band_stats["stddev"],
+                               "valid_percent": 100 * (1 - band_stats["nodata_fraction"])}}
+        if ras["nodata"] is not None:
+            band["nodata"] = ras["nodata"]
+        item.add_asset(key, pystac.Asset(href=os.path.relpath(path, item_dir), media_type=pystac.MediaType.GEOTIFF,
+                                         roles=["data"], extra_fields={"raster:bands": [band],
+                                                                       "s1pro:nodata_fraction": band_stats["nodata_fraction"]}))
+
+    os.makedirs(item_dir, exist_ok=True)
+    with file_lock(catalog_path):
+        if os.path.isfile(catalog_path):
+            catalog = pystac.Catalog.from_file(catalog_path)
+        else:
+            catalog = pystac.Catalog(id="s1pro", description="Sentinel-1 products processed with s1pro",
+                                     catalog_type=pystac.CatalogType.SELF_CONTAINED)
+            catalog.set_self_href(catalog_path)
+        ##drop the link of a former version of the item, all other item links stay unresolved
+        catalog.links = [l for l in catalog.links if not (l.rel == pystac.RelType.ITEM and
+                                                          os.path.abspath(l.get_absolute_href()) == os.path.abspath(item_path))]
+        item.set_self_href(item_path)
+        catalog.add_item(item)
+        item.save_object(include_self_link=False)
+        catalog.save_object(include_self_link=False)
+    return item_path
@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import time
+import shutil
+from zipfile import ZipFile
+from concurrent.futures import ThreadPoolExecutor
+
+from .auxils import file_lock, remove
+
+
+##copy buffer of the extraction, large reads suit network storage
+_BUFFER = 16 * 1024 * 1024
+
+
+def needed_members(names, subswaths, polarizations):
+    """[needed_members]
+    members of a zipped SLC product needed by SNAP for a selection of subswaths and polarizations
+    Parameters
+    ----------
+        names: list
+            member names of the zip file
+        subswaths: list
+            e.g. ["IW1", "IW2"]
+        polarizations: list
+            e.g. ["VV", "VH"]
+        Returns
+        -------
+        list of the manifest and the annotation, calibration, noise and measurement members of the selection
+    """
+    iws = "|".join(iw.lower() for iw in subswaths)
+    pols = "|".join(p.lower() for p in polarizations)
+    regex = rf'\.SAFE/(manifest\.safe$|(annotation|measurement)/.*-({iws})-slc-({pols})-[^/]*\.(xml|tiff)$)'
+    return [n for n in names if re.search(regex, n)]
+
+
+def reduce_manifest(manifest, members):
+    """[reduce_manifest]
+    manifest.safe of a reduced product that lists only the kept members
+    Parameters
+    ----------
+        manifest: bytes
+            manifest.safe of the full product
+        members: list
+            kept member names of the zip file, e.g. of needed_members
+        Returns
+        -------
+        bytes of the manifest without the data objects of the other members and the metadata objects and content
+        units pointing to them, the rest of the XML is left as is
+    """
+    text = manifest.decode("utf-8")
+    kept = {m.split(".SAFE/", 1)[-1] for m in members}
+    removed = []
+
+    def _data_object(match):
+        href = re.search(r'href="\./([^"]+)"', match.group(0))
+        if href is not None and href.group(1) not in kept:
+            removed.append(match.group(1))
+            return ""
+        return match.group(0)
+
+    ##elements are cut from the text, so namespace prefixes and formatting that SNAP and pyroSAR parse stay untouched
+    text = re.sub(r'[ \t]*<dataObject ID="([^"]+)".*?</dataObject>[ \t]*\n?', _data_object, text, flags=re.S)
+    for i in removed:
+        pointer = rf'<dataObjectPointer dataObjectID="{re.escape(i)}"\s*/>'
+        text = re.sub(rf'[ \t]*<metadataObject [^>]*>\s*{pointer}\s*</metadataObject>[ \t]*\n?', "", text)
+        text = re.sub(rf'[ \t]*<xfdu:contentUnit [^>]*>\s*{pointer}\s*</xfdu:contentUnit>[ \t]*\n?', "", text)
+    return text.encode("utf-8")
+
+
+def _extract(zip_path, name, dst):
+    ##every thread reads through its own handle, members are written under a temporary name first
+    target = os.path.join(dst, name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with ZipFile(zip_path) as archive, archive.open(name) as src, open(target + ".part", "wb") as out:
+        shutil.copyfileobj(src, out, _BUFFER)
+    os.replace(target + ".part", target)
+
+
+def _read_index(index_file):
+    if os.path.isfile(index_file):
+        with open(index_file) as f:
+            return json.load(f)
+    return dict()
+
+
+def _write_index(index_file, index):
+    with open(index_file + ".tmp", "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(index_file + ".tmp", index_file)
+
+
+def evict(stage_dir, index, max_bytes, keep= ()):
+    """[evict]
+    remove least recently used staged products until the staging folder fits into a byte budget
+    Parameters
+    ----------
+        stage_dir: str
+            staging folder
+        index: dict
+            staging index, updated in place
+        max_bytes: int
+            byte budget
+        keep: list or tuple
+            staged products that must not be removed, e.g. the ones of the running date
+        Returns
+        -------
+        list of removed products
+    """
+    removed = []
+    total = sum(e["bytes"] for e in index.values())
+    for name in sorted(index, key=lambda n: index[n]["atime"]):
+        if total <= max_bytes:
+            break
+        if name in keep:
+            continue
+        remove(os.path.join(stage_dir, name))
+        total -= index.pop(name)["bytes"]
+        removed.append(name)
+    return removed
+
+
+def stage_scene(zip_path, stage_dir, subswaths, polarizations, max_bytes= None, threads= 4, keep= ()):
+    """[stage_scene]
+    extract the members of a zipped SLC needed for the selected subswaths and polarizations to a local SAFE folder
+    Parameters
+    ----------
+        zip_path: str
+            SLC zip file, e.g. on network storage
+        stage_dir: str
+            staging folder on fast local disk
+        subswaths: list
+            e.g. ["IW1", "IW2"]
+        polarizations: list
+            e.g. ["VV", "VH"]
+        max_bytes: int or None
+            byte budget of the staging folder, least recently used products are removed beyond, default is None (no limit)
+        threads: int
+            number of members extracted in parallel, default is 4
+        keep: list or tuple
+            SAFE folder names that must not be evicted
+        Returns
+        -------
+        path of the staged .SAFE folder
+        Note
+        ----
+        Members already staged by earlier calls are reused, so a later call with more subswaths or polarizations
+        only extracts the missing ones. The index of the staging folder is guarded by a file lock.
+    """
+    os.makedirs(stage_dir, exist_ok=True)
+    index_file = os.path.join(stage_dir, "index.json")
+    with file_lock(index_file):
+        with ZipFile(zip_path) as archive:
+            infos = {i.filename: i for i in archive.infolist()}
+        members = needed_members(list(infos.keys()), subswaths, polarizations)
+        if len(members) == 0:
+            raise RuntimeError(f'no members of {subswaths} {polarizations} in {zip_path}')
+        safe = members[0].split("/")[0]
+        index = _read_index(index_file)
+        entry = index.get(safe, {"members": [], "bytes": 0})
+        missing = [m for m in members if m not in entry["members"]
+                   or not os.path.isfile(os.path.join(stage_dir, m))]
+        if len(missing) > 0:
+            if max_bytes is not None:
+                entry["atime"] = time.time()
+                index[safe] = entry
+                need = sum(infos[m].file_size for m in missing)
+                evict(stage_dir, index, max_bytes - need, keep= list(keep) + [safe])
+            print(f'Staging: {len(missing)} members of {os.path.basename(zip_path)}')
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(lambda m: _extract(zip_path, m, stage_dir), missing))
+            entry["members"] = sorted(set(entry["members"]) | set(missing))
+            entry["bytes"] = sum(infos[m].file_size for m in entry["members"] if m in infos)
+        entry["atime"] = time.time()
+        index[safe] = entry
+        _write_index(index_file, index)
+    return os.path.join(stage_dir, safe)
+
+
+def stage_scenes(scenes, stage_dir, subswaths, polarizations, max_bytes= None, threads= 4):
+    """[stage_scenes]
+    stage the slices of one date, see stage_scene
+    Parameters
+    ----------
+        scenes: list
+            SLC zip files, already staged .SAFE folders are passed through
+        stage_dir: str
+            staging folder on fast local disk
+        subswaths, polarizations: list
+            e.g. ["IW1", "IW2"] and ["VV", "VH"]
+        max_bytes: int or None
+            byte budget of the staging folder, default is None
+        threads: int
+            number of members extracted in parallel, default is 4
+        Returns
+        -------
+        list of the staged .SAFE folders in the order of scenes
+    """
+    if isinstance(polarizations, str):
+        polarizations = [polarizations]
+    keep = [os.path.basename(s).replace(".zip", ".SAFE") for s in scenes]
+    staged = []
+    for scene in scenes:
+        if scene.endswith(".SAFE"):
+            staged.append(scene)
+        else:
+            staged.append(stage_scene(scene, stage_dir, subswaths, polarizations, max_bytes, threads, keep))
+    return staged
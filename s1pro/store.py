@@ -0,0 +1,124 @@
+import os
+import time
+import sqlite3
+
+from .auxils import remove
+
+
+## connection to the store database with its tables
+def _connect(store_dir):
+    os.makedirs(store_dir, exist_ok=True)
+    con = sqlite3.connect(os.path.join(store_dir, "store.db"), timeout=60)
+    con.execute('CREATE TABLE IF NOT EXISTS products (product TEXT PRIMARY KEY, md5 TEXT, bytes INTEGER, atime REAL)')
+    con.execute('CREATE TABLE IF NOT EXISTS refs (product TEXT, project TEXT, link TEXT, PRIMARY KEY (product, project))')
+    return con
+
+## disk usage of a file or folder in bytes
+def _du(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+
+def object_dir(store_dir):
+    """ folder the products of a store are downloaded to, one file or .SAFE folder per product ID """
+    return os.path.join(store_dir, "objects")
+
+
+def link_product(store_dir, name, download_dir, project= None, md5= None):
+    """[link_product]
+    link a product of the store into the download folder of a project and add a reference of the project
+    Parameters
+    ----------
+        store_dir: str
+            folder of the store
+        name: str
+            file name of the product, e.g. "S1A_IW_SLC__1SDV_..._7C85.zip" or the .SAFE folder of a reduced product
+        download_dir: str
+            download folder of the project
+        project: str or None
+            name of the project, default is the absolute path of download_dir
+        md5: str or None
+            checksum of the product, recorded with it
+        Returns
+        -------
+        path of the link
+        Note
+        ----
+        Files are hard-linked and fall back to a symbolic link across file systems, folders are always symbolic links.
+    """
+    src = os.path.join(object_dir(store_dir), name)
+    dst = os.path.join(download_dir, name)
+    if project is None:
+        project = os.path.abspath(download_dir)
+    os.makedirs(download_dir, exist_ok=True)
+    ##links to evicted products are renewed
+    if os.path.lexists(dst) and not os.path.exists(dst):
+        os.remove(dst)
+    if not os.path.lexists(dst):
+        if os.path.isdir(src):
+            os.symlink(os.path.abspath(src), dst)
+        else:
+            try:
+                os.link(src, dst)
+            except OSError:
+                os.symlink(os.path.abspath(src), dst)
+    with _connect(store_dir) as con:
+        con.execute('INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?)', (name, md5, _du(src), time.time()))
+        con.execute('INSERT OR REPLACE INTO refs VALUES (?, ?, ?)', (name, project, os.path.abspath(dst)))
+    return dst
+
+
+def release_project(store_dir, project):
+    """[release_project]
+    remove the references of a project, e.g. when it is finished, its products become candidates of evict_store
+    Parameters
+    ----------
+        store_dir: str
+            folder of the store
+        project: str
+            name of the project, see link_product
+        Returns
+        -------
+        number of released products
+    """
+    with _connect(store_dir) as con:
+        return con.execute('DELETE FROM refs WHERE project = ?', (project,)).rowcount
+
+
+def evict_store(store_dir, max_bytes):
+    """[evict_store]
+    remove least recently linked products without references until the store fits into a byte budget
+    Parameters
+    ----------
+        store_dir: str
+            folder of the store
+        max_bytes: int
+            byte budget
+        Returns
+        -------
+        list of removed products
+        Note
+        ----
+        Products referenced by a project are never removed, so the store may stay above the budget. References whose
+        link no longer exists count as released.
+    """
+    removed = []
+    with _connect(store_dir) as con:
+        ##projects whose links were deleted have released the product
+        for name, project, link in con.execute('SELECT product, project, link FROM refs').fetchall():
+            if not os.path.lexists(link):
+                con.execute('DELETE FROM refs WHERE product = ? AND project = ?', (name, project))
+        total = con.execute('SELECT COALESCE(SUM(bytes), 0) FROM products').fetchone()[0]
+        rows = con.execute('SELECT product, bytes FROM products WHERE product NOT IN (SELECT product FROM refs) '
+                           'ORDER BY atime').fetchall()
+        for name, size in rows:
+            if total <= max_bytes:
+                break
+            remove(os.path.join(object_dir(store_dir), name))
+            con.execute('DELETE FROM products WHERE product = ?', (name,))
+            total -= size
+            removed.append(name)
+    if total > max_bytes:
+        print(f'Store: {total / 1024**3:.1f} GiB referenced, above the budget of {max_bytes / 1024**3:.1f} GiB')
+    return removed
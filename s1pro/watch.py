@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import time
+from pyroSAR import identify
+from spatialist.ancillary import finder
+
+from .s1_slc_proc import S1_SLC_proc, _intersects_aoi
+from .multitemporal import filter_tracks
+
+
+## disk usage of a zip file or .SAFE folder in bytes
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+## .SAFE folders are complete once their manifest is written
+def _complete(path):
+    return not os.path.isdir(path) or os.path.isfile(os.path.join(path, "manifest.safe"))
+
+## acquisition day of a scene from its name, e.g. S1A_IW_SLC__1SDV_20200103T051240_...
+def _name_date(path):
+    match = re.search(r'_(\d{8})T\d{6}_', os.path.basename(path))
+    return match.group(1) if match else None
+
+def _save(state_file, state):
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(state_file + ".tmp", state_file)
+
+
+def S1_watch_proc(proc, interval= 600, state_file= None, once= False, mt_window= 10):
+    """[S1_watch_proc]
+    near-real-time processing of the data folder: every new acquisition is processed as soon as it has landed and
+    its coherence is computed against the previous acquisition of the same relative orbit only
+    Parameters
+    ----------
+        proc: dict
+            arguments of S1_SLC_proc, see the Processing section of the config file
+        interval: int
+            seconds between two scans of the data folder, default is 600
+        state_file: str or None
+            JSON file of the known scenes, default is s1pro_watch.json in the data folder
+        once: bool
+            scan once and return, e.g. for a cron job, default false
+        mt_window: int
+            with mt_speckle, number of latest dates of the relative orbit filtered together after a new date, so
+            the work per date stays bounded, default is 10
+        Returns
+        -------
+        dict of the known scenes
+        Note
+        ----
+        Scenes found at the first start are registered without processing. A scene has landed once its size did not
+        change between two scans, dates with scenes still being written are held back. With split_cache, the split
+        of the previous date is reused, so a new pair only preprocesses the new date.
+    """
+    if proc.get("mt_speckle", False) == True and (proc.get("shapefile") is None or proc.get("grid_align", False) == False):
+        raise ValueError('mt_speckle requires a shapefile and grid_align')
+    data = proc["data"]
+    shapefile = proc.get("shapefile")
+    iws = proc.get("iws", ["IW1", "IW2", "IW3"])
+    pol = proc.get("pol", "full")
+    if state_file is None:
+        state_file = os.path.join(data, "s1pro_watch.json")
+    ##the first scan registers the existing archive
+    baseline = not os.path.isfile(state_file)
+    known = dict()
+    if baseline == False:
+        with open(state_file) as f:
+            known = json.load(f)
+    ##only the latest dates of the relative orbit are filtered after each new date
+    date_proc = dict(proc, coh_proc= False, mt_speckle= False)
+    mt_speckle = proc.get("int_proc", False) == True and proc.get("mt_speckle", False) == True
+    pair_proc = dict(proc, int_proc= False, ha_proc= False, preview_proc= False)
+    sizes = dict()
+
+    while True:
+        in_flight = set()
+        for scene in finder(data, [r'^S1[AB].*(SAFE|zip)$'], regex=True, recursive=True, foldermode=1):
+            if scene in known:
+                continue
+            size = _size(scene)
+            if baseline == True or (sizes.get(scene) == size and _complete(scene)):
+                try:
+                    info = identify(scene)
+                except Exception:
+                    sizes[scene] = size
+                    in_flight.add(_name_date(scene))
+                    continue
+                known[scene] = {"relOrb": info.orbitNumber_rel, "date": info.start[:8],
+                                "aoi": not shapefile or _intersects_aoi(scene, shapefile, iws, pol),
+                                "status": "baseline" if baseline == True else None}
+            else:
+                sizes[scene] = size
+                in_flight.add(_name_date(scene))
+        if baseline == True:
+            print(f'Watch: {len(known)} scenes registered')
+            baseline = False
+        _save(state_file, known)
+
+        groups = dict()
+        for scene, entry in known.items():
+            if entry["aoi"] == True and entry["status"] is None:
+                groups.setdefault((entry["relOrb"], entry["date"]), []).append(scene)
+        for (relOrb, date), group in sorted(groups.items(), key=lambda g: g[0][1]):
+            if date in in_flight:
+                continue
+            print(f'New: relOrb {relOrb} {date}')
+            status = "processed"
+            try:
+                S1_SLC_proc(**date_proc, scenes= sorted(group))
+                if mt_speckle == True:
+                    filter_tracks(proc["outdir_int"], shapefile, [relOrb], pol, size= proc.get("mt_win_size", 5),
+                                  dB= proc.get("l2db_arg", True), threads= proc.get("native_threads", 4), window= mt_window)
+                if proc.get("coh_proc", False) == True:
+                    earlier = [e["date"] for e in known.values() if e["aoi"] == True and e["relOrb"] == relOrb and e["date"] < date]
+                    if len(earlier) > 0:
+                        prev = [s for s, e in known.items() if e["aoi"] == True and e["relOrb"] == relOrb and e["date"] == max(earlier)]
+                        print(f'Pair: relOrb {relOrb} {max(earlier)} {date}')
+                        S1_SLC_proc(**pair_proc, scenes= sorted(prev + group))
+            except Exception as e:
+                ##failed dates are not retried, remove them from the state file to do so
+                print(f'Failed: relOrb {relOrb} {date}: {e}')
+                status = "failed"
+            for scene in group:
+                known[scene]["status"] = status
+            _save(state_file, known)
+
+        if once == True:
+            return known
+        time.sleep(interval)
@@ -19,6 +19,7 @@ setup(
     install_requires=['gdal',
                       'click',
                       'lxml',
+                      'numpy',
                       'pystac',
                       'pyroSAR',
                       'spatialist',
@@ -27,8 +28,10 @@ setup(
                       'pystac',
                       'geopandas',
                       'pandas',
-                      'asf_search'],
+                      'asf_search',
+                      'requests'],
     extras_require={
+          'cube': ['xarray', 'zarr'],
           'docs': ['sphinx', 'sphinxcontrib-bibtex', 'nbsphinx', 'sphinx_rtd_theme', 'sphinx-toolbox'],
     },
     python_requires='>=3.8',
@@ -0,0 +1,60 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class _Handler(BaseHTTPRequestHandler):
+    ##files of the server by path, Range headers are honoured unless the server ignores them
+    def do_GET(self):
+        server = self.server
+        data = server.files.get(self.path)
+        server.log.append((self.path, self.headers.get("Range")))
+        if data is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get("Range") or "")
+        if match is None or server.ranges == False:
+            self._send(200, data)
+            return
+        first, last = match.groups()
+        if first == "":
+            start, end = max(len(data) - int(last), 0), len(data) - 1
+        else:
+            start = int(first)
+            end = min(int(last), len(data) - 1) if last != "" else len(data) - 1
+        if start >= len(data):
+            self.send_response(416)
+            self.send_header("Content-Range", f'bytes */{len(data)}')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._send(206, data[start:end + 1], f'bytes {start}-{end}/{len(data)}')
+
+    def _send(self, status, body, content_range= None):
+        self.send_response(status)
+        if content_range is not None:
+            self.send_header("Content-Range", content_range)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    """ local HTTP server with files (path -> bytes), ranges (honour Range) and log (path, Range) of all requests """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.files = dict()
+    server.ranges = True
+    server.log = []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+
+from s1pro.coherence import coherence
+
+
+def _slc(shape, seed= 0):
+    rng = np.random.default_rng(seed)
+    return (rng.normal(size=shape) + 1j * rng.normal(size=shape)).astype(np.complex64)
+
+
+def test_identical_inputs():
+    master = _slc((60, 45))
+    master[:, :2] = 0
+    windows = [(10, 3), (5, 5)]
+    result = coherence(master, master.copy(), windows, threads=2)
+    for w in windows:
+        np.testing.assert_allclose(result[w][:, 2:], 1, atol=1e-5)
+        ##pixels without data are 0 like in SNAP
+        assert (result[w][:, :2] == 0).all()
+
+
+def test_identical_inputs_with_ref_phase():
+    ##the reference phase of a pure phase ramp between master and slave restores full coherence
+    master = _slc((40, 30))
+    phase = np.linspace(0, 6 * np.pi, 40 * 30).reshape(40, 30).astype(np.float32)
+    slave = master * np.exp(-1j * phase).astype(np.complex64)
+    result = coherence(master, slave, [(10, 3)], ref_phase=phase, threads=1)
+    np.testing.assert_allclose(result[(10, 3)], 1, atol=1e-4)
+
+
+def test_iq_tuple_input():
+    master, slave = _slc((30, 20), 0), _slc((30, 20), 1)
+    windows = [(5, 3)]
+    complex_result = coherence(master, slave, windows, threads=1)
+    iq_result = coherence((master.real, master.imag), (slave.real, slave.imag), windows, threads=1)
+    np.testing.assert_array_equal(iq_result[(5, 3)], complex_result[(5, 3)])
+
+
+def test_independent_of_block_rows():
+    master, slave = _slc((83, 27), 0), _slc((83, 27), 1)
+    slave = 0.7 * master + 0.3 * slave
+    windows = [(10, 3), (7, 9)]
+    reference = coherence(master, slave, windows, block_rows=512, threads=1)
+    assert 0 < reference[(10, 3)].mean() < 1
+    for block_rows in (1, 6, 20):
+        result = coherence(master, slave, windows, block_rows=block_rows, threads=3)
+        for w in windows:
+            np.testing.assert_array_equal(result[w], reference[w])
@@ -0,0 +1,142 @@
+import os
+import io
+import hashlib
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pytest
+import requests
+
+pytest.importorskip("asf_search")
+pytest.importorskip("geopandas")
+pytest.importorskip("pyroSAR")
+from s1pro.download_ASF import download_file, download_partial
+
+
+@pytest.fixture
+def product(http_server):
+    data = os.urandom(300 * 1024)
+    http_server.files["/scene.zip"] = data
+    job = {"url": http_server.url + "/scene.zip", "filename": "scene.zip", "bytes": len(data),
+           "md5": hashlib.md5(data).hexdigest()}
+    return job, data
+
+
+def test_download(tmp_path, product):
+    job, data = product
+    assert download_file(job, str(tmp_path), requests.Session()) == "downloaded"
+    assert (tmp_path / "scene.zip").read_bytes() == data
+    assert download_file(job, str(tmp_path), requests.Session()) == "skipped"
+
+
+def test_resume_part(tmp_path, http_server, product):
+    job, data = product
+    (tmp_path / "scene.zip.part").write_bytes(data[:100000])
+    assert download_file(job, str(tmp_path), requests.Session()) == "downloaded"
+    assert (tmp_path / "scene.zip").read_bytes() == data
+    assert not (tmp_path / "scene.zip.part").exists()
+    assert http_server.log == [("/scene.zip", "bytes=100000-")]
+
+
+def test_resume_ignoring_range(tmp_path, http_server, product):
+    job, data = product
+    http_server.ranges = False
+    (tmp_path / "scene.zip.part").write_bytes(data[:100000])
+    assert download_file(job, str(tmp_path), requests.Session()) == "downloaded"
+    assert (tmp_path / "scene.zip").read_bytes() == data
+
+
+def test_complete_part_416(tmp_path, http_server, product):
+    job, data = product
+    ##without the size the part file is not recognised as complete, the server answers the range with 416
+    job = dict(job, bytes=None)
+    (tmp_path / "scene.zip.part").write_bytes(data)
+    assert download_file(job, str(tmp_path), requests.Session()) == "downloaded"
+    assert (tmp_path / "scene.zip").read_bytes() == data
+    assert http_server.log == [("/scene.zip", f'bytes={len(data)}-')]
+
+
+def test_md5_mismatch(tmp_path, http_server, product):
+    job, data = product
+    job = dict(job, md5=hashlib.md5(b"other").hexdigest())
+    with pytest.raises(IOError):
+        download_file(job, str(tmp_path), requests.Session(), retries=1, backoff=0)
+    assert not (tmp_path / "scene.zip").exists()
+    assert not (tmp_path / "scene.zip.part").exists()
+    assert len(http_server.log) == 2
+
+
+_SAFE = "S1A_IW_SLC__1SDV_20200103T051240_20200103T051307_030626_038264_4F5B.SAFE"
+
+_MANIFEST = """<?xml version="1.0" encoding="UTF-8"?>
+<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1">
+  <informationPackageMap>
+    <xfdu:contentUnit unitType="SAFE Archive Information Package">
+{units}
+    </xfdu:contentUnit>
+  </informationPackageMap>
+  <metadataSection>
+    <metadataObject ID="platform" classification="DESCRIPTION" category="DMD">
+      <metadataWrap mimeType="text/xml"/>
+    </metadataObject>
+{metadata}
+  </metadataSection>
+  <dataObjectSection>
+{objects}
+  </dataObjectSection>
+</xfdu:XFDU>
+"""
+
+
+## zip of a dual-pol SLC with all subswaths, the measurements are stored and the XML files deflated like in ESA zips
+@pytest.fixture
+def slc(http_server):
+    members, units, metadata, objects = dict(), [], [], []
+    for iw in ("iw1", "iw2", "iw3"):
+        for pol in ("vv", "vh"):
+            for folder, ext in (("annotation", "xml"), ("measurement", "tiff")):
+                name = f'{folder}/s1a-{iw}-slc-{pol}-20200103t051241-20200103t051306-030626-038264-004.{ext}'
+                members[name] = os.urandom(5000) if ext == "tiff" else f'<product>{iw} {pol}</product>'.encode() * 50
+                i = f'{folder}{iw}{pol}'
+                units.append(f'      <xfdu:contentUnit unitType="{folder}">\n        <dataObjectPointer dataObjectID="{i}"/>\n      </xfdu:contentUnit>')
+                metadata.append(f'    <metadataObject ID="m{i}" classification="DESCRIPTION" category="DMD">\n      <dataObjectPointer dataObjectID="{i}"/>\n    </metadataObject>')
+                objects.append(f'    <dataObject ID="{i}" repID="{folder}">\n      <byteStream mimeType="text/xml">\n        <fileLocation locatorType="URL" href="./{name}"/>\n      </byteStream>\n    </dataObject>')
+    members["manifest.safe"] = _MANIFEST.format(units="\n".join(units), metadata="\n".join(metadata), objects="\n".join(objects)).encode()
+    members["preview/quick-look.png"] = os.urandom(3000)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(f'{_SAFE}/{name}', data, zipfile.ZIP_STORED if name.endswith("tiff") else zipfile.ZIP_DEFLATED)
+    http_server.files["/slc.zip"] = buf.getvalue()
+    return {"url": http_server.url + "/slc.zip", "filename": _SAFE.replace(".SAFE", ".zip")}, members
+
+
+def test_download_partial(tmp_path, http_server, slc):
+    job, members = slc
+    assert download_partial(job, str(tmp_path), requests.Session(), ["IW2"], ["VV"], threads=2) == "downloaded"
+    safe = tmp_path / _SAFE
+    kept = sorted(str(p.relative_to(safe)) for p in safe.rglob("*") if p.is_file())
+    assert kept == ["annotation/s1a-iw2-slc-vv-20200103t051241-20200103t051306-030626-038264-004.xml", "manifest.safe",
+                    "measurement/s1a-iw2-slc-vv-20200103t051241-20200103t051306-030626-038264-004.tiff"]
+    for name in kept[::2]:
+        assert (safe / name).read_bytes() == members[name]
+    ##one request for the central directory, then one per member
+    assert len(http_server.log) == 4
+    assert download_partial(job, str(tmp_path), requests.Session(), ["IW2"], ["VV"]) == "skipped"
+
+
+def test_download_partial_manifest(tmp_path, slc):
+    job, members = slc
+    download_partial(job, str(tmp_path), requests.Session(), ["IW2"], ["VV"])
+    manifest = (tmp_path / _SAFE / "manifest.safe").read_text()
+    root = ET.fromstring(manifest)
+    hrefs = [e.get("href") for e in root.iter("fileLocation")]
+    assert sorted(hrefs) == ["./annotation/s1a-iw2-slc-vv-20200103t051241-20200103t051306-030626-038264-004.xml",
+                             "./measurement/s1a-iw2-slc-vv-20200103t051241-20200103t051306-030626-038264-004.tiff"]
+    ##every pointer of the metadata and the content units refers to a kept data object
+    objects = {e.get("ID") for e in root.iter("dataObject")}
+    pointers = [e.get("dataObjectID") for e in root.iter("dataObjectPointer")]
+    assert sorted(pointers) == sorted(list(objects) * 2)
+    assert [e.get("ID") for e in root.iter("metadataObject")][0] == "platform"
+    ##the unchanged parts keep their formatting
+    assert manifest.startswith(members["manifest.safe"].decode()[:200])
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+
+from s1pro.halpha import h_alpha, decompose, FEATURES
+
+
+## random hermitian positive semi-definite C2 matrices as sums of outer products of complex vectors
+def _c2(shape, looks= 4, seed= 0):
+    rng = np.random.default_rng(seed)
+    k = rng.normal(size=shape + (looks, 2)) + 1j * rng.normal(size=shape + (looks, 2))
+    c = np.einsum("...li,...lj->...ij", k, np.conj(k)) / looks
+    return c[..., 0, 0].real, c[..., 0, 1].real, c[..., 0, 1].imag, c[..., 1, 1].real
+
+
+def test_h_alpha_matches_eigh():
+    c11, c12_real, c12_imag, c22 = _c2((50, 40))
+    entropy, anisotropy, alpha = h_alpha(c11, c12_real, c12_imag, c22)
+
+    c = np.empty(c11.shape + (2, 2), dtype=np.complex128)
+    c[..., 0, 0] = c11
+    c[..., 0, 1] = c12_real + 1j * c12_imag
+    c[..., 1, 0] = c12_real - 1j * c12_imag
+    c[..., 1, 1] = c22
+    lam, vec = np.linalg.eigh(c)
+    ##eigh sorts ascending, the closed form sorts descending
+    lam, vec = lam[..., ::-1], vec[..., ::-1]
+    p = lam / lam.sum(axis=-1, keepdims=True)
+    alphas = np.degrees(np.arccos(np.clip(np.abs(vec[..., 0, :]), 0, 1)))
+
+    np.testing.assert_allclose(entropy, -(p * np.log2(p)).sum(axis=-1), atol=1e-5)
+    np.testing.assert_allclose(anisotropy, p[..., 0] - p[..., 1], atol=1e-5)
+    np.testing.assert_allclose(alpha, (p * alphas).sum(axis=-1), atol=1e-3)
+
+
+def test_h_alpha_degenerate():
+    ##diagonal matrices and a scaled identity, where one closed-form eigenvector is undefined
+    entropy, anisotropy, alpha = h_alpha(np.array([2.0, 0.0, 1.0, 0.0]), np.zeros(4), np.zeros(4),
+                                         np.array([0.0, 3.0, 1.0, 0.0]))
+    np.testing.assert_allclose(entropy[:3], [0, 0, 1], atol=1e-6)
+    np.testing.assert_allclose(anisotropy[:3], [1, 1, 0], atol=1e-6)
+    np.testing.assert_allclose(alpha[:3], [0, 90, 45], atol=1e-4)
+    assert np.isnan(entropy[3])
+
+
+def test_decompose_independent_of_block_rows():
+    c2 = _c2((97, 31), looks=1, seed=1)
+    ##nodata rows and columns like at the edges of SNAP outputs
+    c2 = tuple(np.where(np.arange(31) < 3, 0, c) for c in c2)
+    reference = decompose(c2, win_size=5, block_rows=512, threads=1)
+    for block_rows in (1, 7, 40):
+        result = decompose(c2, win_size=5, block_rows=block_rows, threads=3)
+        for f in FEATURES:
+            np.testing.assert_array_equal(result[f], reference[f])
+    assert all((reference[f][:, :3] == 0).all() for f in FEATURES)
@@ -0,0 +1,70 @@
+import io
+import os
+import random
+import zipfile
+
+import pytest
+import requests
+
+from s1pro.remote_zip import RemoteFile
+
+
+## zip with stored members of random bytes, large enough to span many blocks
+def _zip(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def members():
+    rng = random.Random(0)
+    return {f'S1A.SAFE/measurement/s1a-iw{i}-slc-vv.tiff': bytes(rng.getrandbits(8) for _ in range(20000)) for i in range(1, 4)}
+
+
+def test_central_directory_one_request(http_server, members):
+    http_server.files["/scene.zip"] = _zip(members)
+    remote = RemoteFile(http_server.url + "/scene.zip", requests.Session(), block_size=64 * 1024)
+    with zipfile.ZipFile(remote) as archive:
+        assert sorted(archive.namelist()) == sorted(members)
+    ##the tail request covers the end of central directory and the central directory
+    assert remote.requests == 1
+
+
+def test_members_with_small_cache(http_server, members):
+    http_server.files["/scene.zip"] = _zip(members)
+    remote = RemoteFile(http_server.url + "/scene.zip", requests.Session(), block_size=1024, max_blocks=8)
+    names = list(members) * 2
+    random.Random(1).shuffle(names)
+    with zipfile.ZipFile(remote) as archive:
+        for name in names:
+            assert archive.read(name) == members[name]
+
+
+def test_reads_across_cached_blocks(http_server):
+    data = os.urandom(64 * 1024)
+    http_server.files["/blob"] = data
+    remote = RemoteFile(http_server.url + "/blob", requests.Session(), block_size=1024, max_blocks=4)
+    ##blocks 1 and 3 are cached, the read of blocks 0 to 3 must not evict them while fetching 0 to 2
+    for pos in (1024, 3072, 40000, 50000, 0):
+        remote.seek(pos)
+        assert remote.read(4096) == data[pos:pos + 4096]
+
+
+def test_server_ignoring_range(http_server, members):
+    http_server.files["/scene.zip"] = _zip(members)
+    http_server.ranges = False
+    with pytest.raises(IOError):
+        RemoteFile(http_server.url + "/scene.zip", requests.Session())
+
+
+def test_large_read_ignoring_range(http_server):
+    data = os.urandom(64 * 1024)
+    http_server.files["/blob"] = data
+    remote = RemoteFile(http_server.url + "/blob", requests.Session(), block_size=1024, max_blocks=4)
+    http_server.ranges = False
+    remote.seek(0)
+    with pytest.raises(IOError):
+        remote.read(16 * 1024)